@@ -0,0 +1,278 @@
+"""
+Admin diagnostics for the skincare database, safe to run against a live database.
+
+Every subcommand runs in a read-only transaction with a statement timeout.
+Summaries are computed with aggregate queries, and row listings are streamed
+from a server-side cursor (yield_per). Listings are keyset-paginated: pass the
+printed --after value to get the next page.
+
+Usage (from backend/):
+    python admin_cli.py counts [--estimate]
+    python admin_cli.py users [--user-id N]
+    python admin_cli.py orphaned-products
+    python admin_cli.py missing-analyses [--backfillable]
+    python admin_cli.py schema
+
+Common options: --format table|ndjson, --limit N (0 = no limit), --after KEY,
+--statement-timeout SECONDS.
+"""
+import argparse
+import sys
+from datetime import date, datetime
+
+import orjson
+from sqlalchemy import text
+
+# Rows fetched from the server-side cursor per round trip
+YIELD_PER = 1000
+
+COUNT_QUERIES = {
+    "users": "SELECT count(*) FROM users",
+    "skincare_entries": "SELECT count(*) FROM skincare_entries",
+    "entries_with_analysis": "SELECT count(*) FROM skincare_entries WHERE analysis_result IS NOT NULL AND analysis_result <> ''",
+    "entries_with_image": "SELECT count(*) FROM skincare_entries WHERE image_path IS NOT NULL",
+    "product_usage": "SELECT count(*) FROM product_usage",
+    "skin_analyses": "SELECT count(*) FROM skin_analyses",
+    "entry_tombstones": "SELECT count(*) FROM entry_tombstones",
+    "product_catalog": "SELECT count(*) FROM product_catalog",
+}
+
+# Planner row estimates: instant on any table size, accurate as of the last ANALYZE
+ESTIMATE_QUERY = """
+SELECT relname AS table, reltuples::bigint AS estimated_rows
+FROM pg_class
+WHERE relkind = 'r' AND relnamespace = 'public'::regnamespace
+ORDER BY relname
+"""
+
+# The page of users is chosen first so the aggregates only cover those users
+USER_SUMMARY_QUERY = """
+WITH page AS (
+    SELECT id, username FROM users
+    WHERE id > :after {user_filter}
+    ORDER BY id
+    {limit}
+),
+entries AS (
+    SELECT user_id, count(*) AS entries, min(date) AS first_entry, max(date) AS last_entry,
+           count(*) FILTER (WHERE analysis_result IS NOT NULL AND analysis_result <> '') AS with_analysis,
+           count(*) FILTER (WHERE image_path IS NOT NULL) AS with_image
+    FROM skincare_entries
+    WHERE user_id IN (SELECT id FROM page)
+    GROUP BY user_id
+),
+products AS (
+    SELECT e.user_id, count(*) AS products
+    FROM product_usage p
+    JOIN skincare_entries e ON e.id = p.entry_id
+    WHERE e.user_id IN (SELECT id FROM page)
+    GROUP BY e.user_id
+),
+analyses AS (
+    SELECT user_id, count(*) AS analyses
+    FROM skin_analyses
+    WHERE user_id IN (SELECT id FROM page)
+    GROUP BY user_id
+)
+SELECT page.id AS user_id, page.username,
+       coalesce(entries.entries, 0) AS entries, entries.first_entry, entries.last_entry,
+       coalesce(entries.with_analysis, 0) AS with_analysis,
+       coalesce(entries.with_image, 0) AS with_image,
+       coalesce(products.products, 0) AS products,
+       coalesce(analyses.analyses, 0) AS analyses
+FROM page
+LEFT JOIN entries ON entries.user_id = page.id
+LEFT JOIN products ON products.user_id = page.id
+LEFT JOIN analyses ON analyses.user_id = page.id
+ORDER BY page.id
+"""
+
+# Rows with no entry_id, or one pointing at a missing entry (e.g. a database
+# restored without its foreign keys)
+ORPHANED_PRODUCTS_QUERY = """
+SELECT p.id, p.entry_id, p.product_name, p.product_type, p.time_of_day
+FROM product_usage p
+LEFT JOIN skincare_entries e ON e.id = p.entry_id
+WHERE e.id IS NULL AND p.id > :after
+ORDER BY p.id
+{limit}
+"""
+
+# --backfillable narrows to entries whose user ran an AI analysis on that day
+MISSING_ANALYSES_QUERY = """
+SELECT e.id, e.user_id, e.date, e.skin_condition, e.image_path IS NOT NULL AS has_image
+FROM skincare_entries e
+WHERE (e.analysis_result IS NULL OR e.analysis_result = '') AND e.id > :after {backfillable}
+ORDER BY e.id
+{limit}
+"""
+
+BACKFILLABLE_FILTER = """
+  AND EXISTS (
+      SELECT 1 FROM skin_analyses a
+      WHERE a.user_id = e.user_id
+        AND a.created_at >= e.date AND a.created_at < e.date + 1
+  )"""
+
+
+def _json_default(value):
+    if isinstance(value, (date, datetime)):
+        return value.isoformat()
+    raise TypeError
+
+
+class Output:
+    """
+    Writes rows as NDJSON (one object per line) or as an aligned table printed
+    in pages, so neither holds more than a page of rows
+    """
+
+    PAGE_SIZE = 50
+
+    def __init__(self, fmt, stream=sys.stdout):
+        self.fmt = fmt
+        self.stream = stream
+        self._page = []
+        self.rows = 0
+
+    def write(self, row):
+        self.rows += 1
+        if self.fmt == "ndjson":
+            self.stream.write(orjson.dumps(row, default=_json_default).decode() + "\n")
+        else:
+            self._page.append(row)
+            if len(self._page) >= self.PAGE_SIZE:
+                self._flush_page()
+
+    def _flush_page(self):
+        if not self._page:
+            return
+        columns = list(self._page[0])
+        cells = [[("" if row[c] is None else str(row[c])) for c in columns] for row in self._page]
+        widths = [max(len(c), *(len(r[i]) for r in cells)) for i, c in enumerate(columns)]
+        self.stream.write("  ".join(c.ljust(w) for c, w in zip(columns, widths)) + "\n")
+        self.stream.write("  ".join("-" * w for w in widths) + "\n")
+        for r in cells:
+            self.stream.write("  ".join(v.ljust(w) for v, w in zip(r, widths)) + "\n")
+        self.stream.write("\n")
+        self._page = []
+
+    def close(self, next_after=None):
+        if self.fmt != "ndjson":
+            self._flush_page()
+            print(f"{self.rows} row(s)", file=sys.stderr)
+        if next_after is not None:
+            print(f"More rows available: rerun with --after {next_after}", file=sys.stderr)
+
+
+def list_rows(conn, out, sql, params, key, limit):
+    """
+    Stream rows from a server-side cursor to out. Returns the keyset value to
+    continue from when the limit cut the listing short, else None.
+    """
+    # Fetch one extra row to learn whether another page exists
+    limit_clause = f"LIMIT {limit + 1}" if limit else ""
+    result = conn.execution_options(stream_results=True, yield_per=YIELD_PER).execute(
+        text(sql.replace("{limit}", limit_clause)), params
+    )
+    last_key = None
+    for index, row in enumerate(result.mappings()):
+        if limit and index == limit:
+            return last_key
+        last_key = row[key]
+        out.write(dict(row))
+    return None
+
+
+def cmd_counts(conn, args, out):
+    if args.estimate:
+        for row in conn.execute(text(ESTIMATE_QUERY)).mappings():
+            out.write(dict(row))
+        return None
+    for name, sql in COUNT_QUERIES.items():
+        out.write({"metric": name, "count": conn.execute(text(sql)).scalar()})
+    return None
+
+
+def cmd_users(conn, args, out):
+    sql = USER_SUMMARY_QUERY.replace("{user_filter}", "AND id = :user_id" if args.user_id else "")
+    return list_rows(conn, out, sql, {"after": args.after, "user_id": args.user_id}, "user_id", args.limit)
+
+
+def cmd_orphaned_products(conn, args, out):
+    return list_rows(conn, out, ORPHANED_PRODUCTS_QUERY, {"after": args.after}, "id", args.limit)
+
+
+def cmd_missing_analyses(conn, args, out):
+    sql = MISSING_ANALYSES_QUERY.replace("{backfillable}", BACKFILLABLE_FILTER if args.backfillable else "")
+    return list_rows(conn, out, sql, {"after": args.after}, "id", args.limit)
+
+
+def cmd_schema(conn, args, out):
+    from sqlalchemy import inspect
+
+    inspector = inspect(conn)
+    for table in sorted(inspector.get_table_names()):
+        for column in inspector.get_columns(table):
+            out.write({
+                "table": table,
+                "column": column["name"],
+                "type": str(column["type"]),
+                "nullable": column["nullable"],
+            })
+    return None
+
+
+COMMANDS = {
+    "counts": cmd_counts,
+    "users": cmd_users,
+    "orphaned-products": cmd_orphaned_products,
+    "missing-analyses": cmd_missing_analyses,
+    "schema": cmd_schema,
+}
+
+
+def build_parser():
+    common = argparse.ArgumentParser(add_help=False)
+    common.add_argument("--format", choices=["table", "ndjson"], default="table")
+    common.add_argument("--limit", type=int, default=None,
+                        help="rows per page (default 200 for table output, unlimited for ndjson; 0 = no limit)")
+    common.add_argument("--after", type=int, default=0, help="keyset cursor printed by the previous page")
+    common.add_argument("--statement-timeout", type=float, default=30.0, help="seconds")
+
+    parser = argparse.ArgumentParser(description="Read-only diagnostics for the skincare database")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    counts = subparsers.add_parser("counts", parents=[common], help="row counts per table and entry coverage")
+    counts.add_argument("--estimate", action="store_true", help="planner estimates instead of exact counts")
+    users = subparsers.add_parser("users", parents=[common], help="per-user entry, product and analysis summaries")
+    users.add_argument("--user-id", type=int)
+    subparsers.add_parser("orphaned-products", parents=[common], help="product_usage rows without an entry")
+    missing = subparsers.add_parser("missing-analyses", parents=[common], help="entries without an AI analysis")
+    missing.add_argument("--backfillable", action="store_true",
+                         help="only entries with a stored skin_analyses row that day")
+    subparsers.add_parser("schema", parents=[common], help="columns of every table")
+    return parser
+
+
+def run(engine, args, stream=sys.stdout):
+    if args.limit is None:
+        args.limit = 0 if args.format == "ndjson" else 200
+    out = Output(args.format, stream)
+    with engine.connect() as conn:
+        conn.execute(text("SET TRANSACTION READ ONLY"))
+        conn.execute(text(f"SET LOCAL statement_timeout = {int(args.statement_timeout * 1000)}"))
+        next_after = COMMANDS[args.command](conn, args, out)
+        conn.rollback()
+    out.close(next_after)
+
+
+def main():
+    args = build_parser().parse_args()
+
+    from db_conn import engine
+
+    run(engine, args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,118 @@
+"""
+Spec table for AILabTools skin analysis results.
+
+One table maps the fields of the API result to the concerns and pore areas
+they report. It drives both the user-facing summary text and structured flag
+extraction, so the live endpoint and backfills of stored results agree.
+"""
+
+import logging
+import re
+
+logger = logging.getLogger(__name__)
+
+SKIN_TYPES = ['Oily', 'Dry', 'Normal', 'Combination']
+
+# (field in the API result, section, label); a field reports its flag when
+# its "value" is 1. Order is the order shown in the summary.
+ANALYSIS_SPEC = (
+    ('acne', 'concerns', 'Acne'),
+    ('eye_pouch', 'concerns', 'Eye Pouches'),
+    ('dark_circle', 'concerns', 'Dark Circles'),
+    ('skin_spot', 'concerns', 'Skin Spots'),
+    ('mole', 'concerns', 'Moles'),
+    ('blackhead', 'concerns', 'Blackheads'),
+    ('forehead_wrinkle', 'concerns', 'Forehead Wrinkles'),
+    ('crows_feet', 'concerns', "Crow's Feet"),
+    ('nasolabial_fold', 'concerns', 'Nasolabial Folds'),
+    ('pores_forehead', 'pores', 'forehead'),
+    ('pores_left_cheek', 'pores', 'left cheek'),
+    ('pores_right_cheek', 'pores', 'right cheek'),
+    ('pores_jaw', 'pores', 'jaw'),
+)
+
+# The spec compiled into one (field, label) tuple per section
+SECTIONS = {
+    section: tuple((field, label) for field, spec_section, label in ANALYSIS_SPEC if spec_section == section)
+    for section in ('concerns', 'pores')
+}
+LABELS = {field: label for field, _, label in ANALYSIS_SPEC}
+
+
+def _label_list(section):
+    label = "|".join(re.escape(label) for _, label in SECTIONS[section])
+    return f"(?:{label})(?:, (?:{label}))*"
+
+
+# Text format_analysis_result produces: a summary line or one of its fallbacks.
+# Anything else in analysis_result was written by a user.
+GENERATED_SUMMARY = re.compile(
+    f"(?:Skin Type: (?:{'|'.join(SKIN_TYPES)}) \\| )?"
+    f"(?:Detected: {_label_list('concerns')}|No major concerns detected)"
+    f"(?: \\| Visible pores on: {_label_list('pores')})?"
+)
+FALLBACK_SUMMARIES = {"Analysis completed successfully", "Analysis completed - see raw data for details"}
+
+
+def extract_analysis_flags(data):
+    """
+    Structured flags from the 'result' object of an AILabTools response:
+    {"skin_type": name or None, "concerns": [fields], "pores": [fields]}
+    """
+    skin_type = None
+    if 'skin_type' in data:
+        skin_type_value = data['skin_type'].get('skin_type', 2)
+        if 0 <= skin_type_value < len(SKIN_TYPES):
+            skin_type = SKIN_TYPES[skin_type_value]
+
+    flags = {"skin_type": skin_type}
+    for section, fields in SECTIONS.items():
+        flags[section] = [field for field, _ in fields if data.get(field, {}).get('value') == 1]
+    return flags
+
+
+def format_analysis_flags(flags):
+    """
+    The summary line shown to users, e.g.
+    "Skin Type: Oily | Detected: Acne, Moles | Visible pores on: jaw"
+    """
+    summary_parts = []
+
+    if flags["skin_type"]:
+        summary_parts.append(f"Skin Type: {flags['skin_type']}")
+
+    if flags["concerns"]:
+        summary_parts.append(f"Detected: {', '.join(LABELS[field] for field in flags['concerns'])}")
+    else:
+        summary_parts.append("No major concerns detected")
+
+    if flags["pores"]:
+        summary_parts.append(f"Visible pores on: {', '.join(LABELS[field] for field in flags['pores'])}")
+
+    return " | ".join(summary_parts)
+
+
+def format_analysis_result(api_response):
+    """
+    Format the AI API response into a user-friendly string
+    """
+    try:
+        # The actual results are in the 'result' key
+        if isinstance(api_response, dict) and 'result' in api_response:
+            return format_analysis_flags(extract_analysis_flags(api_response['result']))
+
+        return "Analysis completed successfully"
+
+    except Exception:
+        logger.exception("Could not format analysis result")
+        return "Analysis completed - see raw data for details"
+
+
+def is_generated_summary(text):
+    """
+    True if text is a summary format_analysis_result could have written, or a
+    raw JSON result stored before summaries existed
+    """
+    if text in FALLBACK_SUMMARIES or GENERATED_SUMMARY.fullmatch(text):
+        return True
+    return text.lstrip().startswith("{") and text.rstrip().endswith("}")
@@ -0,0 +1,341 @@
+"""
+Storage for skin_analyses: JSONB results, partitioned by created_at month.
+
+ensure_analysis_partitions creates the monthly partitions ahead of time (at
+startup, from create_tables.py and periodically from PartitionMaintainer). A
+DEFAULT partition catches rows for any month without one, and their rows are
+moved into the month's partition when it is created. migrate_legacy_analyses converts a legacy
+Text-column table online: a trigger mirrors writes into the new partitioned
+table while existing rows are copied in batches, then a short locked cutover
+swaps the tables. Old months can be detached with archive_partitions and then
+dumped and dropped without touching live data.
+"""
+import logging
+import os
+import threading
+from datetime import date, datetime
+
+from sqlalchemy import MetaData, text
+
+from models import SkinAnalysis, User
+
+logger = logging.getLogger(__name__)
+
+TABLE = "skin_analyses"
+NEW_TABLE = "skin_analyses_new"
+LEGACY_TABLE = "skin_analyses_legacy"
+
+# Months of partitions kept ready beyond the current one
+PARTITION_MONTHS_AHEAD = 3
+
+# Serializes partition maintenance across workers
+PARTITION_LOCK_KEY = 4_731_002
+
+# TOAST compression for results; lz4 needs a server built --with-lz4, otherwise pglz is used
+ANALYSIS_COMPRESSION = os.getenv("ANALYSIS_COMPRESSION", "lz4")
+
+# Legacy rows that aren't valid JSON are kept as {"unparsed": "<original text>"}
+TRY_JSONB_FUNCTION = """
+CREATE OR REPLACE FUNCTION skin_analyses_try_jsonb(value text) RETURNS jsonb AS $$
+BEGIN
+    RETURN value::jsonb;
+EXCEPTION WHEN others THEN
+    RETURN jsonb_build_object('unparsed', value);
+END
+$$ LANGUAGE plpgsql IMMUTABLE
+"""
+
+SYNC_FUNCTION = f"""
+CREATE OR REPLACE FUNCTION skin_analyses_sync() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP IN ('UPDATE', 'DELETE') THEN
+        DELETE FROM {NEW_TABLE} WHERE id = OLD.id AND created_at = OLD.created_at;
+    END IF;
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+        INSERT INTO {NEW_TABLE} (id, user_id, result, created_at)
+        VALUES (NEW.id, NEW.user_id, skin_analyses_try_jsonb(NEW.result), NEW.created_at)
+        ON CONFLICT DO NOTHING;
+    END IF;
+    RETURN NULL;
+END
+$$ LANGUAGE plpgsql
+"""
+
+# FOR SHARE makes a concurrent delete wait for (or be seen by) the batch, so a
+# row deleted mid-copy can't be resurrected in the new table
+COPY_BATCH = f"""
+INSERT INTO {NEW_TABLE} (id, user_id, result, created_at)
+SELECT id, user_id, skin_analyses_try_jsonb(result), created_at
+FROM {TABLE}
+WHERE id >= :low AND id < :high
+FOR SHARE
+ON CONFLICT DO NOTHING
+"""
+
+
+def month_start(value):
+    return date(value.year, value.month, 1)
+
+
+def add_months(value, months):
+    index = value.year * 12 + value.month - 1 + months
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def partition_name(month):
+    # Always named after the final table, so partitions created for
+    # skin_analyses_new keep the right names after the migration cutover
+    return f"{TABLE}_p{month:%Y%m}"
+
+
+DEFAULT_PARTITION = f"{TABLE}_default"
+
+
+def is_partitioned(conn, table=TABLE):
+    return conn.execute(
+        text("SELECT relkind = 'p' FROM pg_class WHERE oid = to_regclass(:table)"), {"table": table}
+    ).scalar()
+
+
+def set_result_compression(conn, table):
+    """
+    Use ANALYSIS_COMPRESSION for the result column, falling back to pglz
+    """
+    try:
+        with conn.begin_nested():
+            conn.execute(text(f"ALTER TABLE {table} ALTER COLUMN result SET COMPRESSION {ANALYSIS_COMPRESSION}"))
+        return ANALYSIS_COMPRESSION
+    except Exception as e:
+        logger.warning("Compression %s unavailable (%s), using pglz", ANALYSIS_COMPRESSION, e.__class__.__name__)
+        conn.execute(text(f"ALTER TABLE {table} ALTER COLUMN result SET COMPRESSION pglz"))
+        return "pglz"
+
+
+def table_exists(conn, name):
+    return conn.execute(text("SELECT to_regclass(:name) IS NOT NULL"), {"name": name}).scalar()
+
+
+def create_default_partition(conn, table):
+    conn.execute(text(f"CREATE TABLE IF NOT EXISTS {DEFAULT_PARTITION} PARTITION OF {table} DEFAULT"))
+
+
+def create_partition(conn, table, month):
+    """
+    Create one month's partition. Rows already in the default partition for
+    that month are moved into it (a plain CREATE ... PARTITION OF would fail on them).
+    """
+    name, start, end = partition_name(month), month, add_months(month, 1)
+    if table_exists(conn, name):
+        return False
+    bounds = {"start": start, "end": end}
+    stranded = table_exists(conn, DEFAULT_PARTITION) and conn.execute(text(
+        f"SELECT 1 FROM {DEFAULT_PARTITION} WHERE created_at >= :start AND created_at < :end LIMIT 1"
+    ), bounds).scalar()
+    if not stranded:
+        conn.execute(text(
+            f"CREATE TABLE IF NOT EXISTS {name} PARTITION OF {table} FOR VALUES FROM ('{start}') TO ('{end}')"
+        ))
+        return True
+    conn.execute(text(f"CREATE TABLE {name} (LIKE {table} INCLUDING DEFAULTS INCLUDING CONSTRAINTS INCLUDING COMPRESSION)"))
+    moved = conn.execute(text(f"""
+        WITH moved AS (
+            DELETE FROM {DEFAULT_PARTITION} WHERE created_at >= :start AND created_at < :end RETURNING *
+        )
+        INSERT INTO {name} SELECT * FROM moved
+    """), bounds).rowcount
+    conn.execute(text(f"ALTER TABLE {table} ATTACH PARTITION {name} FOR VALUES FROM ('{start}') TO ('{end}')"))
+    logger.warning("Moved %d skin_analyses rows from the default partition into %s", moved, name)
+    return True
+
+
+def create_partitions(conn, table, first_month, last_month):
+    """
+    Create monthly partitions of table covering first_month..last_month
+    """
+    month = month_start(first_month)
+    while month <= last_month:
+        create_partition(conn, table, month)
+        month = add_months(month, 1)
+
+
+def ensure_analysis_partitions(engine, months_ahead=PARTITION_MONTHS_AHEAD):
+    """
+    Make sure the default partition and partitions from this month through
+    months_ahead months exist. Does nothing while skin_analyses is still a
+    legacy (unpartitioned) table.
+    """
+    with engine.begin() as conn:
+        if not is_partitioned(conn):
+            return False
+        conn.execute(text("SELECT pg_advisory_xact_lock(:key)"), {"key": PARTITION_LOCK_KEY})
+        create_default_partition(conn, TABLE)
+        today = month_start(datetime.utcnow())
+        create_partitions(conn, TABLE, today, add_months(today, months_ahead))
+    return True
+
+
+class PartitionMaintainer:
+    """
+    Background thread re-running ensure_analysis_partitions every
+    ANALYSIS_PARTITION_CHECK_SECONDS, so long-running servers keep creating
+    partitions as months pass
+    """
+
+    def __init__(self, engine, interval=None):
+        self.engine = engine
+        self.interval = interval if interval is not None else float(os.getenv("ANALYSIS_PARTITION_CHECK_SECONDS", "21600"))
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="analysis-partitions", daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                ensure_analysis_partitions(self.engine)
+            except Exception as e:
+                logger.warning("skin_analyses partition check failed: %s", e)
+
+
+def ensure_analysis_columns(engine):
+    """
+    Add columns introduced after skin_analyses was created (create_all only
+    creates missing tables). Checks first, so the ALTER's lock is only taken once.
+    """
+    with engine.begin() as conn:
+        has_entry_id = conn.execute(text(
+            "SELECT 1 FROM information_schema.columns WHERE table_name = :table AND column_name = 'entry_id'"
+        ), {"table": TABLE}).scalar()
+        if not has_entry_id:
+            conn.execute(text(f"ALTER TABLE {TABLE} ADD COLUMN IF NOT EXISTS entry_id integer"))
+            return True
+    return False
+
+
+def archive_partitions(engine, before):
+    """
+    Detach the monthly partitions that end on or before `before` (a date).
+    The detached tables keep their names and can be dumped and dropped.
+    Returns the detached table names.
+    """
+    # DETACH ... CONCURRENTLY only blocks writes to the partition itself, and
+    # can't run inside a transaction block. Postgres refuses it while a default
+    # partition exists; then a plain DETACH briefly locks the whole table, and
+    # gives up rather than queue behind long transactions.
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        partitions = conn.execute(text("""
+            SELECT c.relname
+            FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid
+            WHERE i.inhparent = to_regclass(:table) AND pg_get_expr(c.relpartbound, c.oid) <> 'DEFAULT'
+            ORDER BY c.relname
+        """), {"table": TABLE}).scalars().all()
+        concurrently = "" if table_exists(conn, DEFAULT_PARTITION) else " CONCURRENTLY"
+        if not concurrently:
+            conn.execute(text("SET lock_timeout = '5s'"))
+
+        detached = []
+        cutoff = month_start(before)
+        for name in partitions:
+            month = datetime.strptime(name.rsplit("_p", 1)[1], "%Y%m").date()
+            if add_months(month, 1) > cutoff:
+                continue
+            conn.execute(text(f"ALTER TABLE {TABLE} DETACH PARTITION {name}{concurrently}"))
+            detached.append(name)
+        conn.execute(text("RESET lock_timeout"))
+    return detached
+
+
+def create_new_table(conn, first_month, last_month):
+    """
+    Create skin_analyses_new from the SkinAnalysis model, with its indexes,
+    compression and partitions
+    """
+    metadata = MetaData()
+    User.__table__.to_metadata(metadata)
+    table = SkinAnalysis.__table__.to_metadata(metadata, name=NEW_TABLE)
+    table.create(conn, checkfirst=True)
+    compression = set_result_compression(conn, NEW_TABLE)
+    create_default_partition(conn, NEW_TABLE)
+    create_partitions(conn, NEW_TABLE, first_month, last_month)
+    return compression
+
+
+def migrate_legacy_analyses(engine, batch_size=10000, progress=print):
+    """
+    Convert a legacy skin_analyses table (Text result, unpartitioned) in place
+    while the application keeps reading and writing it. Safe to rerun after an
+    interruption. Returns the number of rows in the migrated table.
+    """
+    with engine.begin() as conn:
+        if is_partitioned(conn):
+            progress("skin_analyses is already partitioned")
+            return None
+        # Wait out in-flight writes so every row is either below high_id or
+        # written after the sync trigger exists
+        conn.execute(text(f"LOCK TABLE {TABLE} IN SHARE ROW EXCLUSIVE MODE"))
+        low_id, high_id, first_created = conn.execute(
+            text(f"SELECT min(id), max(id), min(created_at) FROM {TABLE}")
+        ).one()
+
+        today = month_start(datetime.utcnow())
+        conn.execute(text(TRY_JSONB_FUNCTION))
+        compression = create_new_table(
+            conn, month_start(first_created or today), add_months(today, PARTITION_MONTHS_AHEAD)
+        )
+        progress(f"Created {NEW_TABLE} (result compression: {compression})")
+
+        # From here on, every write to the legacy table is mirrored
+        conn.execute(text(SYNC_FUNCTION))
+        conn.execute(text(f"DROP TRIGGER IF EXISTS skin_analyses_sync ON {TABLE}"))
+        conn.execute(text(
+            f"CREATE TRIGGER skin_analyses_sync AFTER INSERT OR UPDATE OR DELETE ON {TABLE} "
+            f"FOR EACH ROW EXECUTE FUNCTION skin_analyses_sync()"
+        ))
+
+    # Copy the rows that existed before the trigger, one short transaction per batch
+    copied = 0
+    if low_id is not None:
+        for batch_low in range(low_id, high_id + 1, batch_size):
+            with engine.begin() as conn:
+                copied += conn.execute(
+                    text(COPY_BATCH), {"low": batch_low, "high": batch_low + batch_size}
+                ).rowcount
+            progress(f"  copied ids < {min(batch_low + batch_size, high_id + 1)} ({copied} rows)")
+
+    # Swap the tables under a brief exclusive lock
+    with engine.begin() as conn:
+        conn.execute(text(f"LOCK TABLE {TABLE} IN ACCESS EXCLUSIVE MODE"))
+        legacy_rows = conn.execute(text(f"SELECT count(*) FROM {TABLE}")).scalar()
+        new_rows = conn.execute(text(f"SELECT count(*) FROM {NEW_TABLE}")).scalar()
+        if legacy_rows != new_rows:
+            raise RuntimeError(f"Row counts differ ({legacy_rows} legacy, {new_rows} new); not swapping")
+
+        old_sequence = conn.execute(text(f"SELECT pg_get_serial_sequence('{TABLE}', 'id')")).scalar()
+        new_sequence = conn.execute(text(f"SELECT pg_get_serial_sequence('{NEW_TABLE}', 'id')")).scalar()
+        conn.execute(text(
+            f"SELECT setval('{new_sequence}', greatest((SELECT last_value FROM {old_sequence}), "
+            f"(SELECT coalesce(max(id), 1) FROM {NEW_TABLE})))"
+        ))
+
+        conn.execute(text(f"DROP TRIGGER skin_analyses_sync ON {TABLE}"))
+        conn.execute(text(f"ALTER TABLE {TABLE} RENAME TO {LEGACY_TABLE}"))
+        conn.execute(text(f"ALTER TABLE {NEW_TABLE} RENAME TO {TABLE}"))
+        for old_name, new_name in (
+            (f"{TABLE}_pkey", f"{LEGACY_TABLE}_pkey"),
+            (f"{TABLE}_user_id_fkey", f"{LEGACY_TABLE}_user_id_fkey"),
+        ):
+            conn.execute(text(f"ALTER TABLE {LEGACY_TABLE} RENAME CONSTRAINT {old_name} TO {new_name}"))
+        conn.execute(text(f"ALTER TABLE {TABLE} RENAME CONSTRAINT {NEW_TABLE}_pkey TO {TABLE}_pkey"))
+        conn.execute(text(f"ALTER TABLE {TABLE} RENAME CONSTRAINT {NEW_TABLE}_user_id_fkey TO {TABLE}_user_id_fkey"))
+        conn.execute(text(f"ALTER SEQUENCE {old_sequence} RENAME TO {LEGACY_TABLE}_id_seq"))
+        conn.execute(text(f"ALTER SEQUENCE {new_sequence} RENAME TO {TABLE}_id_seq"))
+        conn.execute(text("DROP FUNCTION skin_analyses_sync()"))
+        conn.execute(text("DROP FUNCTION skin_analyses_try_jsonb(text)"))
+
+    progress(f"Swapped tables; {new_rows} rows now in partitioned {TABLE}, old table kept as {LEGACY_TABLE}")
+    return new_rows
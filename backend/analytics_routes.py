@@ -1,97 +1,159 @@
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Query
+from fastapi.responses import ORJSONResponse
 from sqlalchemy.orm import Session
-from sqlalchemy import func, and_, case, desc
-from db_conn import SessionLocal
+from sqlalchemy import func, and_, case, desc, text
+from sqlalchemy.exc import ProgrammingError
+from db_conn import read_session
 from models import SkinCareEntry, ProductUsage
 from datetime import date, datetime, timedelta
-from typing import Optional
+from typing import Optional, List, Dict, Literal, Union
+from pydantic import BaseModel
+from response_cache import analytics_cache
+from product_usage_counters import top_products
+from trend_engine import DEFAULT_LONG_WINDOW, DEFAULT_SHORT_WINDOW, compute_concern_trends
 
 router = APIRouter(prefix="/skincare/analytics", tags=["analytics"])
 
-# Dependency
+# Response models for the overview. They document the response shape only: the
+# endpoint returns an ORJSONResponse directly so the (potentially year-long)
+# entries_over_time list is not re-validated or run through jsonable_encoder
+class TimePeriod(BaseModel):
+    days: int
+    start_date: str
+    end_date: str
+    granularity: Optional[str] = None
+
+class Consistency(BaseModel):
+    percentage: int
+    streak: int
+    total_days: int
+    completed_days: int
+    missed_days: int
+
+class SkinTrends(BaseModel):
+    most_common_condition: Optional[str]
+    condition_distribution: Dict[str, int]
+    total_entries: int
+    entries_with_ai_analysis: int
+
+class ProductUsageStat(BaseModel):
+    name: str
+    uses: int
+    percentage: int
+
+class EntryOverTime(BaseModel):
+    date: str
+    skin_condition: Optional[str]
+    has_analysis: bool
+    product_count: int
+
+class EntryBucket(BaseModel):
+    date: str  # start of the day/week/month bucket
+    entries: int
+    entries_with_analysis: int
+    product_count: int
+    conditions: Dict[str, int]
+
+class AnalyticsOverviewResponse(BaseModel):
+    time_period: TimePeriod
+    consistency: Consistency
+    skin_trends: SkinTrends
+    product_usage: List[ProductUsageStat]
+    entries_over_time: Union[List[EntryOverTime], List[EntryBucket]]
+
+# TODO: Replace with actual auth
+def get_current_user_id():
+    return 1
+
+# Dependency: every analytics endpoint is read-only, so it reads from the
+# replica unless the user has just written
 def get_db():
-    db = SessionLocal()
+    db = read_session(get_current_user_id())
     try:
         yield db
     finally:
         db.close()
 
-# TODO: Replace with actual auth
-def get_current_user_id():
-    return 1
-
-@router.get("/overview")
+@router.get("/overview", response_model=AnalyticsOverviewResponse)
 async def get_analytics_overview(
     days: Optional[int] = 30,
+    granularity: Optional[Literal["day", "week", "month"]] = None,
     db: Session = Depends(get_db)
 ):
     """
-    Get comprehensive analytics for the dashboard
+    Get comprehensive analytics for the dashboard.
+    With granularity=day|week|month, entries_over_time is bucketed in SQL
+    (one point per bucket) instead of listing every entry.
     """
     user_id = get_current_user_id()
-    
+    return ORJSONResponse(analytics_cache.get_or_compute(
+        db, user_id, "overview", {"days": days, "granularity": granularity},
+        lambda: build_analytics_overview(db, user_id, days, granularity)
+    ))
+
+def build_analytics_overview(db: Session, user_id: int, days: int, granularity: Optional[str] = None):
+    """
+    Compute the dashboard analytics for a user (uncached)
+    """
     # Calculate date range
     end_date = date.today()
     start_date = end_date - timedelta(days=days)
-    
-    # Get all entries in range
-    entries = db.query(SkinCareEntry).filter(
+    in_range = and_(
         SkinCareEntry.user_id == user_id,
         SkinCareEntry.date >= start_date,
         SkinCareEntry.date <= end_date
-    ).order_by(SkinCareEntry.date).all()
+    )
+    has_ai_analysis = and_(SkinCareEntry.analysis_result.isnot(None), SkinCareEntry.analysis_result != '')
+    
+    # Entry counts per skin condition, aggregated in SQL
+    condition_stats = db.query(
+        SkinCareEntry.skin_condition,
+        func.count(SkinCareEntry.id).label('entry_count'),
+        func.count(case((has_ai_analysis, 1))).label('analysis_count')
+    ).filter(in_range).group_by(SkinCareEntry.skin_condition).all()
     
     # Calculate streak
     streak = calculate_streak(db, user_id)
     
     # Calculate consistency
     total_days = days
-    completed_days = len(entries)
+    completed_days = sum(stat.entry_count for stat in condition_stats)
     consistency_percentage = round((completed_days / total_days) * 100) if total_days > 0 else 0
     
     # Get skin condition trends
-    skin_conditions = {}
-    for entry in entries:
-        if entry.skin_condition:
-            skin_conditions[entry.skin_condition] = skin_conditions.get(entry.skin_condition, 0) + 1
+    skin_conditions = {
+        stat.skin_condition: stat.entry_count
+        for stat in condition_stats
+        if stat.skin_condition
+    }
     
     # Most common skin condition
     most_common_condition = max(skin_conditions.items(), key=lambda x: x[1])[0] if skin_conditions else None
     
     # Calculate AI analysis trends (simplified mock for now)
-    ai_analyses = [e for e in entries if e.analysis_result]
-    has_ai_data = len(ai_analyses) > 0
-    
-    # Product usage stats
-    product_stats = db.query(
-        ProductUsage.product_name,
-        func.count(ProductUsage.id).label('usage_count')
-    ).join(
-        SkinCareEntry, ProductUsage.entry_id == SkinCareEntry.id
-    ).filter(
-        SkinCareEntry.user_id == user_id,
-        SkinCareEntry.date >= start_date,
-        SkinCareEntry.date <= end_date
-    ).group_by(
-        ProductUsage.product_name
-    ).order_by(
-        desc('usage_count')
-    ).limit(10).all()
+    ai_analysis_count = sum(stat.analysis_count for stat in condition_stats)
     
+    # Top products from the per-day usage counters (names normalized)
     product_usage = [
         {
-            "name": stat.product_name,
-            "uses": stat.usage_count,
-            "percentage": round((stat.usage_count / completed_days) * 100) if completed_days > 0 else 0
+            "name": name,
+            "uses": uses,
+            "percentage": round((uses / completed_days) * 100) if completed_days > 0 else 0
         }
-        for stat in product_stats
+        for name, uses in top_products(db, user_id, start_date, end_date, limit=10)
     ]
     
+    if granularity:
+        entries_over_time = get_entry_buckets(db, in_range, has_ai_analysis, granularity)
+    else:
+        entries_over_time = get_entries_over_time(db, in_range)
+    
     return {
         "time_period": {
             "days": days,
             "start_date": str(start_date),
-            "end_date": str(end_date)
+            "end_date": str(end_date),
+            "granularity": granularity
         },
         "consistency": {
             "percentage": consistency_percentage,
@@ -103,21 +165,78 @@ async def get_analytics_overview(
         "skin_trends": {
             "most_common_condition": most_common_condition,
             "condition_distribution": skin_conditions,
-            "total_entries": len(entries),
-            "entries_with_ai_analysis": len(ai_analyses)
+            "total_entries": completed_days,
+            "entries_with_ai_analysis": ai_analysis_count
         },
         "product_usage": product_usage,
-        "entries_over_time": [
-            {
-                "date": str(e.date),
-                "skin_condition": e.skin_condition,
-                "has_analysis": e.analysis_result is not None,
-                "product_count": len(e.products)
-            }
-            for e in entries
-        ]
+        "entries_over_time": entries_over_time
     }
 
+def get_entries_over_time(db: Session, in_range):
+    """
+    One point per entry; product counts come from a join rather than lazy loads
+    """
+    rows = db.query(
+        SkinCareEntry.date,
+        SkinCareEntry.skin_condition,
+        SkinCareEntry.analysis_result.isnot(None).label('has_analysis'),
+        func.count(ProductUsage.id).label('product_count')
+    ).outerjoin(
+        ProductUsage, ProductUsage.entry_id == SkinCareEntry.id
+    ).filter(
+        in_range
+    ).group_by(
+        SkinCareEntry.id, SkinCareEntry.date, SkinCareEntry.skin_condition, SkinCareEntry.analysis_result.isnot(None)
+    ).order_by(SkinCareEntry.date).all()
+    
+    return [
+        {
+            "date": str(row.date),
+            "skin_condition": row.skin_condition,
+            "has_analysis": row.has_analysis,
+            "product_count": row.product_count
+        }
+        for row in rows
+    ]
+
+def get_entry_buckets(db: Session, in_range, has_ai_analysis, granularity: str):
+    """
+    One point per day/week/month bucket, with entry, analysis, product and
+    per-condition counts computed in SQL (date_trunc + GROUP BY)
+    """
+    bucket = func.date_trunc(granularity, SkinCareEntry.date).label('bucket')
+    rows = db.query(
+        bucket,
+        SkinCareEntry.skin_condition,
+        func.count(func.distinct(SkinCareEntry.id)).label('entry_count'),
+        func.count(func.distinct(case((has_ai_analysis, SkinCareEntry.id)))).label('analysis_count'),
+        func.count(ProductUsage.id).label('product_count')
+    ).outerjoin(
+        ProductUsage, ProductUsage.entry_id == SkinCareEntry.id
+    ).filter(
+        in_range
+    ).group_by(
+        bucket, SkinCareEntry.skin_condition
+    ).order_by(bucket).all()
+    
+    # Rows are (bucket, condition) pairs; fold the few per bucket together
+    buckets = {}
+    for row in rows:
+        point = buckets.setdefault(row.bucket, {
+            "date": str(row.bucket.date() if isinstance(row.bucket, datetime) else row.bucket),
+            "entries": 0,
+            "entries_with_analysis": 0,
+            "product_count": 0,
+            "conditions": {}
+        })
+        point["entries"] += row.entry_count
+        point["entries_with_analysis"] += row.analysis_count
+        point["product_count"] += row.product_count
+        if row.skin_condition:
+            point["conditions"][row.skin_condition] = row.entry_count
+    
+    return list(buckets.values())
+
 def calculate_streak(db: Session, user_id: int) -> int:
     """
     Calculate current streak of consecutive days with entries
@@ -154,83 +273,56 @@ def calculate_streak(db: Session, user_id: int) -> int:
 @router.get("/skin-progress")
 async def get_skin_progress(
     days: Optional[int] = 30,
+    short_window: int = Query(DEFAULT_SHORT_WINDOW, ge=1, le=365),
+    long_window: int = Query(DEFAULT_LONG_WINDOW, ge=1, le=365),
     db: Session = Depends(get_db)
 ):
     """
     Get skin progress metrics over time
-    This analyzes AI analysis results to track improvements
+    This analyzes AI analysis results to track improvements: rolling concern
+    rates over short_window and long_window days, and a fitted trend per concern
     """
-    user_id = get_current_user_id()
+    if short_window > long_window:
+        raise HTTPException(status_code=400, detail="short_window must not exceed long_window")
     
+    user_id = get_current_user_id()
+    # Only the default windows are cached; custom ones are computed per request
+    if (short_window, long_window) != (DEFAULT_SHORT_WINDOW, DEFAULT_LONG_WINDOW):
+        return build_skin_progress(db, user_id, days, short_window, long_window)
+    return analytics_cache.get_or_compute(
+        db, user_id, "skin-progress", {"days": days},
+        lambda: build_skin_progress(db, user_id, days)
+    )
+
+def build_skin_progress(db: Session, user_id: int, days: int,
+                        short_window: int = DEFAULT_SHORT_WINDOW, long_window: int = DEFAULT_LONG_WINDOW):
+    """
+    Compute skin progress metrics for a user (uncached)
+    """
     end_date = date.today()
     start_date = end_date - timedelta(days=days)
     
-    # Get entries with AI analysis
-    entries = db.query(SkinCareEntry).filter(
-        SkinCareEntry.user_id == user_id,
-        SkinCareEntry.date >= start_date,
-        SkinCareEntry.date <= end_date,
-        SkinCareEntry.analysis_result.isnot(None)
-    ).order_by(SkinCareEntry.date).all()
+    series, metrics = compute_concern_trends(db, user_id, start_date, end_date, short_window, long_window)
     
-    if not entries:
+    if not series:
         return {
             "message": "No AI analysis data available for this period",
             "metrics": {}
         }
     
-    # Analyze AI results for trends
-    # Look for keywords in analysis results
-    concern_keywords = {
-        'acne': ['acne', 'breakout', 'pimple', 'blemish'],
-        'dark_circles': ['dark circle', 'under eye'],
-        'wrinkles': ['wrinkle', 'fine line', 'crow'],
-        'spots': ['spot', 'pigment', 'hyperpigment'],
-        'pores': ['pore', 'enlarged pore']
-    }
-    
-    # Count occurrences over time
-    concern_counts = {key: [] for key in concern_keywords}
-    dates = []
-    
-    for entry in entries:
-        analysis_lower = entry.analysis_result.lower()
-        dates.append(str(entry.date))
-        
-        for concern, keywords in concern_keywords.items():
-            detected = any(keyword in analysis_lower for keyword in keywords)
-            concern_counts[concern].append(1 if detected else 0)
-    
-    # Calculate trend for each concern
-    metrics = {}
-    for concern, counts in concern_counts.items():
-        if not counts:
-            continue
-            
-        # Compare first half vs second half
-        mid_point = len(counts) // 2
-        if mid_point > 0:
-            first_half_avg = sum(counts[:mid_point]) / mid_point
-            second_half_avg = sum(counts[mid_point:]) / (len(counts) - mid_point)
-            
-            # Calculate change (negative means improvement for skin concerns)
-            change = ((second_half_avg - first_half_avg) / max(first_half_avg, 0.01)) * 100
-            current_score = max(0, 100 - (second_half_avg * 100))  # Higher score = better
-            
-            metrics[concern] = {
-                "current": round(current_score),
-                "change": round(-change),  # Negative change in concerns = positive change in score
-                "trend": "improving" if change < 0 else "worsening" if change > 0 else "stable"
-            }
-    
     return {
         "time_period": {
             "days": days,
             "start_date": str(start_date),
             "end_date": str(end_date)
         },
+        "windows": {
+            "short": short_window,
+            "long": long_window
+        },
         "metrics": metrics,
-        "total_analyses": len(entries)
+        "series": series,
+        "total_analyses": len(series)
     }
 
 @router.get("/product-effectiveness")
@@ -242,7 +334,15 @@ async def get_product_effectiveness(
     Analyze which products correlate with better skin conditions
     """
     user_id = get_current_user_id()
-    
+    return analytics_cache.get_or_compute(
+        db, user_id, "product-effectiveness", {"days": days},
+        lambda: build_product_effectiveness(db, user_id, days)
+    )
+
+def build_product_effectiveness(db: Session, user_id: int, days: int):
+    """
+    Compute product effectiveness for a user (uncached)
+    """
     end_date = date.today()
     start_date = end_date - timedelta(days=days)
     
@@ -315,4 +415,75 @@ async def get_product_effectiveness(
             "end_date": str(end_date)
         },
         "products": results
+    }
+
+@router.get("/cache/stats")
+async def get_cache_stats():
+    """
+    Hit/miss counts and hit ratio of the analytics response cache per endpoint
+    """
+    return analytics_cache.stats()
+
+# Cohort (cross-user) analytics. These read only the materialized views in
+# cohort_analytics.py, which are refreshed in the background
+@router.get("/cohort/products-by-condition")
+async def get_cohort_products_by_condition(
+    condition: Optional[str] = None,
+    limit: int = 10,
+    db: Session = Depends(get_db)
+):
+    """
+    Most-used products per skin condition across all users
+    """
+    try:
+        rows = db.execute(text("""
+            SELECT skin_condition, product_name, usage_count, user_count
+            FROM (
+                SELECT *, row_number() OVER (
+                    PARTITION BY skin_condition ORDER BY usage_count DESC, product_name
+                ) AS rank
+                FROM mv_product_usage_by_condition
+                WHERE CAST(:condition AS TEXT) IS NULL OR skin_condition = :condition
+            ) ranked
+            WHERE rank <= :limit
+            ORDER BY skin_condition, rank
+        """), {"condition": condition, "limit": limit}).all()
+    except ProgrammingError:
+        raise HTTPException(status_code=503, detail="Cohort views have not been created yet")
+    
+    conditions = {}
+    for row in rows:
+        conditions.setdefault(row.skin_condition, []).append({
+            "product_name": row.product_name,
+            "uses": row.usage_count,
+            "users": row.user_count
+        })
+    
+    return {"conditions": conditions}
+
+@router.get("/cohort/streaks")
+async def get_cohort_streaks(db: Session = Depends(get_db)):
+    """
+    Average current and longest streak per signup-month cohort
+    """
+    try:
+        rows = db.execute(text("""
+            SELECT cohort_month, users, avg_current_streak, avg_longest_streak, max_longest_streak
+            FROM mv_cohort_streaks
+            ORDER BY cohort_month
+        """)).all()
+    except ProgrammingError:
+        raise HTTPException(status_code=503, detail="Cohort views have not been created yet")
+    
+    return {
+        "cohorts": [
+            {
+                "cohort_month": str(row.cohort_month),
+                "users": row.users,
+                "avg_current_streak": round(row.avg_current_streak, 2),
+                "avg_longest_streak": round(row.avg_longest_streak, 2),
+                "max_longest_streak": row.max_longest_streak
+            }
+            for row in rows
+        ]
     }
\ No newline at end of file
@@ -0,0 +1,188 @@
+"""
+Re-derive skincare_entries.analysis_result from the raw AILabTools JSON stored
+in skin_analyses.result, e.g. after the analysis spec or summary wording changes.
+
+Each entry gets the summary of the latest analysis linked to it through
+skin_analyses.entry_id. Analyses stored before that column existed have no
+link; --match-by-day also pairs those with the entry their user logged on the
+analysis's UTC day, which is a guess (the entry date the client asked for may
+differ, and the user ids only line up once analyses record the real user).
+
+By default only entries whose analysis_result is empty or was itself generated
+(a summary line, one of its fallbacks or a raw JSON blob) are rewritten; text a
+user entered through PUT /entries is reported as a conflict and kept unless
+--overwrite is given. --dry-run formats and classifies everything, reports the
+conflicts and writes nothing.
+
+Rows are streamed from a server-side cursor in chunks, formatted across a
+process pool and written back with one set-based UPDATE per chunk.
+
+Usage (from backend/):
+    python backfill_analysis.py [--workers 8] [--chunk-size 5000] [--match-by-day] [--overwrite] [--dry-run]
+
+Entries updated here get a new updated_at, so clients pick them up on their next
+delta sync. Running servers keep cached analytics until the next day's cache key.
+"""
+import argparse
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import orjson
+from sqlalchemy import text
+
+from analysis_format import format_analysis_result, is_generated_summary
+
+# Latest analysis per entry, linked analyses taking precedence over day matches.
+# Results are read as text so the JSON is parsed in the workers, and legacy rows
+# that were never valid JSON (stored as {"unparsed": ...}) are skipped
+LATEST_ANALYSES_SQL = """
+SELECT DISTINCT ON (entry_id) entry_id, result
+FROM (
+    SELECT entry_id, created_at, result::text AS result, true AS linked
+    FROM skin_analyses
+    WHERE entry_id IS NOT NULL AND result IS NOT NULL AND NOT result ? 'unparsed'
+    {unlinked}
+) analyses
+ORDER BY entry_id, linked DESC, created_at DESC
+"""
+
+UNLINKED_BY_DAY_SQL = """
+    UNION ALL
+    SELECT e.id, a.created_at, a.result::text, false
+    FROM skin_analyses a
+    JOIN skincare_entries e ON e.user_id = a.user_id AND e.date = a.created_at::date
+    WHERE a.entry_id IS NULL AND a.result IS NOT NULL AND NOT a.result ? 'unparsed'
+"""
+
+# Locks the entries so a concurrent PUT can't land between classifying and writing
+CURRENT_RESULTS_SQL = """
+SELECT id, analysis_result FROM skincare_entries WHERE id = ANY(CAST(:entry_ids AS integer[])) FOR UPDATE
+"""
+
+BULK_UPDATE_SQL = """
+UPDATE skincare_entries e
+SET analysis_result = v.summary,
+    updated_at = timezone('utc', now())
+FROM unnest(CAST(:entry_ids AS integer[]), CAST(:summaries AS text[])) AS v(entry_id, summary)
+WHERE e.id = v.entry_id
+"""
+
+# Conflicts printed in full during a dry run
+CONFLICT_SAMPLES = 20
+
+
+def format_chunk(rows):
+    """
+    Worker: [(entry_id, result JSON)] -> [(entry_id, summary)]
+    """
+    formatted = []
+    for entry_id, result in rows:
+        try:
+            api_response = orjson.loads(result)
+        except orjson.JSONDecodeError:
+            continue
+        formatted.append((entry_id, format_analysis_result(api_response)))
+    return formatted
+
+
+def classify(current, summary, overwrite=False):
+    """
+    "unchanged", "update" or "conflict" for an entry's current analysis_result
+    """
+    if current == summary:
+        return "unchanged"
+    if current is None or overwrite or is_generated_summary(current):
+        return "update"
+    return "conflict"
+
+
+def stream_chunks(conn, chunk_size, match_by_day=False):
+    sql = LATEST_ANALYSES_SQL.replace("{unlinked}", UNLINKED_BY_DAY_SQL if match_by_day else "")
+    result = conn.execution_options(stream_results=True, yield_per=chunk_size).execute(text(sql))
+    for partition in result.partitions(chunk_size):
+        yield [tuple(row) for row in partition]
+
+
+def write_chunk(engine, formatted, overwrite=False, dry_run=False):
+    """
+    Returns (entries updated, [(entry_id, current text, summary)] conflicts)
+    """
+    summaries = dict(formatted)
+    with engine.begin() as conn:
+        current = dict(conn.execute(text(CURRENT_RESULTS_SQL), {"entry_ids": list(summaries)}).all())
+        updates, conflicts = [], []
+        for entry_id, text_now in current.items():
+            outcome = classify(text_now, summaries[entry_id], overwrite)
+            if outcome == "update":
+                updates.append(entry_id)
+            elif outcome == "conflict":
+                conflicts.append((entry_id, text_now, summaries[entry_id]))
+        if updates and not dry_run:
+            conn.execute(text(BULK_UPDATE_SQL), {
+                "entry_ids": updates,
+                "summaries": [summaries[entry_id] for entry_id in updates],
+            })
+    return len(updates), conflicts
+
+
+def backfill(engine, workers, chunk_size, dry_run=False, overwrite=False, match_by_day=False):
+    """
+    Returns (analyses read, entries updated, [(entry_id, current text, summary)] conflicts).
+    In a dry run "updated" counts the entries that would be.
+    """
+    read = updated = 0
+    conflicts = []
+    pending = []
+    started = time.perf_counter()
+
+    def drain(future):
+        nonlocal updated
+        formatted = future.result()
+        if formatted:
+            chunk_updated, chunk_conflicts = write_chunk(engine, formatted, overwrite, dry_run)
+            updated += chunk_updated
+            conflicts.extend(chunk_conflicts)
+
+    with engine.connect() as read_conn, ProcessPoolExecutor(max_workers=workers) as pool:
+        for chunk in stream_chunks(read_conn, chunk_size, match_by_day):
+            read += len(chunk)
+            pending.append(pool.submit(format_chunk, chunk))
+            # Bound the chunks held in memory: wait for the oldest once every worker has a spare queued
+            if len(pending) >= workers * 2:
+                drain(pending.pop(0))
+            print(f"  read {read} analyses, updated {updated} entries ({read / (time.perf_counter() - started):.0f} rows/s)")
+        for future in pending:
+            drain(future)
+
+    return read, updated, conflicts
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--chunk-size", type=int, default=5000)
+    parser.add_argument("--match-by-day", action="store_true",
+                        help="also match analyses without an entry link to the entry logged on their day")
+    parser.add_argument("--overwrite", action="store_true", help="replace user-written analysis text too")
+    parser.add_argument("--dry-run", action="store_true", help="format and classify everything but write nothing")
+    args = parser.parse_args()
+
+    from db_conn import engine
+
+    started = time.perf_counter()
+    read, updated, conflicts = backfill(
+        engine, args.workers, args.chunk_size, args.dry_run, args.overwrite, args.match_by_day
+    )
+    elapsed = time.perf_counter() - started
+    print(f"Read {read} analyses, {'would update' if args.dry_run else 'updated'} {updated} entries in {elapsed:.1f}s"
+          + (" (dry run)" if args.dry_run else ""))
+    if conflicts:
+        print(f"{len(conflicts)} entries have user-written analysis text and were left alone (--overwrite replaces it)")
+        if args.dry_run:
+            for entry_id, current, summary in conflicts[:CONFLICT_SAMPLES]:
+                print(f"  entry {entry_id}: {current!r} -> {summary!r}")
+
+
+if __name__ == "__main__":
+    main()
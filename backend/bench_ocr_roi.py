@@ -0,0 +1,172 @@
+"""
+Accuracy / latency report for OCR preprocessing with and without cropping to
+the detected ingredient block (extract_text.detect_text_region).
+
+Fixtures are label images with a sibling .txt file holding the expected
+ingredient list (one per line or comma separated). Without --fixtures, a set
+of synthetic labels (packaging art plus an ingredient panel) is generated.
+OCR accuracy is only reported when the tesseract binary is available.
+
+Usage: python bench_ocr_roi.py [--fixtures DIR] [--count 10]
+"""
+import argparse
+import os
+import random
+import re
+import shutil
+import tempfile
+import time
+
+import cv2
+import numpy as np
+
+from extract_text import detect_text_region, preprocess_for_ocr
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".bmp", ".webp")
+
+
+def load_ingredient_names():
+    with open("./ingredients/ingredient_dictionary.txt", "r") as f:
+        return [line.strip() for line in f if line.strip()]
+
+
+def make_synthetic_label(path, ingredients, rng):
+    """
+    Draw a label with decorative art, a brand line and an ingredient panel.
+    Returns the panel's (x, y, w, h) box.
+    """
+    height, width = 2000, 1500
+    # Background gradient and packaging art
+    gradient = np.linspace(rng.randint(120, 200), rng.randint(200, 255), height, dtype=np.float32)
+    img = np.repeat(gradient[:, None], width, axis=1).astype(np.uint8)
+    img = cv2.cvtColor(img, cv2.COLOR_GRAY2BGR)
+    for _ in range(12):
+        color = tuple(rng.randint(60, 255) for _ in range(3))
+        center = (rng.randint(0, width), rng.randint(0, height // 2))
+        cv2.circle(img, center, rng.randint(40, 250), color, -1)
+    cv2.putText(img, "GLOW SERUM", (150, 350), cv2.FONT_HERSHEY_DUPLEX, 4, (30, 30, 90), 8)
+
+    # Ingredient panel in the lower part of the label
+    panel_x, panel_y = rng.randint(80, 300), rng.randint(1150, 1350)
+    text = "INGREDIENTS: " + ", ".join(ingredients)
+    words, lines, current = text.split(" "), [], ""
+    for word in words:
+        candidate = f"{current} {word}".strip()
+        if cv2.getTextSize(candidate, cv2.FONT_HERSHEY_SIMPLEX, 0.7, 1)[0][0] > width - panel_x - 100:
+            lines.append(current)
+            current = word
+        else:
+            current = candidate
+    lines.append(current)
+
+    line_height = 28
+    panel_w = max(cv2.getTextSize(line, cv2.FONT_HERSHEY_SIMPLEX, 0.7, 1)[0][0] for line in lines)
+    panel_h = line_height * len(lines)
+    cv2.rectangle(img, (panel_x - 20, panel_y - 30), (panel_x + panel_w + 20, panel_y + panel_h), (245, 245, 245), -1)
+    for i, line in enumerate(lines):
+        cv2.putText(img, line, (panel_x, panel_y + i * line_height), cv2.FONT_HERSHEY_SIMPLEX, 0.7, (20, 20, 20), 1, cv2.LINE_AA)
+    cv2.imwrite(path, img)
+    return panel_x, panel_y - 22, panel_w, panel_h
+
+
+def build_synthetic_fixtures(directory, count):
+    rng = random.Random(0)
+    names = load_ingredient_names()
+    panels = {}
+    for i in range(count):
+        ingredients = rng.sample(names, rng.randint(10, 25))
+        image_path = os.path.join(directory, f"label_{i:02d}.png")
+        panels[image_path] = make_synthetic_label(image_path, ingredients, rng)
+        with open(os.path.splitext(image_path)[0] + ".txt", "w") as f:
+            f.write("\n".join(ingredients))
+    return panels
+
+
+def expected_words(image_path):
+    with open(os.path.splitext(image_path)[0] + ".txt", "r") as f:
+        return {w for w in re.split(r"[\s,]+", f.read().lower()) if len(w) > 2}
+
+
+def box_coverage(panel, box):
+    """
+    Fraction of the ground-truth panel covered by the detected box
+    """
+    if box is None:
+        return 0.0
+    px, py, pw, ph = panel
+    bx, by, bw, bh = box
+    overlap_w = max(0, min(px + pw, bx + bw) - max(px, bx))
+    overlap_h = max(0, min(py + ph, by + bh) - max(py, by))
+    return overlap_w * overlap_h / float(pw * ph)
+
+
+def run(image_path, crop_to_text, tesseract):
+    start = time.perf_counter()
+    image = preprocess_for_ocr(image_path, crop_to_text=crop_to_text)
+    preprocess_ms = (time.perf_counter() - start) * 1000
+    result = {"preprocess_ms": preprocess_ms, "pixels": image.size[0] * image.size[1]}
+    if tesseract:
+        import pytesseract
+        pytesseract.pytesseract.tesseract_cmd = tesseract
+        start = time.perf_counter()
+        text = pytesseract.image_to_string(image).lower()
+        result["ocr_ms"] = (time.perf_counter() - start) * 1000
+        expected = expected_words(image_path)
+        found = {w for w in re.split(r"[\s,.:;()]+", text) if w}
+        result["recall"] = len(expected & found) / float(len(expected)) if expected else 1.0
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--fixtures", help="directory of label images with .txt ground truth")
+    parser.add_argument("--count", type=int, default=10, help="number of synthetic labels")
+    args = parser.parse_args()
+
+    tesseract = shutil.which("tesseract") or (
+        "/usr/local/bin/tesseract" if os.path.exists("/usr/local/bin/tesseract") else None
+    )
+    tmpdir = None
+    panels = {}
+    if args.fixtures:
+        images = sorted(
+            os.path.join(args.fixtures, name) for name in os.listdir(args.fixtures)
+            if name.lower().endswith(IMAGE_EXTENSIONS)
+        )
+    else:
+        tmpdir = tempfile.mkdtemp(prefix="ocr_roi_")
+        panels = build_synthetic_fixtures(tmpdir, args.count)
+        images = sorted(panels)
+
+    totals = {True: [], False: []}
+    print(f"{'image':20} {'mode':8} {'prep ms':>8} {'Mpixels':>8} {'ocr ms':>8} {'recall':>7} {'roi cover':>9}")
+    for image_path in images:
+        for crop in (False, True):
+            result = run(image_path, crop, tesseract)
+            totals[crop].append(result)
+            coverage = ""
+            if crop and image_path in panels:
+                gray = cv2.imread(image_path, cv2.IMREAD_GRAYSCALE)
+                coverage = f"{box_coverage(panels[image_path], detect_text_region(gray)):.2f}"
+            print(
+                f"{os.path.basename(image_path):20} {'roi' if crop else 'full':8} "
+                f"{result['preprocess_ms']:8.1f} {result['pixels'] / 1e6:8.2f} "
+                f"{result.get('ocr_ms', float('nan')):8.1f} {result.get('recall', float('nan')):7.2f} {coverage:>9}"
+            )
+
+    print("\nMeans:")
+    for crop in (False, True):
+        rows = totals[crop]
+        mean = lambda key: sum(r.get(key, float("nan")) for r in rows) / len(rows)
+        print(
+            f"  {'roi ' if crop else 'full'}  preprocess {mean('preprocess_ms'):7.1f}ms  "
+            f"OCR input {mean('pixels') / 1e6:5.2f} Mpx  OCR {mean('ocr_ms'):7.1f}ms  recall {mean('recall'):.2f}"
+        )
+    if not tesseract:
+        print("\ntesseract not found: OCR latency and recall were skipped")
+    if tmpdir:
+        shutil.rmtree(tmpdir)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,103 @@
+"""
+Benchmark JSON encoding of the large responses: FastAPI's default
+jsonable_encoder -> json path versus orjson (ORJSONResponse).
+
+Usage: python bench_serialization.py [--years 5] [--repeat 50]
+"""
+import argparse
+import json
+import random
+import time
+import tracemalloc
+from datetime import date, timedelta
+
+import orjson
+from fastapi.encoders import jsonable_encoder
+
+CONDITIONS = ['Clear', 'Normal', 'Combination', 'Dry', 'Oily', 'Sensitive', 'Acne', None]
+
+
+def build_calendar_payload(years):
+    # Same shape as get_calendar_entries: {date: {id, skin_condition, has_image}}
+    start = date.today() - timedelta(days=365 * years)
+    return {
+        str(start + timedelta(days=i)): {
+            "id": i + 1,
+            "skin_condition": random.choice(CONDITIONS),
+            "has_image": random.random() < 0.3,
+        }
+        for i in range(365 * years)
+    }
+
+
+def build_entries_over_time(years):
+    # Same shape as the overview's entries_over_time list
+    start = date.today() - timedelta(days=365 * years)
+    return [
+        {
+            "date": str(start + timedelta(days=i)),
+            "skin_condition": random.choice(CONDITIONS),
+            "has_analysis": random.random() < 0.5,
+            "product_count": random.randint(0, 6),
+        }
+        for i in range(365 * years)
+    ]
+
+
+def default_encode(content):
+    # What FastAPI does for a plain dict return: jsonable_encoder, then JSONResponse.render
+    return json.dumps(
+        jsonable_encoder(content),
+        ensure_ascii=False,
+        allow_nan=False,
+        indent=None,
+        separators=(",", ":"),
+    ).encode("utf-8")
+
+
+def orjson_encode(content):
+    # ORJSONResponse.render
+    return orjson.dumps(content, option=orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY)
+
+
+def measure(encode, content, repeat):
+    encode(content)  # warm up
+    start = time.perf_counter()
+    for _ in range(repeat):
+        encode(content)
+    elapsed_ms = (time.perf_counter() - start) / repeat * 1000
+
+    tracemalloc.start()
+    encode(content)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return elapsed_ms, peak
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--years", type=int, default=5)
+    parser.add_argument("--repeat", type=int, default=50)
+    args = parser.parse_args()
+
+    random.seed(0)
+    payloads = {
+        "calendar/entries": build_calendar_payload(args.years),
+        "overview entries_over_time": {"entries_over_time": build_entries_over_time(args.years)},
+    }
+
+    print(f"{args.years}-year payloads, mean of {args.repeat} runs")
+    print(f"{'payload':30} {'encoder':10} {'ms/encode':>10} {'peak KiB':>10} {'bytes':>10}")
+    for name, content in payloads.items():
+        results = {}
+        for label, encode in (("default", default_encode), ("orjson", orjson_encode)):
+            elapsed_ms, peak = measure(encode, content, args.repeat)
+            results[label] = (elapsed_ms, peak)
+            print(f"{name:30} {label:10} {elapsed_ms:10.2f} {peak / 1024:10.1f} {len(encode(content)):10}")
+        speedup = results["default"][0] / results["orjson"][0]
+        alloc_ratio = results["default"][1] / max(results["orjson"][1], 1)
+        print(f"{'':30} {'orjson':10} {speedup:9.1f}x faster, {alloc_ratio:.1f}x less peak allocation")
+
+
+if __name__ == "__main__":
+    main()
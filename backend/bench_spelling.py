@@ -0,0 +1,122 @@
+"""
+Compare ingredient spelling correction throughput and accuracy: the previous
+pyspellchecker path versus the symmetric-delete index in fuzzy_index.py.
+
+Ingredient lists are sampled from the lexicons and corrupted with OCR-style
+errors (character confusions, deletions, transpositions). Accuracy is the
+share of injected ingredient names recovered exactly after correction.
+
+Usage: python bench_spelling.py [--labels 200] [--seed 0]
+"""
+import argparse
+import random
+import time
+
+from fuzzy_index import IngredientCorrector
+from ingredient_lexicon import load_lexicons, normalize_ingredient
+
+OCR_CONFUSIONS = {'l': '1', 'i': 'l', 'o': '0', 'e': 'c', 'm': 'rn', 'c': 'e', 's': '5', 'n': 'h', 'a': 'o'}
+
+
+def corrupt_word(word, rng):
+    if len(word) < 5:
+        return word
+    i = rng.randrange(1, len(word) - 1)
+    kind = rng.choice(["confuse", "delete", "transpose", "insert"])
+    if kind == "confuse" and word[i] in OCR_CONFUSIONS:
+        return word[:i] + OCR_CONFUSIONS[word[i]] + word[i + 1:]
+    if kind == "delete":
+        return word[:i] + word[i + 1:]
+    if kind == "transpose":
+        return word[:i] + word[i + 1] + word[i] + word[i + 2:]
+    return word[:i] + rng.choice("abcdefghijklmnopqrstuvwxyz") + word[i:]
+
+
+def corrupt_name(name, rng):
+    # One or two OCR errors per ingredient name
+    words = name.split()
+    for _ in range(rng.choice([1, 1, 2])):
+        j = rng.randrange(len(words))
+        words[j] = corrupt_word(words[j], rng)
+    return " ".join(words)
+
+
+def build_labels(names, count, rng):
+    labels = []
+    for _ in range(count):
+        chosen = rng.sample(names, rng.randint(8, 20))
+        noisy = [corrupt_name(name, rng) for name in chosen]
+        labels.append((chosen, "Ingredients: " + ", ".join(noisy)))
+    return labels
+
+
+def make_pyspellchecker_corrector():
+    # The correction path extract_text used before the symmetric-delete index
+    from spellchecker import SpellChecker
+
+    spell = SpellChecker(distance=1)
+    spell.word_frequency.load_text_file('./ingredients/ingredient_dictionary.txt')
+
+    def correct(text):
+        words = text.split()
+        misspelled = spell.unknown(words)
+        corrected_text = []
+        for word in words:
+            word = word.strip()
+            if word in misspelled:
+                corrected_word = spell.correction(word)
+                corrected_text.append("" if corrected_word is None else corrected_word)
+            else:
+                corrected_text.append(word)
+        return " ".join(corrected_text)
+
+    return correct
+
+
+def make_index_corrector(lexicons):
+    corrector = IngredientCorrector(lexicons)
+    return lambda text: " ".join(corrector.correct_tokens(text.split()))
+
+
+def evaluate(correct, labels):
+    recovered = total = tokens = 0
+    start = time.perf_counter()
+    outputs = [correct(text) for _, text in labels]
+    elapsed = time.perf_counter() - start
+    for (names, text), output in zip(labels, outputs):
+        tokens += len(text.split())
+        found = {normalize_ingredient(part) for part in output.split(",")}
+        normalized_output = normalize_ingredient(output)
+        for name in names:
+            total += 1
+            if name in found or f" {name} " in f" {normalized_output} ":
+                recovered += 1
+    return tokens / elapsed, recovered / total
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--labels", type=int, default=200)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    lexicons = load_lexicons()
+    names = sorted({name for entries in lexicons.values() for name in entries})
+    labels = build_labels(names, args.labels, rng)
+
+    print(f"{args.labels} noisy labels, {sum(len(n) for n, _ in labels)} ingredient names")
+    print(f"{'corrector':18} {'build ms':>9} {'tokens/s':>10} {'accuracy':>9}")
+    for label, factory in (
+        ("pyspellchecker", make_pyspellchecker_corrector),
+        ("symmetric-delete", lambda: make_index_corrector(lexicons)),
+    ):
+        start = time.perf_counter()
+        correct = factory()
+        build_ms = (time.perf_counter() - start) * 1000
+        throughput, accuracy = evaluate(correct, labels)
+        print(f"{label:18} {build_ms:9.1f} {throughput:10.0f} {accuracy:9.1%}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,136 @@
+"""
+Population-level (cross-user) analytics served from Postgres materialized views.
+
+The views are refreshed CONCURRENTLY on a schedule by CohortRefresher, so
+readers are never blocked and request handlers never scan the raw tables.
+"""
+import logging
+import os
+import threading
+
+from sqlalchemy import text
+
+logger = logging.getLogger(__name__)
+
+# Arbitrary key for the advisory lock that stops several workers refreshing at once
+REFRESH_LOCK_KEY = 726_001
+
+# Product names are normalized the same way as product_catalog.normalize_product_name
+PRODUCT_USAGE_BY_CONDITION_VIEW = """
+CREATE MATERIALIZED VIEW IF NOT EXISTS mv_product_usage_by_condition AS
+SELECT
+    e.skin_condition,
+    lower(regexp_replace(trim(p.product_name), '\\s+', ' ', 'g')) AS product_name,
+    count(*) AS usage_count,
+    count(DISTINCT e.user_id) AS user_count
+FROM product_usage p
+JOIN skincare_entries e ON e.id = p.entry_id
+WHERE e.skin_condition IS NOT NULL
+GROUP BY e.skin_condition, lower(regexp_replace(trim(p.product_name), '\\s+', ' ', 'g'))
+"""
+
+# Streaks via gaps-and-islands: consecutive dates share (date - row_number).
+# A run is "current" if it reaches today or yesterday, matching calculate_streak
+COHORT_STREAKS_VIEW = """
+CREATE MATERIALIZED VIEW IF NOT EXISTS mv_cohort_streaks AS
+WITH days AS (
+    SELECT DISTINCT user_id, date FROM skincare_entries
+),
+islands AS (
+    SELECT user_id, date,
+           date - (row_number() OVER (PARTITION BY user_id ORDER BY date))::int AS grp
+    FROM days
+),
+runs AS (
+    SELECT user_id, max(date) AS end_date, count(*) AS length
+    FROM islands
+    GROUP BY user_id, grp
+),
+user_streaks AS (
+    SELECT u.id AS user_id,
+           date_trunc('month', u.created_at)::date AS cohort_month,
+           coalesce(max(r.length) FILTER (WHERE r.end_date >= current_date - 1), 0) AS current_streak,
+           coalesce(max(r.length), 0) AS longest_streak
+    FROM users u
+    LEFT JOIN runs r ON r.user_id = u.id
+    GROUP BY u.id, date_trunc('month', u.created_at)
+)
+SELECT cohort_month,
+       count(*) AS users,
+       avg(current_streak)::float AS avg_current_streak,
+       avg(longest_streak)::float AS avg_longest_streak,
+       max(longest_streak) AS max_longest_streak
+FROM user_streaks
+GROUP BY cohort_month
+"""
+
+# REFRESH ... CONCURRENTLY requires a unique index on each view
+VIEW_DEFINITIONS = [
+    (
+        "mv_product_usage_by_condition",
+        PRODUCT_USAGE_BY_CONDITION_VIEW,
+        "CREATE UNIQUE INDEX IF NOT EXISTS mv_product_usage_by_condition_key "
+        "ON mv_product_usage_by_condition (skin_condition, product_name)",
+    ),
+    (
+        "mv_cohort_streaks",
+        COHORT_STREAKS_VIEW,
+        "CREATE UNIQUE INDEX IF NOT EXISTS mv_cohort_streaks_key ON mv_cohort_streaks (cohort_month)",
+    ),
+]
+
+
+def create_cohort_views(engine):
+    """
+    Create (and populate) the materialized views and their unique indexes
+    """
+    with engine.begin() as conn:
+        for _, create_view, create_index in VIEW_DEFINITIONS:
+            conn.execute(text(create_view))
+            conn.execute(text(create_index))
+
+
+def refresh_cohort_views(engine, concurrently=True):
+    """
+    Refresh every view unless another worker holds the refresh lock.
+    Returns True if this call refreshed them.
+    """
+    with engine.connect() as conn:
+        if not conn.execute(text("SELECT pg_try_advisory_lock(:key)"), {"key": REFRESH_LOCK_KEY}).scalar():
+            return False
+        try:
+            for name, _, _ in VIEW_DEFINITIONS:
+                mode = "CONCURRENTLY " if concurrently else ""
+                conn.execute(text(f"REFRESH MATERIALIZED VIEW {mode}{name}"))
+                conn.commit()
+        finally:
+            conn.execute(text("SELECT pg_advisory_unlock(:key)"), {"key": REFRESH_LOCK_KEY})
+            conn.commit()
+    return True
+
+
+class CohortRefresher:
+    """
+    Background thread refreshing the cohort views every COHORT_REFRESH_SECONDS
+    """
+
+    def __init__(self, engine, interval=None):
+        self.engine = engine
+        self.interval = interval if interval is not None else float(os.getenv("COHORT_REFRESH_SECONDS", "900"))
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="cohort-refresher", daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                if refresh_cohort_views(self.engine):
+                    logger.info("Refreshed cohort materialized views")
+            except Exception as e:
+                logger.warning("Cohort view refresh failed: %s", e)
@@ -0,0 +1,103 @@
+from fastapi import APIRouter, Depends, HTTPException, UploadFile, File, Form
+from sqlalchemy.orm import Session
+from pydantic import BaseModel
+from typing import List, Optional
+from db_conn import SessionLocal
+from product_compatibility import get_compatibility_index
+from product_catalog import get_or_create_product, lookup_product, rescore_product, serialize_product
+from ingredient_lexicon import lexicon_version
+
+router = APIRouter(prefix="/skincare/compatibility", tags=["compatibility"])
+
+# Upper bound on products per batch request
+MAX_BATCH_PRODUCTS = 500
+
+# Dependency
+def get_db():
+    db = SessionLocal()
+    try:
+        yield db
+    finally:
+        db.close()
+
+class ProductIngredients(BaseModel):
+    name: Optional[str] = None
+    ingredients: List[str]
+
+class BatchCompatibilityRequest(BaseModel):
+    products: List[ProductIngredients]
+
+@router.post("/batch")
+def score_products(request: BatchCompatibilityRequest):
+    """
+    Score many products in one call (e.g. a shelf or a search result page).
+    Returns per-product compatibility scores and the offending ingredients.
+    """
+    if len(request.products) > MAX_BATCH_PRODUCTS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"At most {MAX_BATCH_PRODUCTS} products can be scored per request"
+        )
+
+    results = get_compatibility_index().score_products(
+        [product.ingredients for product in request.products]
+    )
+
+    return {
+        "products": [
+            {
+                "name": product.name,
+                "score": round(result["score"], 1),
+                **{key: value for key, value in result.items() if key != "score"}
+            }
+            for product, result in zip(request.products, results)
+        ]
+    }
+
+@router.post("/products")
+def check_product(
+    file: UploadFile = File(...),
+    name: Optional[str] = Form(None),
+    db: Session = Depends(get_db)
+):
+    """
+    Compatibility for a product label. Known products (same label image or
+    name) are served from the catalog; new ones are extracted with Gemini once
+    and stored.
+    """
+    file_bytes = file.file.read()
+    if not file_bytes:
+        raise HTTPException(status_code=400, detail="Empty image upload")
+
+    try:
+        product, from_catalog = get_or_create_product(db, file_bytes, file.filename, name=name)
+    except Exception as e:
+        print(f"Product extraction error: {str(e)}")
+        raise HTTPException(status_code=502, detail=f"Ingredient extraction failed: {str(e)}")
+
+    return {**serialize_product(product), "from_catalog": from_catalog}
+
+@router.get("/products")
+def get_product(
+    name: Optional[str] = None,
+    image_hash: Optional[str] = None,
+    db: Session = Depends(get_db)
+):
+    """
+    Look up a catalogued product by name or label image hash (no extraction)
+    """
+    if not name and not image_hash:
+        raise HTTPException(status_code=400, detail="Provide a name or image_hash")
+
+    product = lookup_product(db, name=name, image_hash=image_hash)
+    if not product:
+        raise HTTPException(status_code=404, detail="Product not in catalog")
+
+    # Scores are refreshed in the background when the lexicons change; rescore
+    # inline if this row hasn't been reached yet
+    if product.lexicon_version != lexicon_version():
+        rescore_product(product)
+        db.commit()
+        db.refresh(product)
+
+    return serialize_product(product)
\ No newline at end of file
@@ -1,6 +1,25 @@
 from models import Base
 from db_conn import engine
+from cohort_analytics import create_cohort_views
+from analysis_storage import ensure_analysis_columns, ensure_analysis_partitions
+from product_usage_counters import fill_product_usage_counters
 
 # create all tables
 Base.metadata.create_all(bind=engine)
-print("Tables created successfully!")
\ No newline at end of file
+print("Tables created successfully!")
+
+# skin_analyses is partitioned by month; rows can only be stored once their month's partition exists
+ensure_analysis_partitions(engine)
+print("Analysis partitions created successfully!")
+
+# columns added to skin_analyses since it was first created
+ensure_analysis_columns(engine)
+
+# per-day product usage counters start from the entries already logged
+filled = fill_product_usage_counters(engine)
+if filled is not None:
+    print(f"Product usage counters filled ({filled} rows)")
+
+# materialized views for cohort analytics (need the tables above)
+create_cohort_views(engine)
+print("Cohort views created successfully!")
\ No newline at end of file
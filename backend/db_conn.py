@@ -2,7 +2,13 @@ from sqlalchemy import create_engine
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 from dotenv import load_dotenv
+from http.cookies import SimpleCookie
+import contextvars
+import hashlib
+import hmac
 import os
+import threading
+import time
 
 load_dotenv()
 
@@ -16,4 +22,144 @@ DB_URL = f"postgresql://{DB_USER}:{DB_PASSWORD}@{DB_HOST}:{DB_PORT}/{DB_NAME}"
 
 engine = create_engine(DB_URL)
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
-Base = declarative_base()
\ No newline at end of file
+Base = declarative_base()
+
+# Optional read replica for read-only endpoints, configured like the primary.
+# Without DB_READ_HOST, reads go to the primary.
+DB_READ_HOST = os.getenv('DB_READ_HOST')
+DB_READ_URL = (
+    f"postgresql://{os.getenv('DB_READ_USER', DB_USER)}:{os.getenv('DB_READ_PASSWORD', DB_PASSWORD)}"
+    f"@{DB_READ_HOST}:{os.getenv('DB_READ_PORT', DB_PORT)}/{os.getenv('DB_READ_NAME', DB_NAME)}"
+) if DB_READ_HOST else None
+
+read_engine = create_engine(DB_READ_URL) if DB_READ_URL else engine
+ReadSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=read_engine)
+
+# After a write, a user's reads stay on the primary for this long so they see
+# their own changes while the replica catches up
+READ_YOUR_WRITES_SECONDS = float(os.getenv('READ_YOUR_WRITES_SECONDS', '5'))
+
+# Pins also travel with the client as a signed token (cookie, echoed in the
+# X-Primary-Until header for clients without cookies), so a user's next read
+# stays on the primary whichever worker it lands on
+PRIMARY_PIN_COOKIE = 'primary_until'
+PRIMARY_PIN_HEADER = 'x-primary-until'
+PRIMARY_PIN_SECRET = os.getenv('READ_YOUR_WRITES_SECRET') or os.getenv('SECRET_KEY')
+
+# {"token": pin token the request carried, "issue": token to return} for the current request
+_request_pin = contextvars.ContextVar('request_pin', default=None)
+
+
+def sign_pin(user_id, until):
+    payload = f"{user_id}.{int(until)}"
+    mac = hmac.new(PRIMARY_PIN_SECRET.encode(), payload.encode(), hashlib.sha256).hexdigest()[:32]
+    return f"{payload}.{mac}"
+
+
+def pin_token_valid(token, user_id):
+    """
+    True if token was signed here for user_id and hasn't expired
+    """
+    if not token or not PRIMARY_PIN_SECRET:
+        return False
+    try:
+        token_user, until, _ = token.split('.')
+        expected = sign_pin(int(token_user), int(until))
+    except ValueError:
+        return False
+    return hmac.compare_digest(token, expected) and int(token_user) == user_id and int(until) > time.time()
+
+
+class PrimaryPins:
+    """
+    Users who wrote recently, and so are pinned to the primary. Pins are kept
+    per process, and during a request also handed to the client as a signed
+    token (see PrimaryPinMiddleware) that every worker honours.
+    """
+
+    def __init__(self, window_seconds):
+        self.window_seconds = window_seconds
+        self._until = {}
+        self._lock = threading.Lock()
+
+    def pin(self, user_id):
+        now = time.monotonic()
+        with self._lock:
+            self._until[user_id] = now + self.window_seconds
+            # Drop expired pins as we go so the map stays small
+            if len(self._until) > 1024:
+                self._until = {user: until for user, until in self._until.items() if until > now}
+        request_pin = _request_pin.get()
+        if request_pin is not None and PRIMARY_PIN_SECRET:
+            request_pin["issue"] = sign_pin(user_id, time.time() + self.window_seconds)
+
+    def is_pinned(self, user_id):
+        with self._lock:
+            until = self._until.get(user_id)
+        if until is not None and until > time.monotonic():
+            return True
+        request_pin = _request_pin.get()
+        return request_pin is not None and pin_token_valid(request_pin["token"], user_id)
+
+
+primary_pins = PrimaryPins(READ_YOUR_WRITES_SECONDS)
+
+
+def read_session(user_id=None):
+    """
+    A session for read-only work: the replica, unless there is none or the
+    user wrote within the read-your-writes window
+    """
+    if read_engine is engine or (user_id is not None and primary_pins.is_pinned(user_id)):
+        return SessionLocal()
+    return ReadSessionLocal()
+
+
+class PrimaryPinMiddleware:
+    """
+    ASGI middleware carrying read-your-writes pins through the client: reads
+    the pin token from the request's cookie or X-Primary-Until header, and
+    returns a fresh one (cookie and header) when the request wrote.
+    Writes made after the response has started (e.g. by a streamed analysis)
+    are only pinned in the worker that made them.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        token = None
+        for name, value in scope.get("headers", []):
+            if name == PRIMARY_PIN_HEADER.encode():
+                token = value.decode("latin-1")
+            elif name == b"cookie" and token is None:
+                cookie = SimpleCookie()
+                try:
+                    cookie.load(value.decode("latin-1"))
+                except Exception:
+                    continue
+                if PRIMARY_PIN_COOKIE in cookie:
+                    token = cookie[PRIMARY_PIN_COOKIE].value
+        request_pin = {"token": token, "issue": None}
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start" and request_pin["issue"]:
+                issued = request_pin["issue"]
+                message["headers"] = list(message.get("headers", [])) + [
+                    (b"set-cookie", (
+                        f"{PRIMARY_PIN_COOKIE}={issued}; Max-Age={int(READ_YOUR_WRITES_SECONDS) + 1}; "
+                        f"Path=/; HttpOnly; SameSite=Lax"
+                    ).encode()),
+                    (PRIMARY_PIN_HEADER.encode(), issued.encode()),
+                ]
+            await send(message)
+
+        reset = _request_pin.set(request_pin)
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            _request_pin.reset(reset)
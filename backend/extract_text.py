@@ -1,25 +1,96 @@
-import pytesseract
-from spellchecker import SpellChecker
-from PIL import Image
 import re
-import cv2
-import numpy as np
-import os
+from ingredient_matcher import get_ingredient_matcher
+
+# The OCR stack (cv2, numpy, PIL, pytesseract) is imported inside
+# the functions that use it, so importing this module stays cheap for
+# processes that never run OCR
+
+def find_ingredients(text):
+    """
+    Find every lexicon ingredient in the text (longest multi-word name wins),
+    with its character span and the lexicons it belongs to
+    """
+    return get_ingredient_matcher().find(text)
 
 def get_ingredients(text):
     result_set = set()
-    for filename in os.listdir('./ingredients'):
-        with open(f"./ingredients/{filename}", 'r') as f:
-            # Strip whitespace and lowercase every word
-            ingredient_set = {line.strip().lower() for line in f if line.strip()}
-        for word in text.split():
-            if word.lower() in ingredient_set:
-                result_set.add(word.lower())
+    for match in find_ingredients(text):
+        result_set.add(match["ingredient"])
     return list(result_set)
 
-def preprocess_for_ocr(image_path):
+# Width the image is downscaled to for text-region detection
+ROI_DETECT_WIDTH = 1000
+
+def detect_text_region(gray):
+    """
+    Find the densest block of text lines in a grayscale image, e.g. the
+    ingredient panel on a product label.
+    Returns an (x, y, w, h) box in full-resolution coordinates, or None.
+    """
+    import cv2
+    import numpy as np
+
+    full_h, full_w = gray.shape[:2]
+    # Detection only needs coarse structure, so run it on a downscaled copy
+    scale = min(1.0, ROI_DETECT_WIDTH / full_w)
+    small = cv2.resize(gray, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA) if scale < 1 else gray
+    h, w = small.shape[:2]
+
+    # Character strokes have strong local contrast; the morphological gradient
+    # picks them out while flat packaging art and gradients stay dark
+    gradient = cv2.morphologyEx(small, cv2.MORPH_GRADIENT, cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (3, 3)))
+    _, strokes = cv2.threshold(gradient, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
+
+    # Join characters into line-shaped blobs
+    lines = cv2.morphologyEx(strokes, cv2.MORPH_CLOSE, cv2.getStructuringElement(cv2.MORPH_RECT, (15, 3)))
+    contours, _ = cv2.findContours(lines, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+
+    # Keep blobs shaped like text lines: short, wider than tall, partly filled
+    line_mask = np.zeros_like(strokes)
+    for contour in contours:
+        x, y, cw, ch = cv2.boundingRect(contour)
+        if ch < 4 or ch > h * 0.1 or cw < ch * 2:
+            continue
+        fill = cv2.countNonZero(strokes[y:y + ch, x:x + cw]) / float(cw * ch)
+        if 0.1 <= fill <= 0.85:
+            line_mask[y:y + ch, x:x + cw] = 255
+    if not cv2.countNonZero(line_mask):
+        return None
+
+    # Merge neighbouring lines into blocks and pick the one with the most text
+    blocks = cv2.dilate(line_mask, cv2.getStructuringElement(cv2.MORPH_RECT, (25, 15)))
+    contours, _ = cv2.findContours(blocks, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+    best_box, best_area = None, 0
+    for contour in contours:
+        x, y, cw, ch = cv2.boundingRect(contour)
+        text_area = cv2.countNonZero(line_mask[y:y + ch, x:x + cw])
+        if text_area > best_area:
+            best_box, best_area = (x, y, cw, ch), text_area
+    if best_box is None:
+        return None
+
+    # Map back to full resolution with a small margin so edge glyphs aren't clipped
+    x, y, cw, ch = (int(round(v / scale)) for v in best_box)
+    pad = int(round(10 / scale))
+    x0, y0 = max(0, x - pad), max(0, y - pad)
+    x1, y1 = min(full_w, x + cw + pad), min(full_h, y + ch + pad)
+    return x0, y0, x1 - x0, y1 - y0
+
+def preprocess_for_ocr(image_path, crop_to_text=True):
+    import cv2
+    import numpy as np
+    from PIL import Image
+
     # Load image in grayscale
     img = cv2.imread(image_path, cv2.IMREAD_GRAYSCALE)
+
+    # 0. Crop to the ingredient block so the steps below (and Tesseract) only
+    #    work on the text, not the packaging art around it
+    if crop_to_text:
+        box = detect_text_region(img)
+        if box is not None:
+            x, y, w, h = box
+            img = img[y:y + h, x:x + w]
     
     # 1. Rescale: Tesseract works best with text height of ~30 pixels
     img = cv2.resize(img, None, fx=2, fy=2, interpolation=cv2.INTER_CUBIC)
@@ -53,32 +124,19 @@ def strip_hallucinations(text):
     return " ".join(clean_words)
 
 def extract_text(image_path):
+    import pytesseract
+    from fuzzy_index import get_ingredient_corrector
+
     # Path for tesseract executable, may need to be updated based on your system configuration
     pytesseract.pytesseract.tesseract_cmd = "/usr/local/bin/tesseract"
     image = preprocess_for_ocr(image_path)
     text = pytesseract.image_to_string(image)
 
-    # Use pyspellchecker to correct misspelled words in the extracted text
-    spell = SpellChecker(distance=1)
-    spell.word_frequency.load_text_file('./ingredients/ingredient_dictionary.txt')
-
-    # 5. Strip hallucinations and correct spelling
+    # 5. Strip hallucinations and correct spelling against the precomputed
+    #    symmetric-delete index over the ingredient lexicons (edit distance 2,
+    #    multi-word names matched as phrases)
     text = strip_hallucinations(text)
-    words = text.split()
-    misspelled = spell.unknown(words)
-    corrected_text = []
-    for word in words:
-       word = word.strip()
-       if word in misspelled:
-           # Get the one most likely correction
-           corrected_word = spell.correction(word)
-           if (corrected_word is None):
-               corrected_text.append("")
-           else:
-               corrected_text.append(corrected_word)
-       else:
-             corrected_text.append(word)
-    text = " ".join(corrected_text)
+    text = " ".join(get_ingredient_corrector().correct_tokens(text.split()))
     return text
     #return(get_ingredients(text))
 
@@ -1,10 +1,19 @@
 from fastapi import APIRouter, UploadFile, File, Depends, HTTPException, Form
+from fastapi.responses import ORJSONResponse, StreamingResponse
+from pydantic import BaseModel
+from typing import Any, Dict, Optional
 from sqlalchemy.orm import Session
-from db_conn import SessionLocal
+from db_conn import SessionLocal, primary_pins
 from models import SkinAnalysis, SkinCareEntry
+from metrics import track_dependency
+from resilience import UpstreamHTTPError, UpstreamUnavailable, get_upstream_policy
+from response_cache import analytics_cache
+from analysis_format import format_analysis_result
+from starlette.concurrency import run_in_threadpool
+from contextlib import asynccontextmanager
+import asyncio
 import os
-import requests
-import json
+import orjson
 from datetime import datetime
 
 # Create a router with prefix
@@ -19,105 +28,236 @@ def get_db():
         db.close()
 
 AILABTOOLS_API_KEY = os.getenv("AILABTOOLS_API_KEY")
-API_URL = "https://www.ailabapi.com/api/portrait/analysis/skin-analysis"
+# Overridable to point at a local stand-in (see stub_upstreams.py)
+API_URL = os.getenv("AILABTOOLS_API_URL", "https://www.ailabapi.com/api/portrait/analysis/skin-analysis")
 
-def analyze_skin_image(file_bytes, filename, content_type):
+# Concurrent AILabTools calls, and how many more may wait for a slot before
+# new analyses are turned away with 503
+MAX_CONCURRENT_ANALYSES = int(os.getenv("MAX_CONCURRENT_ANALYSES", "4"))
+MAX_QUEUED_ANALYSES = int(os.getenv("MAX_QUEUED_ANALYSES", "16"))
+
+# Longest image side sent upstream
+MAX_IMAGE_DIMENSION = 2048
+
+SSE_HEARTBEAT_SECONDS = 15
+SSE_RETRY_MS = 10000
+
+def analyze_skin_image(file_bytes, filename, content_type, on_retry=None):
     """
     Sends image bytes to AILabTools API and returns JSON result.
+    Rate limiting, retries and hedging come from the "ailabtools" upstream policy.
     """
+    import requests
+
     if not AILABTOOLS_API_KEY:
         raise Exception("AILABTOOLS_API_KEY environment variable not set")
-    
-    response = requests.post(
-        API_URL,
-        headers={"ailabapi-api-key": AILABTOOLS_API_KEY},
-        files={"image": (filename, file_bytes, content_type)},
-        timeout=60  # 60 second timeout
-    )
-    
-    if response.status_code != 200:
-        raise Exception(f"AILabTools API error: {response.status_code} - {response.text}")
-    
-    return response.json()
 
-def format_analysis_result(api_response):
+    def attempt(timeout):
+        with track_dependency("ailabtools"):
+            response = requests.post(
+                API_URL,
+                headers={"ailabapi-api-key": AILABTOOLS_API_KEY},
+                files={"image": (filename, file_bytes, content_type)},
+                timeout=timeout
+            )
+
+        if response.status_code != 200:
+            raise UpstreamHTTPError(f"AILabTools API error: {response.status_code} - {response.text}", response.status_code)
+
+        return response.json()
+
+    return get_upstream_policy("ailabtools").call(attempt, on_retry=on_retry)
+
+class AIAnalysisResponse(BaseModel):
+    id: Optional[int]
+    result: str
+    raw_data: Dict[str, Any]
+    message: str
+
+class AnalysisBusy(Exception):
+    pass
+
+class AnalysisSlots:
+    """
+    Caps concurrent AILabTools calls. Callers over the cap wait for a slot
+    (up to max_waiting of them), the rest are rejected with AnalysisBusy.
+
+    Waiting happens on the event loop, so queued analyses don't hold threads
+    from the pool that sync dependencies and file I/O also run on.
+    """
+
+    def __init__(self, limit, max_waiting):
+        self._slots = asyncio.Semaphore(limit)
+        self.max_waiting = max_waiting
+        self.waiting = 0
+
+    @asynccontextmanager
+    async def acquire(self, on_wait=None):
+        if self._slots.locked():
+            if self.waiting >= self.max_waiting:
+                raise AnalysisBusy()
+            self.waiting += 1
+            try:
+                if on_wait:
+                    on_wait(self.waiting)
+                await self._slots.acquire()
+            finally:
+                self.waiting -= 1
+        else:
+            await self._slots.acquire()
+        try:
+            yield
+        finally:
+            self._slots.release()
+
+analysis_slots = AnalysisSlots(MAX_CONCURRENT_ANALYSES, MAX_QUEUED_ANALYSES)
+
+def normalize_image(file_bytes, filename, content_type):
     """
-    Format the AI API response into a user-friendly string
+    Apply EXIF orientation, convert to RGB and cap the longest side at
+    MAX_IMAGE_DIMENSION before upload. Unreadable images are passed through.
     """
+    import io
+    from PIL import Image, ImageOps
+
     try:
-        # The actual results are in the 'result' key
-        if isinstance(api_response, dict) and 'result' in api_response:
-            data = api_response['result']
-            
-            summary_parts = []
-            
-            # Skin type
-            if 'skin_type' in data:
-                skin_types = ['Oily', 'Dry', 'Normal', 'Combination']
-                skin_type_value = data['skin_type'].get('skin_type', 2)
-                if 0 <= skin_type_value < len(skin_types):
-                    summary_parts.append(f"Skin Type: {skin_types[skin_type_value]}")
-            
-            # Check for skin concerns (value = 1 means present)
-            concerns = []
-            
-            if data.get('acne', {}).get('value') == 1:
-                concerns.append('Acne')
-            
-            if data.get('eye_pouch', {}).get('value') == 1:
-                concerns.append('Eye Pouches')
-            
-            if data.get('dark_circle', {}).get('value') == 1:
-                concerns.append('Dark Circles')
-            
-            if data.get('skin_spot', {}).get('value') == 1:
-                concerns.append('Skin Spots')
-            
-            if data.get('mole', {}).get('value') == 1:
-                concerns.append('Moles')
-            
-            if data.get('blackhead', {}).get('value') == 1:
-                concerns.append('Blackheads')
-            
-            if data.get('forehead_wrinkle', {}).get('value') == 1:
-                concerns.append('Forehead Wrinkles')
-            
-            if data.get('crows_feet', {}).get('value') == 1:
-                concerns.append("Crow's Feet")
+        with Image.open(io.BytesIO(file_bytes)) as image:
+            image = ImageOps.exif_transpose(image).convert("RGB")
+            image.thumbnail((MAX_IMAGE_DIMENSION, MAX_IMAGE_DIMENSION))
+            output = io.BytesIO()
+            image.save(output, format="JPEG", quality=90)
+    except Exception as e:
+        print(f"Could not normalize image {filename}: {e}")
+        return file_bytes, filename, content_type
+
+    name = os.path.splitext(filename or "image")[0] + ".jpg"
+    return output.getvalue(), name, "image/jpeg"
+
+async def run_ai_analysis(db: Session, file_bytes, filename, content_type, date=None, report=None):
+    """
+    Normalize the image, call AILabTools and store the result.
+    report(stage, **details) is called as each stage is reached.
+    """
+    report = report or (lambda stage, **details: None)
+
+    file_bytes, filename, content_type = await run_in_threadpool(normalize_image, file_bytes, filename, content_type)
+    report("image_normalized", size=len(file_bytes))
+
+    # Call AI API, waiting for a free slot if too many calls are in flight. The
+    # call itself blocks, so it runs in the threadpool once a slot is held
+    async with analysis_slots.acquire(on_wait=lambda position: report("queued", position=position)):
+        report("upstream_call_in_flight")
+        api_result = await run_in_threadpool(
+            analyze_skin_image, file_bytes, filename, content_type,
+            on_retry=lambda attempt, reason: report("upstream_retry", attempt=attempt, reason=reason),
+        )
+
+    return await run_in_threadpool(store_analysis_result, db, api_result, date, report)
+
+def store_analysis_result(db: Session, api_result, date=None, report=None):
+    """
+    Format an AILabTools result, attach it to the entry for `date` and keep the
+    raw response in skin_analyses
+    """
+    report = report or (lambda stage, **details: None)
+    entry_id = None
+
+    print(f"AI API response: {api_result}")
+    
+    # Format the result for display
+    formatted_result = format_analysis_result(api_result)
+    
+    print(f"Formatted result: {formatted_result}")
+    
+    # Update the skincare entry if a date was provided
+    if date:
+        try:
+            entry_date = datetime.strptime(date, "%Y-%m-%d").date()
             
-            if data.get('nasolabial_fold', {}).get('value') == 1:
-                concerns.append('Nasolabial Folds')
+            # Find the entry for this date
+            entry = db.query(SkinCareEntry).filter(
+                SkinCareEntry.user_id == 2,  # TODO: Get from auth
+                SkinCareEntry.date == entry_date
+            ).first()
             
-            if concerns:
-                summary_parts.append(f"Detected: {', '.join(concerns)}")
+            if entry:
+                entry.analysis_result = formatted_result
+                analytics_cache.invalidate_user(db, entry.user_id)
+                db.commit()
+                entry_id = entry.id
+                primary_pins.pin(entry.user_id)
+                print(f"Updated skincare entry {entry.id} with analysis result")
             else:
-                summary_parts.append("No major concerns detected")
-            
-            # Pore information
-            pore_areas = []
-            if data.get('pores_forehead', {}).get('value') == 1:
-                pore_areas.append('forehead')
-            if data.get('pores_left_cheek', {}).get('value') == 1:
-                pore_areas.append('left cheek')
-            if data.get('pores_right_cheek', {}).get('value') == 1:
-                pore_areas.append('right cheek')
-            if data.get('pores_jaw', {}).get('value') == 1:
-                pore_areas.append('jaw')
-            
-            if pore_areas:
-                summary_parts.append(f"Visible pores on: {', '.join(pore_areas)}")
-            
-            if summary_parts:
-                return " | ".join(summary_parts)
-        
-        return "Analysis completed successfully"
-        
-    except Exception as e:
-        print(f"Error formatting result: {e}")
-        return "Analysis completed - see raw data for details"
+                print(f"No entry found for date {date}, creating one...")
+                # Create a new entry with just the analysis
+                new_entry = SkinCareEntry(
+                    user_id=2,  # TODO: Get from auth
+                    date=entry_date,
+                    analysis_result=formatted_result
+                )
+                db.add(new_entry)
+                analytics_cache.invalidate_user(db, new_entry.user_id)
+                db.commit()
+                db.refresh(new_entry)
+                entry_id = new_entry.id
+                primary_pins.pin(new_entry.user_id)
+                print(f"Created new entry {new_entry.id} with analysis")
+                
+        except Exception as e:
+            print(f"Warning: Could not update skincare entry: {e}")
+    
+    # Try to store raw data in skin_analyses table (optional)
+    analysis_id = None
+    try:
+        analysis = SkinAnalysis(
+            user_id=1,  # TODO: Get from authenticated user
+            entry_id=entry_id,
+            result=api_result
+        )
+        db.add(analysis)
+        analytics_cache.invalidate_user(db, analysis.user_id)
+        db.commit()
+        db.refresh(analysis)
+        primary_pins.pin(analysis.user_id)
+        analysis_id = analysis.id
+    except Exception as db_error:
+        print(f"Warning: Could not save to skin_analyses table: {db_error}")
+        print("Continuing without skin_analyses storage...")
+    report("result_stored", id=analysis_id)
+    
+    return {
+        "id": analysis_id,
+        "result": formatted_result,  # User-friendly formatted text
+        "raw_data": api_result,  # Full API response
+        "message": "Skin analysis completed successfully"
+    }
+
+def describe_analysis_error(e):
+    """
+    (HTTP status, detail) for an exception raised by run_ai_analysis
+    """
+    import requests
+
+    if isinstance(e, AnalysisBusy):
+        return 503, "Too many analyses in progress. Please try again shortly."
+    if isinstance(e, UpstreamUnavailable):
+        print(f"AI API unavailable: {str(e)}")
+        return 503, "AI analysis is temporarily unavailable. Please try again shortly."
+    if isinstance(e, (requests.Timeout, TimeoutError)):
+        return 504, "AI analysis timed out. Please try again with a smaller image."
+    if isinstance(e, requests.RequestException):
+        print(f"AI API request error: {str(e)}")
+        return 502, f"AI API connection failed: {str(e)}"
+    if isinstance(e, UpstreamHTTPError) and e.status_code >= 500:
+        print(f"AI API error: {str(e)}")
+        return 502, f"AI API error: {str(e)}"
+    print(f"Analysis error: {str(e)}")
+    return 500, f"Analysis failed: {str(e)}"
 
 # AI Analysis endpoint that matches frontend
-@router.post("/ai-analysis")
+# raw_data echoes the full upstream response, so it is encoded with orjson and
+# returned directly instead of being re-validated against the response model
+@router.post("/ai-analysis", response_model=AIAnalysisResponse)
 async def ai_analysis(
     file: UploadFile = File(...),
     date: str = Form(None),
@@ -127,94 +267,94 @@ async def ai_analysis(
     Analyze skin from uploaded image using AILabTools API.
     This endpoint matches the frontend call: /skincare/entries/ai-analysis
     """
+    # Read file bytes
+    file_bytes = await file.read()
+    
+    print(f"Analyzing image: {file.filename}, size: {len(file_bytes)} bytes")
+    
     try:
-        # Read file bytes
-        file_bytes = await file.read()
-        
-        print(f"Analyzing image: {file.filename}, size: {len(file_bytes)} bytes")
-        
-        # Call AI API
-        api_result = analyze_skin_image(file_bytes, file.filename, file.content_type)
-        
-        print(f"AI API response: {api_result}")
-        
-        # Format the result for display
-        formatted_result = format_analysis_result(api_result)
-        
-        print(f"Formatted result: {formatted_result}")
-        
-        # Update the skincare entry if a date was provided
-        if date:
-            try:
-                from datetime import datetime
-                entry_date = datetime.strptime(date, "%Y-%m-%d").date()
-                
-                # Find the entry for this date
-                from models import SkinCareEntry
-                entry = db.query(SkinCareEntry).filter(
-                    SkinCareEntry.user_id == 2,  # TODO: Get from auth
-                    SkinCareEntry.date == entry_date
-                ).first()
-                
-                if entry:
-                    entry.analysis_result = formatted_result
-                    db.commit()
-                    print(f"Updated skincare entry {entry.id} with analysis result")
-                else:
-                    print(f"No entry found for date {date}, creating one...")
-                    # Create a new entry with just the analysis
-                    new_entry = SkinCareEntry(
-                        user_id=2,  # TODO: Get from auth
-                        date=entry_date,
-                        analysis_result=formatted_result
-                    )
-                    db.add(new_entry)
-                    db.commit()
-                    db.refresh(new_entry)
-                    print(f"Created new entry {new_entry.id} with analysis")
-                    
-            except Exception as e:
-                print(f"Warning: Could not update skincare entry: {e}")
-        
-        # Try to store raw data in skin_analyses table (optional)
-        analysis_id = None
-        try:
-            analysis = SkinAnalysis(
-                user_id=1,  # TODO: Get from authenticated user
-                result=json.dumps(api_result)
-            )
-            db.add(analysis)
-            db.commit()
-            db.refresh(analysis)
-            analysis_id = analysis.id
-        except Exception as db_error:
-            print(f"Warning: Could not save to skin_analyses table: {db_error}")
-            print("Continuing without skin_analyses storage...")
-        
-        return {
-            "id": analysis_id,
-            "result": formatted_result,  # User-friendly formatted text
-            "raw_data": api_result,  # Full API response
-            "message": "Skin analysis completed successfully"
-        }
-        
-    except requests.Timeout:
-        raise HTTPException(
-            status_code=504, 
-            detail="AI analysis timed out after 60 seconds. Please try again with a smaller image."
-        )
-    except requests.RequestException as e:
-        print(f"AI API request error: {str(e)}")
-        raise HTTPException(
-            status_code=502, 
-            detail=f"AI API connection failed: {str(e)}"
-        )
+        result = await run_ai_analysis(db, file_bytes, file.filename, file.content_type, date)
     except Exception as e:
-        print(f"Analysis error: {str(e)}")
-        raise HTTPException(
-            status_code=500, 
-            detail=f"Analysis failed: {str(e)}"
-        )
+        status_code, detail = describe_analysis_error(e)
+        raise HTTPException(status_code=status_code, detail=detail)
+    
+    return ORJSONResponse(result)
+
+# Strong references to streamed analyses still running; the event loop only keeps weak ones
+running_analyses = set()
+
+def sse_event(event, data):
+    return f"event: {event}\ndata: {orjson.dumps(data).decode()}\n\n"
+
+@router.post("/ai-analysis/stream")
+async def ai_analysis_stream(
+    file: UploadFile = File(...),
+    date: str = Form(None)
+):
+    """
+    Same analysis as /ai-analysis, streamed as server-sent events: a "stage"
+    event as each step is reached (upload_received, image_normalized, queued,
+    upstream_call_in_flight, result_stored), then one "result" or "error" event.
+    Comment heartbeats keep the connection open during the upstream call. The
+    analysis finishes and is stored even if the client disconnects.
+    """
+    file_bytes = await file.read()
+    filename, content_type = file.filename, file.content_type
+    
+    loop = asyncio.get_running_loop()
+    events = asyncio.Queue()
+    
+    def push(event, data):
+        loop.call_soon_threadsafe(events.put_nowait, (event, data))
+    
+    def report(stage, **details):
+        push("stage", {"stage": stage, **details})
+    
+    async def run():
+        # The request's session is closed once the handler returns, so the
+        # task opens its own
+        db = SessionLocal()
+        try:
+            push("result", await run_ai_analysis(db, file_bytes, filename, content_type, date, report))
+        except Exception as e:
+            status_code, detail = describe_analysis_error(e)
+            push("error", {"status": status_code, "detail": detail})
+        finally:
+            db.close()
+    
+    def finished(task):
+        running_analyses.discard(task)
+        # run() reports its own failures; this covers cancellation and anything
+        # it let escape, so the stream never waits forever
+        if task.cancelled() or task.exception() is not None:
+            if not task.cancelled():
+                print(f"Analysis task failed: {task.exception()!r}")
+            push("error", {"status": 500, "detail": "Analysis failed"})
+    
+    events.put_nowait(("stage", {"stage": "upload_received", "filename": filename, "size": len(file_bytes)}))
+    # Runs to completion (and is stored) even if the client disconnects
+    task = asyncio.create_task(run())
+    running_analyses.add(task)
+    task.add_done_callback(finished)
+    
+    async def stream():
+        # Tell EventSource clients to wait before reconnecting instead of retrying at once
+        yield f"retry: {SSE_RETRY_MS}\n\n"
+        while True:
+            try:
+                event, data = await asyncio.wait_for(events.get(), SSE_HEARTBEAT_SECONDS)
+            except asyncio.TimeoutError:
+                yield ": keep-alive\n\n"
+                continue
+            yield sse_event(event, data)
+            if event != "stage":
+                break
+    
+    return StreamingResponse(
+        stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
 
 # Legacy endpoint for backward compatibility
 @router.post("/analyze_skin/")
@@ -226,4 +366,4 @@ async def analyze_skin_legacy(
     """
     Legacy endpoint - redirects to new ai-analysis endpoint
     """
-    return await ai_analysis(file=file, db=db)
\ No newline at end of file
+    return await ai_analysis(file=file, date=None, db=db)
\ No newline at end of file
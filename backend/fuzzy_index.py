@@ -0,0 +1,230 @@
+"""
+Symmetric-delete fuzzy index (SymSpell-style) for correcting OCR'd ingredient
+names against the ingredient lexicons.
+
+Every lexicon term is indexed under all strings reachable by deleting up to
+max_distance characters. A lookup generates the same deletes for the input and
+probes the dict, so its cost depends on the input length only, not on the size
+of the lexicon.
+"""
+import string
+from collections import Counter
+from functools import lru_cache
+
+from ingredient_index import load_ingredient_index
+from ingredient_lexicon import load_lexicons, normalize_ingredient
+
+TOKEN_PUNCTUATION = string.punctuation + '“”‘’'
+
+
+def generate_deletes(term, max_distance):
+    """
+    Return every string reachable from term by deleting up to max_distance characters
+    """
+    results = {term}
+    frontier = {term}
+    for _ in range(max_distance):
+        next_frontier = set()
+        for word in frontier:
+            if len(word) > 1:
+                next_frontier.update(word[:i] + word[i + 1:] for i in range(len(word)))
+        next_frontier -= results
+        results |= next_frontier
+        frontier = next_frontier
+    return results
+
+
+def edit_distance(a, b, max_distance):
+    """
+    Optimal string alignment distance (Levenshtein plus adjacent transpositions),
+    or max_distance + 1 as soon as it is known to exceed max_distance
+    """
+    if abs(len(a) - len(b)) > max_distance:
+        return max_distance + 1
+    before_previous = None
+    previous = list(range(len(b) + 1))
+    for i in range(1, len(a) + 1):
+        current = [i] + [0] * len(b)
+        for j in range(1, len(b) + 1):
+            cost = 0 if a[i - 1] == b[j - 1] else 1
+            current[j] = min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + cost)
+            if i > 1 and j > 1 and a[i - 1] == b[j - 2] and a[i - 2] == b[j - 1]:
+                current[j] = min(current[j], before_previous[j - 2] + 1)
+        if min(current) > max_distance:
+            return max_distance + 1
+        before_previous, previous = previous, current
+    return min(previous[-1], max_distance + 1)
+
+
+class SymmetricDeleteIndex:
+    def __init__(self, terms, max_distance=2):
+        """
+        terms: {term: frequency}; frequency breaks ties between equally close terms
+        """
+        self.max_distance = max_distance
+        self.terms = dict(terms)
+        deletes = {}
+        for term in self.terms:
+            for deleted in generate_deletes(term, max_distance):
+                deletes.setdefault(deleted, []).append(term)
+        self.deletes = {key: tuple(terms) for key, terms in deletes.items()}
+
+    @classmethod
+    def from_tables(cls, terms, deletes, max_distance):
+        """
+        An index over prebuilt mappings, e.g. the mmapped views from ingredient_index
+        """
+        index = cls.__new__(cls)
+        index.max_distance = max_distance
+        index.terms = terms
+        index.deletes = deletes
+        return index
+
+    def lookup(self, text, max_distance=None):
+        """
+        Return (term, distance) for the closest indexed term within max_distance,
+        or None if there isn't one
+        """
+        if max_distance is None or max_distance > self.max_distance:
+            max_distance = self.max_distance
+        if text in self.terms:
+            return text, 0
+        if max_distance == 0:
+            return None
+
+        best = None
+        seen = set()
+        for deleted in generate_deletes(text, max_distance):
+            for term in self.deletes.get(deleted, ()):
+                if term in seen:
+                    continue
+                seen.add(term)
+                distance = edit_distance(text, term, max_distance)
+                if distance > max_distance:
+                    continue
+                rank = (distance, -self.terms[term], term)
+                if best is None or rank < best[0]:
+                    best = (rank, term, distance)
+        return (best[1], best[2]) if best else None
+
+
+def allowed_distance(text, max_distance=2):
+    # Short tokens are too ambiguous to correct aggressively
+    if len(text) <= 3:
+        return 0
+    if len(text) <= 5:
+        return min(1, max_distance)
+    return max_distance
+
+
+class IngredientCorrector:
+    """
+    Corrects OCR tokens against the ingredient lexicons: multi-word INCI names
+    are matched as whole phrases first (longest window wins), then single words
+    are corrected against the vocabulary of words used in the lexicons.
+    Tokens that match nothing are passed through unchanged.
+    """
+
+    def __init__(self, lexicons, max_distance=2):
+        self.max_distance = max_distance
+        names = {name for entries in lexicons.values() for name in entries}
+        word_counts = Counter(word for name in names for word in name.split())
+        phrases = {name: 1 for name in names if ' ' in name}
+
+        self.words = SymmetricDeleteIndex(word_counts, max_distance)
+        self.phrases = SymmetricDeleteIndex(phrases, max_distance)
+
+        # First word of each phrase -> the longest phrase (in words) starting with it,
+        # so phrase lookups are only attempted where a phrase can actually start
+        self.phrase_starts = {}
+        for phrase in phrases:
+            words = phrase.split()
+            self.phrase_starts[words[0]] = max(self.phrase_starts.get(words[0], 0), len(words))
+
+    @classmethod
+    def from_index(cls, index):
+        """
+        A corrector reading the shared precompiled index instead of building its own tables
+        """
+        corrector = cls.__new__(cls)
+        corrector.max_distance = index.max_distance
+        corrector.words = SymmetricDeleteIndex.from_tables(index.word_terms, index.word_deletes, index.max_distance)
+        corrector.phrases = SymmetricDeleteIndex.from_tables(
+            index.phrase_terms, index.phrase_deletes, index.max_distance
+        )
+        corrector.phrase_starts = index.phrase_starts
+        return corrector
+
+    def correct_word(self, word):
+        """
+        Return the corrected (lowercase) word, or None if nothing is close enough
+        """
+        normalized = normalize_ingredient(word)
+        match = self.words.lookup(normalized, allowed_distance(normalized, self.max_distance))
+        return match[0] if match else None
+
+    def _phrase_at(self, cores, ends_clause, start):
+        words = normalize_ingredient(cores[start]).split()
+        if not words:
+            return None
+        longest = self.phrase_starts.get(self.correct_word(words[0]), 0)
+        # Try the longest window first; phrases don't span a comma or other clause break
+        end = start + 1
+        while end < len(cores) and end - start < longest and not ends_clause[end - 1]:
+            end += 1
+        for stop in range(end, start, -1):
+            phrase = normalize_ingredient(" ".join(cores[start:stop]))
+            if ' ' not in phrase:
+                # Single words are handled by the word index
+                break
+            match = self.phrases.lookup(phrase, allowed_distance(phrase, self.max_distance))
+            if match:
+                return match[0], stop
+        return None
+
+    def correct_tokens(self, tokens):
+        """
+        Correct a list of whitespace-separated OCR tokens, keeping each token's
+        surrounding punctuation
+        """
+        cores = [token.strip(TOKEN_PUNCTUATION) for token in tokens]
+        ends_clause = [token.rstrip() != token.rstrip(',;:.)]') for token in tokens]
+
+        corrected = []
+        i = 0
+        while i < len(tokens):
+            phrase = self._phrase_at(cores, ends_clause, i)
+            if phrase:
+                name, stop = phrase
+                corrected.append(_leading_punctuation(tokens[i]) + name + _trailing_punctuation(tokens[stop - 1]))
+                i = stop
+                continue
+
+            token, core = tokens[i], cores[i]
+            word = self.correct_word(core) if core else None
+            if word is None:
+                corrected.append(token)
+            else:
+                corrected.append(_leading_punctuation(token) + word + _trailing_punctuation(token))
+            i += 1
+        return corrected
+
+
+def _leading_punctuation(token):
+    return token[:len(token) - len(token.lstrip(TOKEN_PUNCTUATION))]
+
+
+def _trailing_punctuation(token):
+    return token[len(token.rstrip(TOKEN_PUNCTUATION)):]
+
+
+@lru_cache(maxsize=1)
+def get_ingredient_corrector():
+    """
+    The corrector over the shared precompiled index when it is current,
+    otherwise built once per process from the lexicon files
+    """
+    index = load_ingredient_index()
+    if index is not None:
+        return IngredientCorrector.from_index(index)
+    return IngredientCorrector(load_lexicons())
@@ -1,26 +1,38 @@
-import PIL.Image
-from google import genai
 from dotenv import load_dotenv
+from metrics import track_dependency
+from resilience import get_upstream_policy
 import os
 
 load_dotenv()
 GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
+# Overridable to point at a local stand-in (see stub_upstreams.py)
+GEMINI_BASE_URL = os.getenv("GEMINI_BASE_URL")
 
 def extract_text(image_path):
-    # 1. Setup the Client
-    client = genai.Client(api_key=GEMINI_API_KEY)
+    # Imported on first use: google.genai alone takes over a second to import
+    import PIL.Image
+    from google import genai
 
-    # 2. Load the image
+    # 1. Load the image
     img = PIL.Image.open(image_path)
+    img.load()  # decoded once, since retried or hedged attempts share it
 
-    # 3. Define the prompt
+    # 2. Define the prompt
     prompt = "Extract the full list of ingredients from this product label. Format it as a clean, comma-separated list."
 
-    # 4. Generate the content
-    response = client.models.generate_content(
-        model='gemini-2.0-flash',  # You can also use 'gemini-1.5-pro'
-        contents=[prompt, img]
-    )
+    # 3. Generate the content, with rate limiting and retries from the "gemini" upstream policy
+    def attempt(timeout):
+        http_options = {"timeout": int(timeout * 1000)}
+        if GEMINI_BASE_URL:
+            http_options["base_url"] = GEMINI_BASE_URL
+        client = genai.Client(api_key=GEMINI_API_KEY, http_options=http_options)
+        with track_dependency("gemini"):
+            return client.models.generate_content(
+                model='gemini-2.0-flash',  # You can also use 'gemini-1.5-pro'
+                contents=[prompt, img]
+            )
 
-    # 5. Output the result
+    response = get_upstream_policy("gemini").call(attempt)
+
+    # 4. Output the result
     return response.text.lower().strip().split(",")
\ No newline at end of file
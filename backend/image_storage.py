@@ -0,0 +1,313 @@
+"""
+Content-addressed image storage with reference counting.
+
+Images are stored once per SHA-256 digest in a pluggable blob store: a sharded
+local directory, or any S3-compatible bucket (AWS, MinIO, or a local stand-in
+via S3_ENDPOINT_URL). The image_blobs table counts the entries referencing each
+blob.
+
+Releasing the last reference deletes the row in the caller's transaction, but
+the blob (or legacy upload file) is only removed once that transaction commits,
+so a failed or rolled-back request never loses an image. Blob writes and
+post-commit deletes take the same per-digest advisory lock, and a delete skips
+any digest that has been referenced again in the meantime. A crash between the
+commit and the delete leaves an unreferenced blob behind, never a missing one.
+
+Configuration:
+    IMAGE_STORAGE       local (default) or s3
+    IMAGE_STORAGE_DIR   root directory for the local backend (default uploads/blobs)
+    S3_BUCKET, S3_PREFIX, S3_ENDPOINT_URL and the usual AWS_* credentials for s3
+                        (the s3 backend needs boto3: pip install -r requirements-s3.txt)
+"""
+import hashlib
+import logging
+import mimetypes
+import os
+import tempfile
+from abc import ABC, abstractmethod
+from functools import lru_cache
+
+from fastapi.responses import FileResponse, RedirectResponse
+from sqlalchemy import event, text
+from sqlalchemy.orm import Session
+
+logger = logging.getLogger(__name__)
+
+# Legacy uploads (entry_<id>_<timestamp>.<ext>) live directly in this directory
+LEGACY_UPLOAD_DIR = "uploads"
+
+# URL prefix stored in SkinCareEntry.image_path and served by GET /skincare/uploads/{filename}
+IMAGE_URL_PREFIX = "/uploads/"
+
+# pg_advisory_xact_lock namespace for per-digest blob locks
+BLOB_LOCK_NAMESPACE = 4_731_044
+
+# Session.info keys for what a transaction released, removed after it commits
+RELEASED_BLOBS = "released_image_blobs"
+RELEASED_LEGACY_UPLOADS = "released_legacy_uploads"
+
+
+def shard_key(digest):
+    """
+    ab/cd/abcd...: two directory levels keep any one directory small
+    """
+    return f"{digest[:2]}/{digest[2:4]}/{digest}"
+
+
+class BlobStore(ABC):
+    @abstractmethod
+    def exists(self, key):
+        ...
+
+    @abstractmethod
+    def put(self, key, data, content_type):
+        ...
+
+    @abstractmethod
+    def delete(self, key):
+        ...
+
+    @abstractmethod
+    def serve(self, key, media_type):
+        """
+        A response that delivers the blob to a client
+        """
+
+
+class LocalBlobStore(BlobStore):
+    def __init__(self, root):
+        self.root = root
+
+    def path(self, key):
+        return os.path.join(self.root, *key.split("/"))
+
+    def exists(self, key):
+        return os.path.exists(self.path(key))
+
+    def put(self, key, data, content_type):
+        path = self.path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Write to a temp file and rename so readers never see a partial image
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix=".tmp-")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+
+    def delete(self, key):
+        try:
+            os.remove(self.path(key))
+        except FileNotFoundError:
+            pass
+
+    def serve(self, key, media_type):
+        return FileResponse(self.path(key), media_type=media_type)
+
+
+class S3BlobStore(BlobStore):
+    """
+    Any S3-compatible bucket. Clients are redirected to short-lived presigned
+    URLs rather than having image bytes proxied through the app.
+    """
+
+    PRESIGNED_URL_SECONDS = 300
+
+    def __init__(self, bucket, prefix="", endpoint_url=None, client=None):
+        if client is None:
+            # Only needed for this backend, so not imported with the module
+            try:
+                import boto3
+            except ImportError as e:
+                raise ValueError(
+                    "IMAGE_STORAGE=s3 needs boto3; install it with pip install -r requirements-s3.txt"
+                ) from e
+            client = boto3.client("s3", endpoint_url=endpoint_url)
+        self.client = client
+        self.bucket = bucket
+        self.prefix = prefix.strip("/") + "/" if prefix.strip("/") else ""
+
+    def object_key(self, key):
+        return self.prefix + key
+
+    def exists(self, key):
+        from botocore.exceptions import ClientError
+
+        try:
+            self.client.head_object(Bucket=self.bucket, Key=self.object_key(key))
+            return True
+        except ClientError as e:
+            if e.response.get("Error", {}).get("Code") in ("404", "NoSuchKey", "NotFound"):
+                return False
+            raise
+
+    def put(self, key, data, content_type):
+        self.client.put_object(Bucket=self.bucket, Key=self.object_key(key), Body=data, ContentType=content_type)
+
+    def delete(self, key):
+        self.client.delete_object(Bucket=self.bucket, Key=self.object_key(key))
+
+    def serve(self, key, media_type):
+        url = self.client.generate_presigned_url(
+            "get_object",
+            Params={"Bucket": self.bucket, "Key": self.object_key(key), "ResponseContentType": media_type},
+            ExpiresIn=self.PRESIGNED_URL_SECONDS,
+        )
+        return RedirectResponse(url, status_code=307)
+
+
+@lru_cache(maxsize=1)
+def get_image_store():
+    backend = os.getenv("IMAGE_STORAGE", "local")
+    if backend == "s3":
+        return S3BlobStore(
+            os.environ["S3_BUCKET"],
+            prefix=os.getenv("S3_PREFIX", "images"),
+            endpoint_url=os.getenv("S3_ENDPOINT_URL"),
+        )
+    if backend == "local":
+        return LocalBlobStore(os.getenv("IMAGE_STORAGE_DIR", os.path.join(LEGACY_UPLOAD_DIR, "blobs")))
+    raise ValueError(f"Unknown IMAGE_STORAGE backend: {backend}")
+
+
+def image_url(digest, extension):
+    return f"{IMAGE_URL_PREFIX}{digest}{extension}"
+
+
+def parse_image_url(image_path):
+    """
+    (digest, extension) for a content-addressed image_path, or None for a
+    legacy upload path
+    """
+    if not image_path or not image_path.startswith(IMAGE_URL_PREFIX):
+        return None
+    digest, extension = os.path.splitext(image_path[len(IMAGE_URL_PREFIX):])
+    if len(digest) != 64 or any(c not in "0123456789abcdef" for c in digest):
+        return None
+    return digest, extension
+
+
+def add_image_reference(db, data, filename, store=None):
+    """
+    Store an image (once per content) and count one more reference to it.
+    Runs in the caller's transaction; the caller commits. Returns the image_path.
+    """
+    store = store or get_image_store()
+    digest = hashlib.sha256(data).hexdigest()
+    extension = os.path.splitext(filename or "")[1].lower() or ".jpg"
+    content_type = mimetypes.guess_type(f"x{extension}")[0] or "application/octet-stream"
+
+    # Held until commit, so a post-commit delete of this digest waits for us and
+    # then sees the row; the upsert also locks the row against a concurrent release
+    lock_blob(db, digest)
+    db.execute(text("""
+        INSERT INTO image_blobs (digest, size, content_type, refcount, created_at)
+        VALUES (:digest, :size, :content_type, 1, timezone('utc', now()))
+        ON CONFLICT (digest) DO UPDATE SET refcount = image_blobs.refcount + 1
+    """), {"digest": digest, "size": len(data), "content_type": content_type})
+
+    key = shard_key(digest)
+    if not store.exists(key):
+        store.put(key, data, content_type)
+    return image_url(digest, extension)
+
+
+def lock_blob(conn, digest):
+    conn.execute(text("SELECT pg_advisory_xact_lock(:namespace, hashtext(:digest))"), {
+        "namespace": BLOB_LOCK_NAMESPACE, "digest": digest,
+    })
+
+
+def release_image_reference(db, image_path):
+    """
+    Drop one reference to an entry's image. Runs in the caller's transaction;
+    the caller commits, and the blob is deleted after that commit if this was
+    its last reference.
+    """
+    parsed = parse_image_url(image_path)
+    if parsed is None:
+        if image_path:
+            db.info.setdefault(RELEASED_LEGACY_UPLOADS, []).append(image_path)
+        return
+
+    digest, _ = parsed
+    refcount = db.execute(text("""
+        UPDATE image_blobs SET refcount = refcount - 1
+        WHERE digest = :digest
+        RETURNING refcount
+    """), {"digest": digest}).scalar()
+    if refcount is not None and refcount <= 0:
+        db.execute(text("DELETE FROM image_blobs WHERE digest = :digest"), {"digest": digest})
+        db.info.setdefault(RELEASED_BLOBS, set()).add(digest)
+
+
+def delete_unreferenced_blobs(engine, digests, store=None):
+    """
+    Delete the blobs of digests that no image_blobs row references. Returns
+    the number deleted.
+    """
+    store = store or get_image_store()
+    deleted = 0
+    for digest in digests:
+        with engine.begin() as conn:
+            lock_blob(conn, digest)
+            referenced = conn.execute(
+                text("SELECT 1 FROM image_blobs WHERE digest = :digest"), {"digest": digest}
+            ).scalar()
+            if not referenced:
+                store.delete(shard_key(digest))
+                deleted += 1
+    return deleted
+
+
+@event.listens_for(Session, "after_commit")
+def _remove_released_images(session):
+    digests = session.info.pop(RELEASED_BLOBS, None)
+    legacy_paths = session.info.pop(RELEASED_LEGACY_UPLOADS, None)
+    if digests:
+        try:
+            delete_unreferenced_blobs(session.get_bind(), digests)
+        except Exception as e:
+            # The commit stands; the blobs are only left orphaned
+            logger.warning("Could not delete released image blobs %s: %s", sorted(digests), e)
+    for image_path in legacy_paths or ():
+        remove_legacy_upload(image_path)
+
+
+@event.listens_for(Session, "after_rollback")
+def _keep_released_images(session):
+    session.info.pop(RELEASED_BLOBS, None)
+    session.info.pop(RELEASED_LEGACY_UPLOADS, None)
+
+
+def remove_legacy_upload(image_path):
+    if not image_path:
+        return
+    path = os.path.join(LEGACY_UPLOAD_DIR, os.path.basename(image_path))
+    try:
+        os.remove(path)
+        logger.info("Deleted image file %s", path)
+    except FileNotFoundError:
+        pass
+    except Exception as e:
+        logger.warning("Could not delete image file %s: %s", path, e)
+
+
+def serve_image(db, filename, store=None):
+    """
+    Response for GET /uploads/{filename}, or None if there is no such image
+    """
+    parsed = parse_image_url(IMAGE_URL_PREFIX + filename)
+    if parsed is None:
+        path = os.path.join(LEGACY_UPLOAD_DIR, os.path.basename(filename))
+        return FileResponse(path) if os.path.exists(path) else None
+
+    digest, _ = parsed
+    content_type = db.execute(
+        text("SELECT content_type FROM image_blobs WHERE digest = :digest"), {"digest": digest}
+    ).scalar()
+    if content_type is None:
+        return None
+    return (store or get_image_store()).serve(shard_key(digest), content_type)
@@ -0,0 +1,418 @@
+"""
+Precompiled ingredient index shared read-only across worker processes.
+
+`python ingredient_index.py build` compiles the lexicons, the token trie used by
+IngredientMatcher and the symmetric-delete tables used by IngredientCorrector
+into one binary file. Each worker mmaps that file instead of parsing the
+lexicon text files and building ~20MB of dicts itself, so the workers share
+the same physical pages and load it in milliseconds.
+
+Layout: an 8-byte magic, a length-prefixed JSON header (lexicon version and
+section offsets), then 8-byte aligned sections of native uint32 arrays:
+    - a string pool (id -> UTF-8 string)
+    - each lexicon as (normalized id, display id) pairs, in file order
+    - hash tables (CRC-32, linear probing) mapping a UTF-8 key to a uint32
+      list: word/phrase frequencies, deletes -> term ids, phrase starts, and
+      the trie, keyed by space-joined token paths
+
+Rebuilding writes a temp file and renames it over the old one, so a worker
+holding the previous mapping keeps reading a consistent file. The
+LexiconWatcher notices the new file and workers switch over. If the index is
+missing or was built from different lexicon files, workers fall back to
+building their indexes in-process.
+"""
+import argparse
+import json
+import logging
+import mmap
+import os
+import sys
+import tempfile
+import threading
+import zlib
+from array import array
+
+from ingredient_lexicon import LEXICON_DIR, lexicon_version, load_lexicons
+
+logger = logging.getLogger(__name__)
+
+INDEX_PATH = os.getenv("INGREDIENT_INDEX_PATH", os.path.join(LEXICON_DIR, "ingredient_index.bin"))
+
+MAGIC = b"SKIDX\x00\x01\x00"
+FORMAT_VERSION = 1
+
+# Key marking the end of a complete name in a trie node (as in ingredient_matcher)
+_TERMINAL = None
+
+
+def _align(buffer, boundary=8):
+    buffer.extend(b"\x00" * (-len(buffer) % boundary))
+
+
+class _Writer:
+    def __init__(self):
+        self.data = bytearray()
+        self.strings = {}
+        self.string_list = []
+
+    def string_id(self, value):
+        if value not in self.strings:
+            self.strings[value] = len(self.string_list)
+            self.string_list.append(value)
+        return self.strings[value]
+
+    def uint32s(self, values):
+        _align(self.data)
+        offset = len(self.data)
+        self.data.extend(array("I", values).tobytes())
+        return offset
+
+    def blob(self, parts):
+        """
+        Concatenate byte strings; returns (offsets array offset, blob offset)
+        """
+        offsets = [0]
+        for part in parts:
+            offsets.append(offsets[-1] + len(part))
+        offsets_at = self.uint32s(offsets)
+        _align(self.data)
+        blob_at = len(self.data)
+        self.data.extend(b"".join(parts))
+        return offsets_at, blob_at
+
+    def table(self, items):
+        """
+        Hash table section for [(str key, [uint32 values])]
+        """
+        keys = [key.encode() for key, _ in items]
+        slot_count = 1
+        while slot_count < max(len(keys) * 2, 8):
+            slot_count *= 2
+        slots = [0] * slot_count
+        for entry, key in enumerate(keys):
+            slot = zlib.crc32(key) & (slot_count - 1)
+            while slots[slot]:
+                slot = (slot + 1) & (slot_count - 1)
+            slots[slot] = entry + 1
+
+        value_offsets = [0]
+        values = []
+        for _, entry_values in items:
+            values.extend(entry_values)
+            value_offsets.append(len(values))
+
+        key_offsets_at, keys_at = self.blob(keys)
+        return {
+            "entries": len(keys),
+            "slots": self.uint32s(slots),
+            "slot_count": slot_count,
+            "key_offsets": key_offsets_at,
+            "keys": keys_at,
+            "value_offsets": self.uint32s(value_offsets),
+            "values": self.uint32s(values),
+            "value_count": len(values),
+        }
+
+
+def _trie_items(node, path, writer, lexicon_ids):
+    """
+    Flatten IngredientMatcher's nested-dict trie into (token path, values);
+    values are [name, display, lexicon...] ids for complete names, else empty
+    """
+    for token, child in node.items():
+        if token is _TERMINAL:
+            continue
+        child_path = f"{path} {token}" if path else token
+        payload = child.get(_TERMINAL)
+        values = []
+        if payload:
+            values = [writer.string_id(payload["name"]), writer.string_id(payload["display"])]
+            values += [lexicon_ids[lexicon] for lexicon in payload["lexicons"]]
+        yield child_path, values
+        yield from _trie_items(child, child_path, writer, lexicon_ids)
+
+
+def build_index(path=INDEX_PATH, lexicons=None, version=None, max_distance=2):
+    """
+    Compile the lexicons into an index file at path, replacing any existing one
+    atomically. Returns the number of bytes written.
+    """
+    from fuzzy_index import IngredientCorrector
+    from ingredient_matcher import IngredientMatcher
+
+    if lexicons is None:
+        version = lexicon_version()
+        lexicons = load_lexicons()
+    corrector = IngredientCorrector(lexicons, max_distance)
+    matcher = IngredientMatcher(lexicons)
+
+    writer = _Writer()
+    lexicon_ids = {lexicon: writer.string_id(lexicon) for lexicon in lexicons}
+    sections = {"lexicons": {}}
+    for lexicon, entries in lexicons.items():
+        pairs = []
+        for normalized, name in entries.items():
+            pairs += [writer.string_id(normalized), writer.string_id(name)]
+        sections["lexicons"][lexicon] = {"pairs": writer.uint32s(pairs), "entries": len(entries)}
+
+    for name, index in (("words", corrector.words), ("phrases", corrector.phrases)):
+        sections[f"{name}_terms"] = writer.table([(term, [count]) for term, count in index.terms.items()])
+        sections[f"{name}_deletes"] = writer.table([
+            (deleted, [writer.string_id(term) for term in terms]) for deleted, terms in index.deletes.items()
+        ])
+    sections["phrase_starts"] = writer.table([(word, [length]) for word, length in corrector.phrase_starts.items()])
+    sections["trie"] = writer.table(list(_trie_items(matcher.root, "", writer, lexicon_ids)))
+
+    # Written last: every section above adds to the pool
+    offsets_at, blob_at = writer.blob([value.encode() for value in writer.string_list])
+    sections["strings"] = {"offsets": offsets_at, "blob": blob_at, "entries": len(writer.string_list)}
+
+    header = json.dumps({
+        "format": FORMAT_VERSION,
+        "byteorder": sys.byteorder,
+        "lexicon_version": version,
+        "max_distance": max_distance,
+        "sections": sections,
+    }).encode()
+    prefix = bytearray(MAGIC)
+    prefix.extend(array("I", [len(header)]).tobytes())
+    prefix.extend(header)
+    _align(prefix)
+
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".ingredient_index-")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(prefix)
+            f.write(writer.data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.chmod(tmp_path, 0o644)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+    return len(prefix) + len(writer.data)
+
+
+class _StringPool:
+    def __init__(self, index, section):
+        self.buffer = index.buffer
+        self.offsets = index.uint32s(section["offsets"], section["entries"] + 1)
+        self.blob = index.data_start + section["blob"]
+
+    def __getitem__(self, string_id):
+        return str(self.buffer[self.blob + self.offsets[string_id]:self.blob + self.offsets[string_id + 1]], "utf-8")
+
+
+class _Table:
+    def __init__(self, index, section):
+        self.buffer = index.buffer
+        self.mask = section["slot_count"] - 1
+        self.slots = index.uint32s(section["slots"], section["slot_count"])
+        self.key_offsets = index.uint32s(section["key_offsets"], section["entries"] + 1)
+        self.keys = index.data_start + section["keys"]
+        self.value_offsets = index.uint32s(section["value_offsets"], section["entries"] + 1)
+        self.values = index.uint32s(section["values"], section["value_count"])
+
+    def find(self, key):
+        """
+        The uint32 values stored for key, or None
+        """
+        # Most lookups are misses (symmetric-delete probes), so the empty-slot
+        # check comes first and everything else stays in locals
+        data = key.encode()
+        mask, slots = self.mask, self.slots
+        slot = zlib.crc32(data) & mask
+        entry = slots[slot]
+        while entry:
+            start, end = self.key_offsets[entry - 1], self.key_offsets[entry]
+            if end - start == len(data) and self.buffer[self.keys + start:self.keys + end] == data:
+                return self.values[self.value_offsets[entry - 1]:self.value_offsets[entry]]
+            slot = (slot + 1) & mask
+            entry = slots[slot]
+        return None
+
+
+class MappedTerms:
+    """
+    {term: frequency} view used as SymmetricDeleteIndex.terms
+    """
+
+    def __init__(self, table):
+        self.table = table
+
+    def __contains__(self, term):
+        return self.table.find(term) is not None
+
+    def __getitem__(self, term):
+        values = self.table.find(term)
+        if values is None:
+            raise KeyError(term)
+        return values[0]
+
+
+class MappedDeletes:
+    """
+    {delete: (terms,)} view used as SymmetricDeleteIndex.deletes
+    """
+
+    def __init__(self, table, strings):
+        self.table = table
+        self.strings = strings
+
+    def get(self, deleted, default=None):
+        values = self.table.find(deleted)
+        if values is None:
+            return default
+        return tuple(self.strings[string_id] for string_id in values)
+
+
+class MappedCounts:
+    """
+    {word: int} view used as IngredientCorrector.phrase_starts
+    """
+
+    def __init__(self, table):
+        self.table = table
+
+    def get(self, key, default=None):
+        if key is None:
+            return default
+        values = self.table.find(key)
+        return values[0] if values is not None else default
+
+
+class MappedTrieNode:
+    """
+    One node of the matcher trie, with the dict operations IngredientMatcher.find uses
+    """
+
+    def __init__(self, index, path, values=None):
+        self.index = index
+        self.path = path
+        self.values = values
+
+    def get(self, token, default=None):
+        path = f"{self.path} {token}" if self.path else token
+        values = self.index.trie.find(path)
+        return MappedTrieNode(self.index, path, values) if values is not None else default
+
+    def __contains__(self, key):
+        return key is _TERMINAL and bool(self.values)
+
+    def __getitem__(self, key):
+        if key is not _TERMINAL or not self.values:
+            raise KeyError(key)
+        strings = self.index.strings
+        return {
+            "name": strings[self.values[0]],
+            "display": strings[self.values[1]],
+            "lexicons": [strings[string_id] for string_id in self.values[2:]],
+        }
+
+
+class IngredientIndex:
+    """
+    A read-only mapping of an index file built by build_index
+    """
+
+    def __init__(self, path):
+        with open(path, "rb") as f:
+            self.buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            self.identity = index_file_identity(path, os.fstat(f.fileno()))
+        if self.buffer[:len(MAGIC)] != MAGIC:
+            raise ValueError(f"{path} is not an ingredient index")
+        header_length = array("I", self.buffer[len(MAGIC):len(MAGIC) + 4])[0]
+        header_start = len(MAGIC) + 4
+        header = json.loads(self.buffer[header_start:header_start + header_length])
+        if header["format"] != FORMAT_VERSION or header["byteorder"] != sys.byteorder:
+            raise ValueError(f"{path} was built for a different format or byte order")
+        self.data_start = header_start + header_length + (-(header_start + header_length) % 8)
+        self.view = memoryview(self.buffer)
+
+        self.path = path
+        self.lexicon_version = header["lexicon_version"]
+        self.max_distance = header["max_distance"]
+        sections = header["sections"]
+        self.strings = _StringPool(self, sections["strings"])
+        self.lexicons = {}
+        for lexicon, section in sections["lexicons"].items():
+            pairs = self.uint32s(section["pairs"], section["entries"] * 2)
+            self.lexicons[lexicon] = {
+                self.strings[pairs[i]]: self.strings[pairs[i + 1]] for i in range(0, len(pairs), 2)
+            }
+        self.word_terms = MappedTerms(_Table(self, sections["words_terms"]))
+        self.word_deletes = MappedDeletes(_Table(self, sections["words_deletes"]), self.strings)
+        self.phrase_terms = MappedTerms(_Table(self, sections["phrases_terms"]))
+        self.phrase_deletes = MappedDeletes(_Table(self, sections["phrases_deletes"]), self.strings)
+        self.phrase_starts = MappedCounts(_Table(self, sections["phrase_starts"]))
+        self.trie = _Table(self, sections["trie"])
+
+    def uint32s(self, offset, count):
+        start = self.data_start + offset
+        return self.view[start:start + count * 4].cast("I")
+
+    def trie_root(self):
+        return MappedTrieNode(self, "")
+
+
+def index_file_identity(path=INDEX_PATH, stat=None):
+    """
+    Changes whenever the index file is replaced; None if there is no index
+    """
+    try:
+        stat = stat or os.stat(path)
+    except FileNotFoundError:
+        return None
+    return stat.st_ino, stat.st_mtime_ns, stat.st_size
+
+
+_loaded = None
+_load_lock = threading.Lock()
+
+
+def load_ingredient_index(path=INDEX_PATH):
+    """
+    The mapped index if the file exists and matches the current lexicon files,
+    else None. Re-maps the file after it has been replaced.
+    """
+    global _loaded
+    identity = index_file_identity(path)
+    if identity is None:
+        return None
+    with _load_lock:
+        if _loaded is None or _loaded.path != path or _loaded.identity != identity:
+            try:
+                _loaded = IngredientIndex(path)
+            except (OSError, ValueError, KeyError) as e:
+                logger.warning("Could not load ingredient index %s: %s", path, e)
+                return None
+        index = _loaded
+    if index.lexicon_version != lexicon_version():
+        logger.warning("Ingredient index %s is stale (lexicon files changed); run ingredient_index.py build", path)
+        return None
+    return index
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("command", choices=["build", "info"])
+    parser.add_argument("--path", default=INDEX_PATH)
+    args = parser.parse_args()
+
+    if args.command == "build":
+        size = build_index(args.path)
+        print(f"Wrote {args.path} ({size / 1e6:.1f} MB) for lexicon {lexicon_version()[:12]}")
+        return
+
+    index = IngredientIndex(args.path)
+    current = index.lexicon_version == lexicon_version()
+    print(f"{args.path}: {len(index.buffer) / 1e6:.1f} MB, lexicon {index.lexicon_version[:12]}"
+          f" ({'current' if current else 'stale'})")
+    for lexicon, entries in index.lexicons.items():
+        print(f"  {lexicon}: {len(entries)} entries")
+
+
+if __name__ == "__main__":
+    main()
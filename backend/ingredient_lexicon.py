@@ -0,0 +1,68 @@
+"""
+Loading and normalization of the ingredient lexicon files in ./ingredients
+"""
+import hashlib
+import os
+import re
+
+LEXICON_DIR = './ingredients'
+
+# Lexicon name -> file in LEXICON_DIR
+LEXICON_FILES = {
+    'dictionary': 'ingredient_dictionary.txt',
+    'drying_skin': 'drying_skin.txt',
+    'pore_clogging': 'pore_clogging.txt',
+}
+
+# Lexicons that flag an ingredient as bad for the skin
+FLAG_LEXICONS = ('drying_skin', 'pore_clogging')
+
+
+def normalize_ingredient(name):
+    """
+    Lowercase, treat hyphens/underscores as spaces and collapse whitespace, so
+    "Laureth-4", "laureth 4" and "LAURETH  4" compare equal
+    """
+    name = name.lower().replace('-', ' ').replace('_', ' ')
+    name = re.sub(r'\s+', ' ', name)
+    return name.strip(' .,;:()[]')
+
+
+def ingredient_tokens(text):
+    """
+    Split text into the word tokens used for matching ingredient names
+    ("D&C Red 17" -> ["d&c", "red", "17"], "Goat's Milk" -> ["goat's", "milk"])
+    """
+    return re.findall(r"[a-z0-9&']+", normalize_ingredient(text))
+
+
+def load_lexicon(filename, directory=LEXICON_DIR):
+    """
+    Return {normalized name: name as written in the file} for one lexicon file
+    """
+    entries = {}
+    with open(os.path.join(directory, filename), 'r') as f:
+        for line in f:
+            name = line.strip()
+            if name:
+                entries.setdefault(normalize_ingredient(name), name)
+    return entries
+
+
+def load_lexicons(directory=LEXICON_DIR):
+    """
+    Return {lexicon name: {normalized name: name as written}} for every lexicon
+    """
+    return {lexicon: load_lexicon(filename, directory) for lexicon, filename in LEXICON_FILES.items()}
+
+
+def lexicon_version(directory=LEXICON_DIR):
+    """
+    Content hash of all lexicon files; changes whenever any of them is edited
+    """
+    digest = hashlib.sha256()
+    for lexicon, filename in sorted(LEXICON_FILES.items()):
+        digest.update(lexicon.encode())
+        with open(os.path.join(directory, filename), 'rb') as f:
+            digest.update(f.read())
+    return digest.hexdigest()
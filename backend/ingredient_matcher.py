@@ -0,0 +1,103 @@
+"""
+Token-trie matcher that finds the longest ingredient names (including
+multi-word INCI names like "sodium lauryl sulfate") in OCR text in one pass.
+"""
+import re
+from functools import lru_cache
+
+from ingredient_index import load_ingredient_index
+from ingredient_lexicon import ingredient_tokens, load_lexicons
+
+# Same token alphabet as ingredient_lexicon.ingredient_tokens, but run on the raw
+# text so match positions can be reported
+TOKEN_PATTERN = re.compile(r"[A-Za-z0-9&']+")
+
+# Separators that end an ingredient; a match never spans one of these. Whitespace
+# and hyphens don't ("Laureth-4" matches the "laureth 4" entry)
+BOUNDARY_PATTERN = re.compile(r"[,/()\[\]{};:|\n]")
+
+# Key marking the end of a complete name in a trie node
+_TERMINAL = None
+
+
+class IngredientMatcher:
+    def __init__(self, lexicons):
+        """
+        lexicons: {lexicon name: {normalized name: name as written}}
+        """
+        self.root = {}
+        for lexicon, entries in lexicons.items():
+            for normalized, name in entries.items():
+                tokens = ingredient_tokens(normalized)
+                if not tokens:
+                    continue
+                node = self.root
+                for token in tokens:
+                    node = node.setdefault(token, {})
+                payload = node.setdefault(_TERMINAL, {"name": " ".join(tokens), "display": name, "lexicons": []})
+                if lexicon not in payload["lexicons"]:
+                    payload["lexicons"].append(lexicon)
+
+    @classmethod
+    def from_index(cls, index):
+        """
+        A matcher walking the trie stored in the shared precompiled index
+        """
+        matcher = cls.__new__(cls)
+        matcher.root = index.trie_root()
+        return matcher
+
+    def find(self, text):
+        """
+        Return non-overlapping longest matches, left to right, as dicts with the
+        normalized name, the name as written in the lexicon, the [start, end)
+        character span in text and the lexicons that contain it
+        """
+        spans = [(m.group().lower(), m.start(), m.end()) for m in TOKEN_PATTERN.finditer(text)]
+        # breaks[i] is True when a separator sits between token i and token i + 1
+        breaks = [
+            bool(BOUNDARY_PATTERN.search(text, spans[i][2], spans[i + 1][1]))
+            for i in range(len(spans) - 1)
+        ]
+
+        matches = []
+        i = 0
+        while i < len(spans):
+            node = self.root
+            longest = None
+            j = i
+            while j < len(spans):
+                node = node.get(spans[j][0])
+                if node is None:
+                    break
+                if _TERMINAL in node:
+                    longest = (j, node[_TERMINAL])
+                if j < len(breaks) and breaks[j]:
+                    break
+                j += 1
+
+            if longest is None:
+                i += 1
+                continue
+            end_index, payload = longest
+            matches.append({
+                "ingredient": payload["name"],
+                "display_name": payload["display"],
+                "start": spans[i][1],
+                "end": spans[end_index][2],
+                "lexicons": list(payload["lexicons"]),
+            })
+            i = end_index + 1
+        return matches
+
+
+@lru_cache(maxsize=1)
+def get_ingredient_matcher():
+    """
+    The matcher over the shared precompiled index when it is current,
+    otherwise built once per process from the lexicon files
+    """
+    index = load_ingredient_index()
+    if index is not None:
+        return IngredientMatcher.from_index(index)
+    return IngredientMatcher(load_lexicons())
@@ -0,0 +1,324 @@
+"""
+End-to-end load test that replays the user journey against a running API.
+
+Each virtual user (VU) signs up once and then runs sessions back to back:
+    login -> log today's entry with products (POST, or PUT if the day is already
+    logged) -> calendar -> photo upload -> AI analysis -> overview, skin-progress
+    and product-effectiveness analytics
+
+Each step is timed, and the report shows throughput, latency percentiles
+and error rates per step. Passing several VU counts (--vus 5,10,20,40) runs
+one stage per count and prints a summary line per stage, so the saturation
+point shows up as the stage where throughput stops growing and latency and
+errors climb.
+
+Run it against the app backed by a disposable database, with the upstream AI
+APIs replaced by stub_upstreams.py:
+    python stub_upstreams.py --port 8100 &
+    AILABTOOLS_API_URL=http://127.0.0.1:8100/api/portrait/analysis/skin-analysis \\
+    AILABTOOLS_API_KEY=stub uvicorn main:app --port 8000 --workers 4 &
+    python load_test.py --base-url http://127.0.0.1:8000 --vus 5,10,20 --duration 60
+
+Entry, calendar and analytics routes still use a fixed user id until they are
+wired to auth, so all VUs share one user's data there.
+"""
+import argparse
+import asyncio
+import io
+import random
+import sys
+import time
+import uuid
+from collections import Counter, defaultdict
+from datetime import date, timedelta
+
+import httpx
+import orjson
+
+STEPS = (
+    "signup", "login", "entry_create", "entry_lookup", "entry_update", "calendar",
+    "upload_image", "ai_analysis", "overview", "skin_progress", "product_effectiveness",
+)
+
+# The calendar's skin condition choices, which the analytics endpoints score
+CONDITIONS = ["Clear", "Oily", "Dry", "Combination", "Acne", "Sensitive", "Normal"]
+
+PRODUCTS = [
+    ("CeraVe Hydrating Cleanser", "cleanser"),
+    ("The Ordinary Niacinamide 10%", "serum"),
+    ("La Roche-Posay Toleriane", "moisturizer"),
+    ("Paula's Choice 2% BHA", "exfoliant"),
+    ("EltaMD UV Clear SPF 46", "sunscreen"),
+    ("Differin Gel", "treatment"),
+    ("Vanicream Moisturizing Cream", "moisturizer"),
+    ("Cetaphil Gentle Cleanser", "cleanser"),
+]
+
+# Meets auth.UserCreate's password rules
+PASSWORD = "LoadTest-2024!"
+
+
+def percentile(ordered, fraction):
+    if not ordered:
+        return 0.0
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+def make_images(count, seed):
+    """
+    Small distinct JPEGs, so uploads exercise both new and deduplicated blobs
+    """
+    from PIL import Image
+
+    rng = random.Random(seed)
+    images = []
+    for _ in range(count):
+        image = Image.new("RGB", (640, 480), tuple(rng.randrange(256) for _ in range(3)))
+        output = io.BytesIO()
+        image.save(output, format="JPEG", quality=85)
+        images.append(output.getvalue())
+    return images
+
+
+class Results:
+    def __init__(self):
+        self.latencies = defaultdict(list)
+        self.errors = defaultdict(Counter)
+        self.sessions = 0
+        self.started = time.perf_counter()
+        self.finished = None
+
+    def record(self, step, seconds, error=None):
+        self.latencies[step].append(seconds)
+        if error is not None:
+            self.errors[step][error] += 1
+
+    def elapsed(self):
+        return (self.finished or time.perf_counter()) - self.started
+
+    def summary(self):
+        elapsed = self.elapsed()
+        rows = []
+        for step in STEPS:
+            latencies = sorted(self.latencies.get(step, []))
+            if not latencies:
+                continue
+            errors = sum(self.errors[step].values())
+            rows.append({
+                "step": step,
+                "requests": len(latencies),
+                "rps": len(latencies) / elapsed,
+                "error_rate": errors / len(latencies),
+                "p50_ms": percentile(latencies, 0.50) * 1000,
+                "p90_ms": percentile(latencies, 0.90) * 1000,
+                "p95_ms": percentile(latencies, 0.95) * 1000,
+                "p99_ms": percentile(latencies, 0.99) * 1000,
+                "max_ms": latencies[-1] * 1000,
+                "errors": {str(error): count for error, count in self.errors[step].items()},
+            })
+        requests = sum(row["requests"] for row in rows)
+        errors = sum(sum(row["errors"].values()) for row in rows)
+        return {
+            "elapsed_s": elapsed,
+            "sessions": self.sessions,
+            "sessions_per_s": self.sessions / elapsed,
+            "requests": requests,
+            "rps": requests / elapsed,
+            "error_rate": errors / requests if requests else 0.0,
+            "steps": rows,
+        }
+
+
+class VirtualUser:
+    def __init__(self, client, results, args, rng, images):
+        self.client = client
+        self.results = results
+        self.args = args
+        self.rng = rng
+        self.images = images
+        self.username = f"load_{uuid.uuid4().hex[:12]}"
+        self.token = None
+        self.calendar_etag = None
+
+    async def request(self, step, method, url, expected=(200,), **kwargs):
+        """
+        Time one request; returns the response, or None if it failed outright
+        """
+        started = time.perf_counter()
+        try:
+            response = await self.client.request(method, url, **kwargs)
+        except httpx.HTTPError as e:
+            self.results.record(step, time.perf_counter() - started, type(e).__name__)
+            return None
+        seconds = time.perf_counter() - started
+        self.results.record(step, seconds, None if response.status_code in expected else response.status_code)
+        return response
+
+    async def think(self):
+        if self.args.think_time:
+            await asyncio.sleep(self.rng.uniform(0, self.args.think_time))
+
+    async def signup(self):
+        await self.request("signup", "POST", "/auth/signup", json={
+            "username": self.username,
+            "email": f"{self.username}@example.com",
+            "password": PASSWORD,
+        })
+
+    async def session(self):
+        response = await self.request("login", "POST", "/auth/login", json={
+            "username_or_email": self.username,
+            "password": PASSWORD,
+        })
+        if response is not None and response.status_code == 200:
+            self.token = response.json().get("access_token")
+        headers = {"Authorization": f"Bearer {self.token}"} if self.token else {}
+        await self.think()
+
+        # Mostly today, sometimes backfilling a recent day
+        day = date.today() - timedelta(days=self.rng.choice([0, 0, 0, 1, 2, 3, 7]))
+        entry = {
+            "date": day.isoformat(),
+            "skin_condition": self.rng.choice(CONDITIONS),
+            "notes": "load test",
+            "products": [
+                {"product_name": name, "product_type": kind,
+                 "time_of_day": self.rng.choice(["morning", "evening"])}
+                for name, kind in self.rng.sample(PRODUCTS, self.rng.randint(2, 5))
+            ],
+        }
+        entry_id = await self.save_entry(entry, headers)
+        await self.think()
+
+        calendar_headers = dict(headers)
+        if self.calendar_etag:
+            calendar_headers["If-None-Match"] = self.calendar_etag
+        response = await self.request("calendar", "GET", "/skincare/calendar/entries",
+                                      expected=(200, 304), headers=calendar_headers)
+        if response is not None and response.status_code == 200:
+            self.calendar_etag = response.headers.get("ETag")
+        await self.think()
+
+        if not self.args.skip_analysis:
+            image = self.rng.choice(self.images)
+            if entry_id is not None:
+                await self.request("upload_image", "POST", f"/skincare/entries/{entry_id}/upload-image",
+                                   headers=headers, files={"file": ("photo.jpg", image, "image/jpeg")})
+            await self.request("ai_analysis", "POST", "/skincare/entries/ai-analysis", headers=headers,
+                               files={"file": ("photo.jpg", image, "image/jpeg")},
+                               data={"date": day.isoformat()})
+            await self.think()
+
+        days = self.rng.choice([7, 30, 90])
+        await self.request("overview", "GET", "/skincare/analytics/overview",
+                           headers=headers, params={"days": days})
+        await self.request("skin_progress", "GET", "/skincare/analytics/skin-progress",
+                           headers=headers, params={"days": days})
+        await self.request("product_effectiveness", "GET", "/skincare/analytics/product-effectiveness",
+                           headers=headers, params={"days": days})
+        self.results.sessions += 1
+
+    async def save_entry(self, entry, headers):
+        """
+        Create the day's entry, or update it if that day is already logged.
+        Returns the entry id.
+        """
+        response = await self.request("entry_create", "POST", "/skincare/entries",
+                                      expected=(200, 400), json=entry, headers=headers)
+        if response is None:
+            return None
+        if response.status_code == 200:
+            return response.json()["id"]
+        if response.status_code != 400:
+            return None
+
+        existing = await self.request("entry_lookup", "GET", f"/skincare/entries/{entry['date']}", headers=headers)
+        if existing is None or existing.status_code != 200:
+            return None
+        entry_id = existing.json()["id"]
+        update = {key: value for key, value in entry.items() if key != "date"}
+        await self.request("entry_update", "PUT", f"/skincare/entries/{entry_id}", json=update, headers=headers)
+        return entry_id
+
+    async def run(self, stop_at):
+        await self.signup()
+        while time.perf_counter() < stop_at:
+            await self.session()
+
+
+async def run_stage(args, vus, images):
+    results = Results()
+    limits = httpx.Limits(max_connections=vus, max_keepalive_connections=vus)
+    timeout = httpx.Timeout(args.timeout)
+    async with httpx.AsyncClient(base_url=args.base_url, limits=limits, timeout=timeout) as client:
+        stop_at = time.perf_counter() + args.ramp_up + args.duration
+        tasks = []
+        for index in range(vus):
+            rng = random.Random(None if args.seed is None else args.seed * 100003 + index)
+            user = VirtualUser(client, results, args, rng, images)
+            tasks.append(asyncio.create_task(user.run(stop_at)))
+            # Spread VU starts over the ramp-up period
+            if args.ramp_up and vus > 1:
+                await asyncio.sleep(args.ramp_up / (vus - 1))
+        await asyncio.gather(*tasks)
+    results.finished = time.perf_counter()
+    return results.summary()
+
+
+def print_stage(vus, summary, stream=sys.stdout):
+    columns = ("step", "requests", "rps", "error_rate", "p50_ms", "p90_ms", "p95_ms", "p99_ms", "max_ms")
+    stream.write(f"\n== {vus} VUs: {summary['sessions']} sessions, {summary['requests']} requests "
+                 f"in {summary['elapsed_s']:.1f}s ({summary['rps']:.1f} req/s, "
+                 f"{summary['error_rate']:.2%} errors)\n")
+    stream.write("".join(f"{c:>22}" if i == 0 else f"{c:>11}" for i, c in enumerate(columns)) + "\n")
+    for row in summary["steps"]:
+        cells = [f"{row['step']:>22}", f"{row['requests']:>11}", f"{row['rps']:>11.1f}",
+                 f"{row['error_rate']:>11.2%}"]
+        cells += [f"{row[c]:>11.0f}" for c in columns[4:]]
+        stream.write("".join(cells) + "\n")
+        if row["errors"]:
+            stream.write(f"{'':>22} errors: {row['errors']}\n")
+
+
+def print_saturation(stages, stream=sys.stdout):
+    stream.write("\n== Stages\n")
+    stream.write(f"{'vus':>6}{'req/s':>10}{'sessions/s':>12}{'errors':>9}{'p95 ms':>9}{'p99 ms':>9}\n")
+    for vus, summary in stages:
+        latencies = [row["p95_ms"] for row in summary["steps"]]
+        tails = [row["p99_ms"] for row in summary["steps"]]
+        stream.write(f"{vus:>6}{summary['rps']:>10.1f}{summary['sessions_per_s']:>12.2f}"
+                     f"{summary['error_rate']:>9.2%}{max(latencies, default=0):>9.0f}{max(tails, default=0):>9.0f}\n")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--base-url", default="http://127.0.0.1:8000")
+    parser.add_argument("--vus", default="10", help="virtual users, or a comma-separated list of stages")
+    parser.add_argument("--duration", type=float, default=60.0, help="seconds per stage after ramp-up")
+    parser.add_argument("--ramp-up", type=float, default=5.0, help="seconds to start all VUs of a stage")
+    parser.add_argument("--think-time", type=float, default=0.0, help="max random pause between steps (s)")
+    parser.add_argument("--timeout", type=float, default=120.0, help="per-request timeout (s)")
+    parser.add_argument("--skip-analysis", action="store_true", help="leave out the image upload and AI analysis")
+    parser.add_argument("--images", type=int, default=20, help="distinct images to upload")
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--json", help="also write the results to this file")
+    args = parser.parse_args()
+
+    stages = [int(vus) for vus in args.vus.split(",")]
+    images = [] if args.skip_analysis else make_images(args.images, args.seed)
+
+    results = []
+    for vus in stages:
+        summary = asyncio.run(run_stage(args, vus, images))
+        results.append((vus, summary))
+        print_stage(vus, summary)
+    if len(results) > 1:
+        print_saturation(results)
+
+    if args.json:
+        with open(args.json, "wb") as f:
+            f.write(orjson.dumps([{"vus": vus, **summary} for vus, summary in results], option=orjson.OPT_INDENT_2))
+
+
+if __name__ == "__main__":
+    main()
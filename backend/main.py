@@ -1,11 +1,37 @@
-from fastapi import FastAPI
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, Response
 from fastapi.middleware.cors import CORSMiddleware
+from db_conn import PrimaryPinMiddleware, engine, read_engine, SessionLocal
+from metrics import MetricsMiddleware, instrument_engine, render_latest, PROMETHEUS_CONTENT_TYPE
 from auth import router as auth_router
 from face_scan import router as face_scan_router
 from skincare_router import router as skincare_router
 from analytics_routes import router as analytics_router
+from compatibility_routes import router as compatibility_router
+from product_catalog import LexiconWatcher
+from cohort_analytics import CohortRefresher
+from analysis_storage import PartitionMaintainer, ensure_analysis_columns, ensure_analysis_partitions
 
-app = FastAPI()
+@asynccontextmanager
+async def lifespan(app):
+    # skin_analyses rows need their month's partition; keep the next few months ready
+    try:
+        ensure_analysis_partitions(engine)
+        ensure_analysis_columns(engine)
+    except Exception as e:
+        print(f"Warning: Could not prepare skin_analyses: {e}")
+    # Rescore the product catalog in the background whenever the lexicon files change
+    lexicon_watcher = LexiconWatcher(SessionLocal).start()
+    # Refresh the cohort analytics materialized views on a schedule
+    cohort_refresher = CohortRefresher(engine).start()
+    # Keep creating skin_analyses partitions as months pass
+    partition_maintainer = PartitionMaintainer(engine).start()
+    yield
+    lexicon_watcher.stop()
+    cohort_refresher.stop()
+    partition_maintainer.stop()
+
+app = FastAPI(lifespan=lifespan)
 
 # CORS Configuration
 app.add_middleware(
@@ -14,14 +40,34 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-DB-Statements", "X-DB-Time-Ms", "ETag", "X-Primary-Until"],
 )
 
+# Read-your-writes pins carried by the client, so reads after a write stay on
+# the primary whichever worker serves them
+app.add_middleware(PrimaryPinMiddleware)
+
+# Request metrics (latency, status codes, in-flight, DB vs upstream AI time,
+# SQL statement counts and the slow query log)
+app.add_middleware(MetricsMiddleware)
+instrument_engine(engine)
+if read_engine is not engine:
+    instrument_engine(read_engine)
+
 # Include routers
 app.include_router(auth_router)
 app.include_router(face_scan_router)
 app.include_router(skincare_router)
 app.include_router(analytics_router)
+app.include_router(compatibility_router)
 
 @app.get("/")
 def read_root():
-    return {"message": "API is running"}
\ No newline at end of file
+    return {"message": "API is running"}
+
+@app.get("/metrics")
+def get_metrics():
+    """
+    Expose request metrics in Prometheus text format
+    """
+    return Response(content=render_latest(), media_type=PROMETHEUS_CONTENT_TYPE)
\ No newline at end of file
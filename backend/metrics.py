@@ -0,0 +1,361 @@
+"""
+Lightweight in-process request metrics exposed in Prometheus text format
+"""
+import contextvars
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+# Latency buckets in seconds - upstream AI calls can take up to a minute
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+_registry = []
+_registry_lock = threading.Lock()
+
+# Per-request state: the ASGI scope, time spent in dependencies (db, ailabtools,
+# gemini) and the number of SQL statements executed
+_request_state = contextvars.ContextVar("request_state", default=None)
+
+slow_query_logger = logging.getLogger("slow_query")
+
+
+def _escape_label(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(labelnames, values, extra=None):
+    pairs = list(zip(labelnames, values))
+    if extra:
+        pairs.extend(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape_label(value)}"' for name, value in pairs) + "}"
+
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+class _Metric:
+    type_name = "untyped"
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+        with _registry_lock:
+            _registry.append(self)
+
+    def _key(self, labels):
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}, got {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def value(self, **labels):
+        with self._lock:
+            return self._values.get(self._key(labels), 0)
+
+    def reset(self):
+        with self._lock:
+            self._values.clear()
+
+    def _samples(self):
+        with self._lock:
+            return [(self.name, key, None, value) for key, value in self._values.items()]
+
+    def render(self):
+        lines = [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} {self.type_name}",
+        ]
+        for sample_name, key, extra, value in self._samples():
+            lines.append(f"{sample_name}{_format_labels(self.labelnames, key, extra)} {_format_value(value)}")
+        return "\n".join(lines)
+
+
+class Counter(_Metric):
+    type_name = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(_Metric):
+    type_name = "gauge"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+
+class Histogram(_Metric):
+    type_name = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = {"counts": [0] * len(self.buckets), "sum": 0.0, "count": 0}
+                self._values[key] = state
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state["counts"][i] += 1
+            state["sum"] += value
+            state["count"] += 1
+
+    def value(self, **labels):
+        with self._lock:
+            state = self._values.get(self._key(labels))
+            return dict(state, counts=list(state["counts"])) if state else None
+
+    def _samples(self):
+        samples = []
+        with self._lock:
+            for key, state in self._values.items():
+                for bound, count in zip(self.buckets, state["counts"]):
+                    samples.append((f"{self.name}_bucket", key, [("le", _format_value(bound))], count))
+                samples.append((f"{self.name}_bucket", key, [("le", "+Inf")], state["count"]))
+                samples.append((f"{self.name}_sum", key, None, state["sum"]))
+                samples.append((f"{self.name}_count", key, None, state["count"]))
+        return samples
+
+
+def render_latest():
+    """
+    Render every registered metric in the Prometheus text exposition format
+    """
+    with _registry_lock:
+        metrics = list(_registry)
+    return "\n".join(metric.render() for metric in metrics) + "\n"
+
+
+PROMETHEUS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+REQUEST_LATENCY = Histogram(
+    "http_request_duration_seconds",
+    "HTTP request latency by route",
+    ["method", "route"],
+)
+REQUESTS_TOTAL = Counter(
+    "http_requests_total",
+    "HTTP requests by route and status code",
+    ["method", "route", "status"],
+)
+REQUESTS_IN_FLIGHT = Gauge(
+    "http_requests_in_flight",
+    "HTTP requests currently being served",
+)
+DEPENDENCY_LATENCY = Histogram(
+    "http_request_dependency_seconds",
+    "Time spent per request in the database and upstream AI calls",
+    ["route", "dependency"],
+)
+DB_STATEMENTS = Histogram(
+    "http_request_db_statements",
+    "SQL statements executed per request",
+    ["route"],
+    buckets=(1, 2, 5, 10, 25, 50, 100, 250, 500, 1000),
+)
+SLOW_QUERIES_TOTAL = Counter(
+    "db_slow_queries_total",
+    "SQL statements slower than the slow query threshold",
+    ["route"],
+)
+UPSTREAM_BREAKER_STATE = Gauge(
+    "upstream_circuit_breaker_state",
+    "Circuit breaker state per upstream (0 closed, 1 half-open, 2 open)",
+    ["dependency"],
+)
+UPSTREAM_RETRIES_TOTAL = Counter(
+    "upstream_retries_total",
+    "Upstream call attempts retried after a transient failure",
+    ["dependency", "reason"],
+)
+UPSTREAM_HEDGES_TOTAL = Counter(
+    "upstream_hedged_requests_total",
+    "Hedged upstream requests sent after the p95 delay, by which attempt won",
+    ["dependency", "winner"],
+)
+UPSTREAM_REJECTED_TOTAL = Counter(
+    "upstream_rejected_total",
+    "Upstream calls failed fast without being sent",
+    ["dependency", "reason"],
+)
+UPSTREAM_RATE_LIMIT_WAIT = Histogram(
+    "upstream_rate_limit_wait_seconds",
+    "Time spent waiting for an upstream rate limit token",
+    ["dependency"],
+)
+
+
+def record_dependency_time(dependency, seconds):
+    """
+    Add time spent in a dependency to the current request, if there is one
+    """
+    state = _request_state.get()
+    if state is not None:
+        timings = state["timings"]
+        timings[dependency] = timings.get(dependency, 0.0) + seconds
+
+
+@contextmanager
+def track_dependency(dependency):
+    """
+    Time a block of work (e.g. an upstream API call) against the current request
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_dependency_time(dependency, time.perf_counter() - start)
+
+
+def _route_template(scope):
+    # Use the route template rather than the raw path to keep label cardinality bounded
+    route = scope.get("route") if scope else None
+    return getattr(route, "path", None) or "unmatched"
+
+
+def describe_params(parameters):
+    """
+    Bound parameters reduced to their types (and lengths for strings/bytes), so
+    slow query logs never carry the values themselves
+    """
+    def shape(value):
+        if isinstance(value, (str, bytes)):
+            return f"{type(value).__name__}[{len(value)}]"
+        return type(value).__name__
+
+    if isinstance(parameters, dict):
+        return repr({key: shape(value) for key, value in parameters.items()})
+    if isinstance(parameters, (list, tuple)):
+        if parameters and isinstance(parameters[0], (dict, list, tuple)):
+            # executemany: describe the first row only
+            return f"{len(parameters)} rows of {describe_params(parameters[0])}"
+        return repr([shape(value) for value in parameters])
+    return shape(parameters)
+
+
+def instrument_engine(engine, slow_query_ms=None):
+    """
+    Attach cursor execution hooks so DB time and statement counts are attributed
+    to the current request, and statements slower than the threshold are logged
+    with their route.
+
+    The threshold defaults to the SLOW_QUERY_MS environment variable (200ms).
+    Bound parameter values are never logged (they include password hashes and
+    tokens); with SLOW_QUERY_LOG_PARAMS=1 their types and lengths are.
+    """
+    # Imported here so modules that only time upstream calls don't pull in SQLAlchemy
+    from sqlalchemy import event
+
+    if slow_query_ms is None:
+        slow_query_ms = float(os.getenv("SLOW_QUERY_MS", "200"))
+    slow_query_seconds = slow_query_ms / 1000
+    log_params = os.getenv("SLOW_QUERY_LOG_PARAMS", "").lower() in ("1", "true", "yes")
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("query_start_time", []).append(time.perf_counter())
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        elapsed = time.perf_counter() - conn.info["query_start_time"].pop()
+        record_dependency_time("db", elapsed)
+
+        state = _request_state.get()
+        if state is not None:
+            state["db_statements"] += 1
+
+        if elapsed >= slow_query_seconds:
+            route = _route_template(state["scope"] if state else None)
+            SLOW_QUERIES_TOTAL.inc(route=route)
+            if log_params:
+                slow_query_logger.warning(
+                    "Slow query (%.1fms) on %s: %s | params=%.500s",
+                    elapsed * 1000, route, " ".join(statement.split()), describe_params(parameters),
+                )
+            else:
+                slow_query_logger.warning(
+                    "Slow query (%.1fms) on %s: %s",
+                    elapsed * 1000, route, " ".join(statement.split()),
+                )
+
+
+def _debug_headers_enabled():
+    return os.getenv("DB_DEBUG_HEADERS", "").lower() in ("1", "true", "yes")
+
+
+class MetricsMiddleware:
+    """
+    ASGI middleware recording latency, status codes, in-flight requests,
+    per-dependency time and SQL statement counts for every HTTP request.
+
+    With DB_DEBUG_HEADERS=1 the statement count and DB time are also returned
+    in X-DB-Statements / X-DB-Time-Ms response headers.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        status = {"code": 500}
+        state = {"scope": scope, "timings": {}, "db_statements": 0}
+        debug_headers = _debug_headers_enabled()
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status["code"] = message["status"]
+                if debug_headers:
+                    db_ms = state["timings"].get("db", 0.0) * 1000
+                    message["headers"] = list(message.get("headers", [])) + [
+                        (b"x-db-statements", str(state["db_statements"]).encode()),
+                        (b"x-db-time-ms", f"{db_ms:.2f}".encode()),
+                    ]
+            await send(message)
+
+        token = _request_state.set(state)
+        REQUESTS_IN_FLIGHT.inc()
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            elapsed = time.perf_counter() - start
+            REQUESTS_IN_FLIGHT.dec()
+            _request_state.reset(token)
+
+            method = scope.get("method", "GET")
+            route = _route_template(scope)
+            REQUEST_LATENCY.observe(elapsed, method=method, route=route)
+            REQUESTS_TOTAL.inc(method=method, route=route, status=status["code"])
+            for dependency, seconds in state["timings"].items():
+                DEPENDENCY_LATENCY.observe(seconds, route=route, dependency=dependency)
+            DB_STATEMENTS.observe(state["db_statements"], route=route)
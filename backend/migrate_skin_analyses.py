@@ -0,0 +1,54 @@
+"""
+Maintenance for the partitioned, JSONB skin_analyses table.
+
+Usage (from backend/):
+    python migrate_skin_analyses.py migrate [--batch-size 10000] [--drop-legacy]
+    python migrate_skin_analyses.py partitions [--months-ahead 3]
+    python migrate_skin_analyses.py archive --before 2025-01
+
+migrate converts a legacy Text-column table online (see analysis_storage.py).
+archive detaches partitions for months before --before; dump them with pg_dump
+and drop them once archived.
+"""
+import argparse
+from datetime import datetime
+
+from sqlalchemy import text
+
+from analysis_storage import (
+    LEGACY_TABLE, PARTITION_MONTHS_AHEAD, archive_partitions, ensure_analysis_partitions, migrate_legacy_analyses
+)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="skin_analyses storage maintenance")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    migrate = subparsers.add_parser("migrate", help="convert a legacy skin_analyses table online")
+    migrate.add_argument("--batch-size", type=int, default=10000)
+    migrate.add_argument("--drop-legacy", action="store_true", help=f"drop {LEGACY_TABLE} after the swap")
+    partitions = subparsers.add_parser("partitions", help="create upcoming monthly partitions")
+    partitions.add_argument("--months-ahead", type=int, default=PARTITION_MONTHS_AHEAD)
+    archive = subparsers.add_parser("archive", help="detach partitions for months before a cutoff")
+    archive.add_argument("--before", required=True, type=lambda value: datetime.strptime(value, "%Y-%m").date(),
+                         help="first month to keep, as YYYY-MM")
+    args = parser.parse_args()
+
+    from db_conn import engine
+
+    if args.command == "migrate":
+        migrate_legacy_analyses(engine, args.batch_size)
+        ensure_analysis_partitions(engine)
+        if args.drop_legacy:
+            with engine.begin() as conn:
+                conn.execute(text(f"DROP TABLE IF EXISTS {LEGACY_TABLE}"))
+            print(f"Dropped {LEGACY_TABLE}")
+    elif args.command == "partitions":
+        if not ensure_analysis_partitions(engine, args.months_ahead):
+            print("skin_analyses is not partitioned yet; run the migrate command first")
+    elif args.command == "archive":
+        detached = archive_partitions(engine, args.before)
+        print(f"Detached {len(detached)} partition(s): {', '.join(detached) or 'none'}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,4 +1,5 @@
-from sqlalchemy import Column, Date, Integer, String, Text, ForeignKey, Boolean, Table, DateTime
+from sqlalchemy import Column, Date, Integer, String, Text, ForeignKey, Boolean, Table, DateTime, Index, text
+from sqlalchemy.dialects.postgresql import JSONB
 from sqlalchemy.orm import relationship
 from sqlalchemy.ext.declarative import declarative_base
 from datetime import datetime, timedelta
@@ -39,6 +40,26 @@ class SkinCareEntry(Base):
     # Relationships
     user = relationship("User", back_populates="entries")
     products = relationship("ProductUsage", back_populates="entry")
+    
+    # Delta sync reads a user's entries changed since a cursor
+    __table_args__ = (
+        Index("ix_skincare_entries_user_updated", "user_id", "updated_at"),
+    )
+
+
+class EntryTombstone(Base):
+    __tablename__ = "entry_tombstones"
+    
+    # Records deleted entries so delta sync can tell clients to drop them
+    id = Column(Integer, primary_key=True, index=True)
+    entry_id = Column(Integer, nullable=False)
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    date = Column(Date, nullable=False)
+    deleted_at = Column(DateTime, default=datetime.utcnow, nullable=False)
+    
+    __table_args__ = (
+        Index("ix_entry_tombstones_user_deleted", "user_id", "deleted_at"),
+    )
 
 
 class ProductUsage(Base):
@@ -54,13 +75,70 @@ class ProductUsage(Base):
     entry = relationship("SkinCareEntry", back_populates="products")
 
 
+class ProductUsageDaily(Base):
+    __tablename__ = "product_usage_daily"
+    
+    # Product uses per user and day, kept in step with product_usage by the
+    # entry endpoints (see product_usage_counters.py)
+    user_id = Column(Integer, ForeignKey("users.id"), primary_key=True)
+    date = Column(Date, primary_key=True)
+    product_name = Column(String, primary_key=True)  # normalized, see product_catalog.normalize_product_name
+    display_name = Column(String, nullable=False)  # as most recently written
+    uses = Column(Integer, nullable=False, default=0)
+
+
+class AnalyticsVersion(Base):
+    __tablename__ = "analytics_versions"
+    
+    # Bumped by every write that changes a user's analytics; part of the
+    # analytics response cache key (see response_cache.py)
+    user_id = Column(Integer, ForeignKey("users.id"), primary_key=True)
+    version = Column(Integer, nullable=False, default=0)
+
+
 class SkinAnalysis(Base):
     __tablename__ = "skin_analyses"
     
-    id = Column(Integer, primary_key=True, index=True)
+    # Partitioned by created_at month (see analysis_storage.py), so the
+    # partition key is part of the primary key
+    id = Column(Integer, primary_key=True, autoincrement=True)
     user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
-    result = Column(Text, nullable=True)  # Store the JSON result as text
-    created_at = Column(DateTime, default=datetime.utcnow, nullable=False)
+    entry_id = Column(Integer, nullable=True)  # skincare entry the summary was written to, if any
+    result = Column(JSONB, nullable=True)  # Full AILabTools response
+    created_at = Column(DateTime, default=datetime.utcnow, nullable=False, primary_key=True)
     
     # Relationships
-    user = relationship("User", back_populates="skin_analyses")
\ No newline at end of file
+    user = relationship("User", back_populates="skin_analyses")
+    
+    __table_args__ = (
+        Index("ix_skin_analyses_user_created", "user_id", "created_at"),
+        # Containment queries, e.g. result @> '{"result": {"acne": {"value": 1}}}'
+        Index("ix_skin_analyses_result", "result", postgresql_using="gin", postgresql_ops={"result": "jsonb_path_ops"}),
+        Index("ix_skin_analyses_skin_type", text("(result #>> '{result,skin_type,skin_type}')")),
+        {"postgresql_partition_by": "RANGE (created_at)"},
+    )
+
+
+class ImageBlob(Base):
+    __tablename__ = "image_blobs"
+    
+    # One row per stored image content (see image_storage.py)
+    digest = Column(String(64), primary_key=True)  # sha256 of the image bytes
+    size = Column(Integer, nullable=False)
+    content_type = Column(String, nullable=False)
+    refcount = Column(Integer, nullable=False, default=0)  # entries whose image_path points here
+    created_at = Column(DateTime, default=datetime.utcnow, nullable=False)
+
+
+class ProductCatalog(Base):
+    __tablename__ = "product_catalog"
+    
+    id = Column(Integer, primary_key=True, index=True)
+    name = Column(String, unique=True, nullable=True, index=True)  # normalized product name
+    display_name = Column(String, nullable=True)
+    image_hash = Column(String(64), unique=True, nullable=True, index=True)  # sha256 of the label image
+    ingredients = Column(Text, nullable=False)  # JSON list of normalized ingredient names
+    compatibility = Column(Text, nullable=False)  # JSON compatibility breakdown
+    lexicon_version = Column(String(64), nullable=False, index=True)  # lexicons the breakdown was scored with
+    created_at = Column(DateTime, default=datetime.utcnow, nullable=False)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow, nullable=False)
@@ -0,0 +1,230 @@
+"""
+Persisted product catalog: each product's normalized ingredient list, label
+image hash and precomputed compatibility breakdown.
+
+Lookups by product name or label image hash skip Gemini extraction entirely.
+Breakdowns record the lexicon version they were scored with; when the lexicon
+files change, a background watcher rescores stored products from their saved
+ingredient lists.
+"""
+import hashlib
+import json
+import logging
+import os
+import re
+import threading
+
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from ingredient_index import index_file_identity
+from ingredient_lexicon import lexicon_version, normalize_ingredient
+from models import ProductCatalog
+from product_compatibility import build_compatibility_index, get_compatibility_index
+
+logger = logging.getLogger(__name__)
+
+# Rows rescored per transaction during a background recompute
+RECOMPUTE_BATCH_SIZE = 500
+
+
+def normalize_product_name(name):
+    """
+    Case- and whitespace-insensitive product name ("CeraVe  Cleanser" -> "cerave cleanser")
+    """
+    if name is None:
+        return None
+    return re.sub(r'\s+', ' ', name).strip().lower() or None
+
+
+def hash_image(file_bytes):
+    return hashlib.sha256(file_bytes).hexdigest()
+
+
+def score_ingredients(ingredients, index=None):
+    """
+    Normalize an ingredient list and compute its compatibility breakdown
+    """
+    index = index or get_compatibility_index()
+    normalized = [normalize_ingredient(i) for i in ingredients if normalize_ingredient(i)]
+    breakdown = index.score_products([normalized])[0]
+    return normalized, breakdown
+
+
+def lookup_product(db: Session, name=None, image_hash=None):
+    """
+    Find a catalog product by label image hash or by normalized name
+    """
+    if image_hash:
+        product = db.query(ProductCatalog).filter(ProductCatalog.image_hash == image_hash).first()
+        if product:
+            return product
+    normalized_name = normalize_product_name(name)
+    if normalized_name:
+        return db.query(ProductCatalog).filter(ProductCatalog.name == normalized_name).first()
+    return None
+
+
+def rescore_product(product, index=None):
+    """
+    Recompute a stored product's breakdown from its saved ingredient list,
+    stamping the lexicon version of the index that actually scored it
+    """
+    index = index or get_compatibility_index()
+    _, breakdown = score_ingredients(json.loads(product.ingredients), index)
+    product.compatibility = json.dumps(breakdown)
+    product.lexicon_version = index.lexicon_version
+
+
+def get_or_create_product(db: Session, file_bytes, filename, name=None):
+    """
+    Return the catalog product for a label image, extracting its ingredients
+    with Gemini only when neither the image hash nor the name is known.
+    Returns (product, from_catalog).
+    """
+    image_hash = hash_image(file_bytes)
+
+    product = lookup_product(db, name=name, image_hash=image_hash)
+    if product:
+        changed = False
+        if product.lexicon_version != lexicon_version():
+            rescore_product(product)
+            changed = True
+        if product.image_hash is None:
+            product.image_hash = image_hash
+            changed = True
+        if changed:
+            db.commit()
+            db.refresh(product)
+        return product, True
+
+    # Imported lazily so catalog hits never load the Gemini client
+    import gemini_extract_text
+    import tempfile
+
+    suffix = os.path.splitext(filename or "")[1] or ".jpg"
+    with tempfile.NamedTemporaryFile(suffix=suffix, delete=False) as tmp:
+        tmp.write(file_bytes)
+        tmp_path = tmp.name
+    try:
+        extracted = gemini_extract_text.extract_text(tmp_path)
+    finally:
+        os.remove(tmp_path)
+
+    index = get_compatibility_index()
+    ingredients, breakdown = score_ingredients(extracted, index)
+    product = ProductCatalog(
+        name=normalize_product_name(name),
+        display_name=name,
+        image_hash=image_hash,
+        ingredients=json.dumps(ingredients),
+        compatibility=json.dumps(breakdown),
+        lexicon_version=index.lexicon_version,
+    )
+    db.add(product)
+    try:
+        db.commit()
+    except IntegrityError:
+        # Another request catalogued the same image or name while we were extracting
+        db.rollback()
+        return lookup_product(db, name=name, image_hash=image_hash), True
+    db.refresh(product)
+    return product, False
+
+
+def serialize_product(product):
+    breakdown = json.loads(product.compatibility)
+    return {
+        "id": product.id,
+        "name": product.display_name or product.name,
+        "image_hash": product.image_hash,
+        "ingredients": json.loads(product.ingredients),
+        "score": round(breakdown["score"], 1),
+        "compatibility": breakdown,
+        "lexicon_version": product.lexicon_version,
+        "updated_at": str(product.updated_at),
+    }
+
+
+def refresh_lexicon_caches():
+    """
+    Drop the in-process indexes built from the lexicon files so they are rebuilt
+    """
+    from fuzzy_index import get_ingredient_corrector
+    from ingredient_matcher import get_ingredient_matcher
+
+    build_compatibility_index.cache_clear()
+    get_ingredient_corrector.cache_clear()
+    get_ingredient_matcher.cache_clear()
+
+
+def recompute_stale_products(session_factory):
+    """
+    Rescore every product whose breakdown was computed with an older lexicon,
+    committing in batches. Returns the number of products rescored.
+    """
+    index = get_compatibility_index()
+    version = index.lexicon_version
+    rescored = 0
+    while True:
+        db = session_factory()
+        try:
+            batch = db.query(ProductCatalog).filter(
+                ProductCatalog.lexicon_version != version
+            ).order_by(ProductCatalog.id).limit(RECOMPUTE_BATCH_SIZE).all()
+            if not batch:
+                return rescored
+            for product in batch:
+                rescore_product(product, index)
+            db.commit()
+            rescored += len(batch)
+        finally:
+            db.close()
+
+
+class LexiconWatcher:
+    """
+    Background thread that polls the lexicon files and the precompiled index
+    file. When either changes it drops the in-process indexes (re-mapping a
+    rebuilt index file), and rescores the catalog on lexicon changes.
+    """
+
+    def __init__(self, session_factory, interval=None):
+        self.session_factory = session_factory
+        self.interval = interval if interval is not None else float(os.getenv("LEXICON_POLL_SECONDS", "60"))
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="lexicon-watcher", daemon=True)
+        self._version = None
+        self._index_identity = index_file_identity()
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+
+    def check(self):
+        index_identity = index_file_identity()
+        if index_identity != self._index_identity:
+            logger.info("Ingredient index file replaced, reloading indexes")
+            refresh_lexicon_caches()
+            self._index_identity = index_identity
+
+        version = lexicon_version()
+        if version != self._version:
+            if self._version is not None:
+                logger.info("Lexicon files changed, rebuilding indexes")
+                refresh_lexicon_caches()
+            rescored = recompute_stale_products(self.session_factory)
+            if rescored:
+                logger.info("Rescored %d catalog products for lexicon %s", rescored, version[:12])
+            self._version = version
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                self.check()
+            except Exception as e:
+                logger.warning("Lexicon watcher check failed: %s", e)
+            self._stop.wait(self.interval)
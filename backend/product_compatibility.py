@@ -1,25 +1,153 @@
-import gemini_extract_text
+from functools import lru_cache
+
+from ingredient_index import load_ingredient_index
+from ingredient_lexicon import FLAG_LEXICONS, ingredient_tokens, lexicon_version, load_lexicons
 
 
 # Takes in an image path, extracts the ingredients using Gemini, and returns a set of ingredients
 def extract_ingredients(image_path):
+    # Imported lazily so scoring alone doesn't pull in the Gemini client
+    import gemini_extract_text
     ingredients = gemini_extract_text.extract_text(image_path)
     return calculate_compatibility(ingredients)
 
 # Takes a list of ingredients and calculates a dictionary of compatibility scores
 def calculate_compatibility(ingredients):
-    # Calculate compatibility as the percentage of shared ingredients
-    bad_ingredients = set()
-    with open('./ingredients/drying_skin.txt', 'r') as file:
-        content = file.read()
-        bad_ingredients.update(content.splitlines())
-    with open('./ingredients/pore_clogging.txt', 'r') as file:
-        content = file.read()
-        bad_ingredients.update(content.lower().splitlines())
-    bad_ingredient_count = 0
-    print(ingredients)
-    for ingredient in ingredients:
-        if any(bad_ingredient.strip().lower() in ingredient.strip().lower() for bad_ingredient in bad_ingredients):
-            bad_ingredient_count += 1
-    compatibility_score = 100 * (1 - bad_ingredient_count / len(ingredients))
-    return compatibility_score
\ No newline at end of file
+    # Compatibility is the percentage of ingredients that don't contain a flagged ingredient
+    return get_compatibility_index().score_products([ingredients])[0]["score"]
+
+
+class CompatibilityIndex:
+    """
+    Flags ingredients against the drying / pore-clogging lexicons using bitsets.
+
+    Each flagged pattern owns one bit. An ingredient is encoded once as the
+    bitset of patterns it contains (matched on word boundaries via n-gram
+    lookups, so encoding cost doesn't grow with the number of patterns), and
+    a batch of products is scored with vectorized AND / OR over those bitsets.
+    """
+
+    def __init__(self, lexicons, lexicon_version=None):
+        self.lexicon_version = lexicon_version  # version of the lexicons this index was built from
+        self.patterns = []  # bit -> (pattern, lexicon)
+        self.pattern_bits = {}  # pattern tokens -> bit
+        for lexicon in FLAG_LEXICONS:
+            for name in lexicons[lexicon]:
+                key = " ".join(ingredient_tokens(name))
+                if key and key not in self.pattern_bits:
+                    self.pattern_bits[key] = len(self.patterns)
+                    self.patterns.append((key, lexicon))
+        self.max_pattern_words = max((len(key.split()) for key in self.pattern_bits), default=1)
+        self.n_words = max(1, (len(self.patterns) + 63) // 64)
+
+        self.flag_mask = self._mask(range(len(self.patterns)))
+        self.lexicon_masks = {
+            lexicon: self._mask(bit for bit, (_, name) in enumerate(self.patterns) if name == lexicon)
+            for lexicon in FLAG_LEXICONS
+        }
+        self._encode = lru_cache(maxsize=65536)(self._encode_uncached)
+        self._decode = lru_cache(maxsize=65536)(self._decode_uncached)
+
+    def _words(self, bits):
+        words = [0] * self.n_words
+        for bit in bits:
+            words[bit // 64] |= 1 << (bit % 64)
+        return tuple(words)
+
+    def _mask(self, bits):
+        # numpy is imported on first use so importing the catalog at startup stays cheap
+        import numpy as np
+        return np.array(self._words(bits), dtype=np.uint64)
+
+    def _encode_uncached(self, ingredient):
+        tokens = ingredient_tokens(ingredient)
+        bits = set()
+        for start in range(len(tokens)):
+            for length in range(1, min(self.max_pattern_words, len(tokens) - start) + 1):
+                bit = self.pattern_bits.get(" ".join(tokens[start:start + length]))
+                if bit is not None:
+                    bits.add(bit)
+        return self._words(bits)
+
+    def encode(self, ingredient):
+        """
+        Bitset (tuple of 64-bit words) of the flagged patterns contained in an ingredient
+        """
+        return self._encode(ingredient)
+
+    def _decode_uncached(self, bitset):
+        matches = []
+        for word_index, word in enumerate(bitset):
+            while word:
+                low = word & -word
+                matches.append(self.patterns[word_index * 64 + low.bit_length() - 1])
+                word ^= low
+        return tuple(matches)
+
+    def decode(self, bitset):
+        """
+        [(pattern, lexicon)] for every bit set in a bitset from encode()
+        """
+        return self._decode(bitset)
+
+    def score_products(self, products):
+        """
+        Score a batch of ingredient lists. Returns one dict per product with the
+        compatibility score, flag counts per lexicon and the offending ingredients.
+        """
+        import numpy as np
+
+        ingredients = [ingredient for product in products for ingredient in product]
+        product_ids = np.repeat(np.arange(len(products)), [len(product) for product in products])
+        vectors = np.array(
+            [self.encode(ingredient) for ingredient in ingredients], dtype=np.uint64
+        ).reshape(len(ingredients), self.n_words)
+
+        flagged = (vectors & self.flag_mask).any(axis=1)
+        flagged_counts = np.bincount(product_ids, weights=flagged, minlength=len(products))
+        lexicon_counts = {
+            lexicon: np.bincount(product_ids, weights=(vectors & mask).any(axis=1), minlength=len(products))
+            for lexicon, mask in self.lexicon_masks.items()
+        }
+
+        results = [
+            {
+                "score": 100.0 if not product else float(100 * (1 - flagged_counts[i] / len(product))),
+                "total_ingredients": len(product),
+                "flagged_count": int(flagged_counts[i]),
+                "flag_counts": {lexicon: int(counts[i]) for lexicon, counts in lexicon_counts.items()},
+                "offending_ingredients": [],
+            }
+            for i, product in enumerate(products)
+        ]
+        for row in np.flatnonzero(flagged):
+            results[int(product_ids[row])]["offending_ingredients"].append({
+                "ingredient": ingredients[row],
+                "matches": [
+                    {"pattern": pattern, "lexicon": lexicon}
+                    for pattern, lexicon in self.decode(self.encode(ingredients[row]))
+                ],
+            })
+        return results
+
+
+@lru_cache(maxsize=1)
+def build_compatibility_index(version):
+    """
+    Build the index for one lexicon version, from the lexicons in the shared
+    precompiled index when it matches, otherwise from the lexicon files
+    """
+    index = load_ingredient_index()
+    if index is not None and index.lexicon_version == version:
+        return CompatibilityIndex(index.lexicons, version)
+    # If the files change while loading, the index carries the older version
+    # and is rebuilt on the next call
+    return CompatibilityIndex(load_lexicons(), version)
+
+
+def get_compatibility_index():
+    """
+    The index for the lexicon files as they are now; rebuilt once per process
+    whenever their version changes
+    """
+    return build_compatibility_index(lexicon_version())
@@ -0,0 +1,157 @@
+"""
+Per-user, per-product, per-day usage counters (product_usage_daily).
+
+The entry endpoints apply the change in a day's product list to the counters
+in the same transaction that writes product_usage, so top-product queries for
+any window are an indexed range sum over (user_id, date) instead of a join and
+GROUP BY over every product_usage row. Product names are counted under
+product_catalog.normalize_product_name, so "CeraVe Cleanser" and
+"cerave  cleanser" aggregate together.
+
+create_tables.py fills the table from existing product_usage rows when it is
+empty; resync it at any time with:
+    python product_usage_counters.py rebuild
+"""
+import argparse
+from collections import Counter
+
+from sqlalchemy import text
+
+from product_catalog import normalize_product_name
+
+# Rows are sorted by product name so concurrent writers lock them in the same order
+APPLY_DELTAS_SQL = """
+INSERT INTO product_usage_daily (user_id, date, product_name, display_name, uses)
+SELECT :user_id, :day, v.product_name, v.display_name, v.uses
+FROM unnest(CAST(:names AS text[]), CAST(:display_names AS text[]), CAST(:deltas AS integer[]))
+    AS v(product_name, display_name, uses)
+ORDER BY v.product_name
+ON CONFLICT (user_id, date, product_name) DO UPDATE
+SET uses = product_usage_daily.uses + EXCLUDED.uses,
+    display_name = CASE WHEN EXCLUDED.uses > 0 THEN EXCLUDED.display_name
+                        ELSE product_usage_daily.display_name END
+"""
+
+DELETE_EMPTY_SQL = """
+DELETE FROM product_usage_daily
+WHERE user_id = :user_id AND date = :day AND product_name = ANY(CAST(:names AS text[])) AND uses <= 0
+"""
+
+TOP_PRODUCTS_SQL = """
+SELECT product_name,
+       (array_agg(display_name ORDER BY date DESC))[1] AS display_name,
+       sum(uses) AS uses
+FROM product_usage_daily
+WHERE user_id = :user_id AND date >= :start AND date <= :end
+GROUP BY product_name
+ORDER BY uses DESC, product_name
+LIMIT :limit
+"""
+
+# Same normalization as normalize_product_name: collapse whitespace, trim, lowercase
+NORMALIZED_NAME_SQL = "nullif(lower(btrim(regexp_replace(p.product_name, '\\s+', ' ', 'g'))), '')"
+
+REBUILD_SQL = f"""
+INSERT INTO product_usage_daily (user_id, date, product_name, display_name, uses)
+SELECT e.user_id, e.date, {NORMALIZED_NAME_SQL},
+       (array_agg(p.product_name ORDER BY p.id DESC))[1],
+       count(*)
+FROM product_usage p
+JOIN skincare_entries e ON e.id = p.entry_id
+WHERE {NORMALIZED_NAME_SQL} IS NOT NULL {{user_filter}}
+GROUP BY e.user_id, e.date, {NORMALIZED_NAME_SQL}
+"""
+
+
+def count_products(product_names):
+    """
+    {normalized name: (uses, name as written last)}
+    """
+    counts = Counter()
+    display_names = {}
+    for name in product_names:
+        normalized = normalize_product_name(name)
+        if normalized:
+            counts[normalized] += 1
+            display_names[normalized] = name
+    return {normalized: (uses, display_names[normalized]) for normalized, uses in counts.items()}
+
+
+def apply_product_usage(db, user_id, day, added=(), removed=()):
+    """
+    Move one day's counters from the `removed` product names to the `added`
+    ones. Runs in the caller's transaction; the caller commits.
+    """
+    deltas = {}
+    for normalized, (uses, display_name) in count_products(added).items():
+        deltas[normalized] = (uses, display_name)
+    for normalized, (uses, display_name) in count_products(removed).items():
+        current, current_display = deltas.get(normalized, (0, display_name))
+        deltas[normalized] = (current - uses, current_display)
+    names = sorted(name for name, (delta, _) in deltas.items() if delta)
+    if not names:
+        return
+
+    params = {"user_id": user_id, "day": day, "names": names}
+    db.execute(text(APPLY_DELTAS_SQL), dict(
+        params,
+        display_names=[deltas[name][1] for name in names],
+        deltas=[deltas[name][0] for name in names],
+    ))
+    if any(deltas[name][0] < 0 for name in names):
+        db.execute(text(DELETE_EMPTY_SQL), params)
+
+
+def top_products(db, user_id, start, end, limit=10):
+    """
+    [(display name, uses)] of a user's most used products between start and end (inclusive)
+    """
+    rows = db.execute(text(TOP_PRODUCTS_SQL), {
+        "user_id": user_id, "start": start, "end": end, "limit": limit,
+    }).all()
+    return [(row.display_name, int(row.uses)) for row in rows]
+
+
+def rebuild_product_usage_counters(engine, user_id=None):
+    """
+    Recompute the counters from product_usage (all users, or one). Returns the
+    number of counter rows written.
+    """
+    with engine.begin() as conn:
+        conn.execute(text("LOCK TABLE product_usage_daily IN EXCLUSIVE MODE"))
+        if user_id is None:
+            conn.execute(text("DELETE FROM product_usage_daily"))
+        else:
+            conn.execute(text("DELETE FROM product_usage_daily WHERE user_id = :user_id"), {"user_id": user_id})
+        sql = REBUILD_SQL.replace("{user_filter}", "" if user_id is None else "AND e.user_id = :user_id")
+        return conn.execute(text(sql), {"user_id": user_id}).rowcount
+
+
+def fill_product_usage_counters(engine):
+    """
+    Build the counters from product_usage if the table is still empty (i.e.
+    right after it was created). Returns the rows written, or None if it
+    already had counters.
+    """
+    with engine.connect() as conn:
+        if conn.execute(text("SELECT EXISTS (SELECT 1 FROM product_usage_daily)")).scalar():
+            return None
+    return rebuild_product_usage_counters(engine)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("command", choices=["rebuild"])
+    parser.add_argument("--user-id", type=int, help="only this user's counters")
+    args = parser.parse_args()
+
+    from db_conn import engine
+    from models import ProductUsageDaily
+
+    ProductUsageDaily.__table__.create(engine, checkfirst=True)
+    rows = rebuild_product_usage_counters(engine, args.user_id)
+    print(f"Rebuilt {rows} product usage counter rows")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,56 @@
+"""
+Report per-module import time for the app (or any module) on a cold start.
+
+Runs a fresh interpreter with `python -X importtime`, so nothing imported by
+this script skews the result.
+
+Usage: python profile_startup.py [--module main] [--top 25] [--sort cumulative|self]
+"""
+import argparse
+import re
+import subprocess
+import sys
+
+IMPORTTIME_LINE = re.compile(r"^import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)$")
+
+
+def profile_imports(module):
+    """
+    Import `module` in a new interpreter and return [(name, self_us, cumulative_us, depth)]
+    """
+    completed = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        capture_output=True,
+        text=True,
+    )
+    if completed.returncode != 0:
+        raise RuntimeError(f"Importing {module} failed:\n{completed.stderr}")
+
+    rows = []
+    for line in completed.stderr.splitlines():
+        match = IMPORTTIME_LINE.match(line)
+        if match:
+            self_us, cumulative_us, indent, name = match.groups()
+            rows.append((name, int(self_us), int(cumulative_us), len(indent) // 2))
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--module", default="main", help="module to import (default: main)")
+    parser.add_argument("--top", type=int, default=25, help="number of modules to show")
+    parser.add_argument("--sort", choices=["cumulative", "self"], default="cumulative")
+    args = parser.parse_args()
+
+    rows = profile_imports(args.module)
+    total_us = next((cumulative for name, _, cumulative, _ in rows if name == args.module), 0)
+    sort_index = 2 if args.sort == "cumulative" else 1
+
+    print(f"Cold import of {args.module}: {total_us / 1000:.1f}ms across {len(rows)} modules")
+    print(f"{'module':50} {'self ms':>10} {'cumul ms':>10}")
+    for name, self_us, cumulative_us, depth in sorted(rows, key=lambda r: r[sort_index], reverse=True)[:args.top]:
+        print(f"{name:50} {self_us / 1000:10.1f} {cumulative_us / 1000:10.1f}")
+
+
+if __name__ == "__main__":
+    main()
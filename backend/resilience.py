@@ -0,0 +1,411 @@
+"""
+Tail-latency protection for upstream API calls (AILabTools, Gemini).
+
+Every call to an upstream goes through its UpstreamPolicy, which combines:
+  - a token bucket matched to the API quota, so bursts wait briefly here
+    instead of being throttled upstream
+  - a circuit breaker that fails fast while the upstream keeps failing, and
+    lets one trial call through once it has cooled down
+  - bounded retries of transient failures (timeouts, connection errors, 429
+    and 5xx) with full-jitter exponential backoff, all within one deadline
+  - optionally, a hedged second request when an attempt runs past the p95
+    latency seen for that upstream; whichever answers first wins
+
+Configuration per upstream, shown for AILabTools (GEMINI_* for Gemini):
+    AILABTOOLS_RATE_PER_SEC      sustained requests per second (0 = unlimited)
+    AILABTOOLS_BURST             requests allowed back to back
+    AILABTOOLS_ATTEMPT_TIMEOUT   seconds per attempt
+    AILABTOOLS_DEADLINE          seconds for the whole call, waits included
+    AILABTOOLS_MAX_ATTEMPTS      attempts per call, including the first
+    AILABTOOLS_BREAKER_FAILURES  consecutive failures that open the breaker
+    AILABTOOLS_BREAKER_RESET     seconds the breaker stays open
+    AILABTOOLS_HEDGE             1 to hedge slow attempts (the call must be idempotent)
+"""
+import contextvars
+import logging
+import os
+import queue
+import random
+import sys
+import threading
+import time
+from collections import deque
+
+from metrics import (
+    UPSTREAM_BREAKER_STATE,
+    UPSTREAM_HEDGES_TOTAL,
+    UPSTREAM_RATE_LIMIT_WAIT,
+    UPSTREAM_REJECTED_TOTAL,
+    UPSTREAM_RETRIES_TOTAL,
+)
+
+logger = logging.getLogger(__name__)
+
+UPSTREAM_DEFAULTS = {
+    "ailabtools": {
+        "rate_per_sec": 2.0,
+        "burst": 4,
+        "attempt_timeout": 20.0,
+        "deadline": 45.0,
+        "max_attempts": 3,
+    },
+    # Gemini free tier: 15 requests per minute
+    "gemini": {
+        "rate_per_sec": 0.25,
+        "burst": 5,
+        "attempt_timeout": 30.0,
+        "deadline": 60.0,
+        "max_attempts": 3,
+    },
+}
+
+RETRYABLE_STATUSES = {408, 425, 429}
+
+# Exception classes (by module) that mean the request may not have been served,
+# checked only when that client library has already been imported
+TRANSIENT_EXCEPTIONS = {
+    "requests": ("Timeout", "ConnectionError"),
+    "httpx": ("TimeoutException", "NetworkError", "RemoteProtocolError"),
+}
+
+# Don't start an attempt with less time than this left before the deadline
+MIN_ATTEMPT_SECONDS = 1.0
+
+# Successful attempt latencies kept per upstream, and how many are needed
+# before the p95 is trusted for hedging
+LATENCY_WINDOW = 200
+MIN_HEDGE_SAMPLES = 20
+
+CLOSED, HALF_OPEN, OPEN = "closed", "half_open", "open"
+BREAKER_STATE_VALUES = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+
+class UpstreamUnavailable(Exception):
+    """
+    A call failed fast without being sent upstream
+    """
+
+    reason = "unavailable"
+
+    def __init__(self, dependency, message, retry_after=None):
+        super().__init__(message)
+        self.dependency = dependency
+        self.retry_after = retry_after
+
+
+class CircuitOpen(UpstreamUnavailable):
+    reason = "circuit_open"
+
+    def __init__(self, dependency, retry_after):
+        super().__init__(
+            dependency,
+            f"{dependency} is failing; not retrying for another {retry_after:.0f}s",
+            retry_after,
+        )
+
+
+class RateLimited(UpstreamUnavailable):
+    reason = "rate_limited"
+
+    def __init__(self, dependency):
+        super().__init__(dependency, f"{dependency} rate limit reached; no capacity before the deadline")
+
+
+class UpstreamHTTPError(Exception):
+    """
+    An upstream answered with an error status
+    """
+
+    def __init__(self, message, status_code):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+def error_status(error):
+    # requests/UpstreamHTTPError use status_code, google.genai's APIError uses code
+    for attr in ("status_code", "code"):
+        status = getattr(error, attr, None)
+        if isinstance(status, int):
+            return status
+    return None
+
+
+def is_transient(error):
+    """
+    Whether retrying the same request may succeed
+    """
+    if isinstance(error, (TimeoutError, ConnectionError)):
+        return True
+    status = error_status(error)
+    if status is not None:
+        return status in RETRYABLE_STATUSES or status >= 500
+    for module_name, class_names in TRANSIENT_EXCEPTIONS.items():
+        module = sys.modules.get(module_name)
+        if module is None:
+            continue
+        classes = tuple(getattr(module, name) for name in class_names if hasattr(module, name))
+        if classes and isinstance(error, classes):
+            return True
+    return False
+
+
+def retry_reason(error):
+    status = error_status(error)
+    return str(status) if status is not None else type(error).__name__
+
+
+class TokenBucket:
+    """
+    rate tokens per second, up to burst saved up. Tokens are reserved ahead,
+    so waiting callers are served in arrival order without polling.
+    """
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.capacity = max(burst, 1)
+        self.tokens = float(self.capacity)
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def reserve(self, max_wait):
+        """
+        Take a token and return how long to wait before using it, or None
+        (taking nothing) if that wait would be longer than max_wait
+        """
+        if self.rate <= 0:
+            return 0.0
+        with self._lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            wait = 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+            if wait > max_wait:
+                return None
+            self.tokens -= 1
+            return wait
+
+
+class CircuitBreaker:
+    """
+    Opens after failure_threshold consecutive failures. After reset_timeout
+    one trial call is let through (half-open): success closes the breaker,
+    failure opens it again.
+    """
+
+    def __init__(self, name, failure_threshold, reset_timeout):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = 0.0
+        self.trial_in_flight = False
+        self._lock = threading.Lock()
+        self._set_state(CLOSED)
+
+    def _set_state(self, state):
+        if hasattr(self, "state"):
+            logger.warning("%s circuit breaker %s -> %s", self.name, self.state, state)
+        self.state = state
+        UPSTREAM_BREAKER_STATE.set(BREAKER_STATE_VALUES[state], dependency=self.name)
+
+    def retry_after(self):
+        return max(0.0, self.opened_at + self.reset_timeout - time.monotonic())
+
+    def allow(self):
+        with self._lock:
+            if self.state == OPEN:
+                if self.retry_after() > 0:
+                    return False
+                self._set_state(HALF_OPEN)
+            if self.state == HALF_OPEN:
+                if self.trial_in_flight:
+                    return False
+                self.trial_in_flight = True
+            return True
+
+    def release(self):
+        """
+        Give back an allowed call that was never sent
+        """
+        with self._lock:
+            self.trial_in_flight = False
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.trial_in_flight = False
+            if self.state != CLOSED:
+                self._set_state(CLOSED)
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            self.trial_in_flight = False
+            if self.state == HALF_OPEN or (self.state == CLOSED and self.failures >= self.failure_threshold):
+                self.opened_at = time.monotonic()
+                self._set_state(OPEN)
+
+
+class UpstreamPolicy:
+    def __init__(self, name, rate_per_sec, burst, attempt_timeout, deadline, max_attempts,
+                 breaker_failures=5, breaker_reset=30.0, hedge=False,
+                 base_backoff=0.5, max_backoff=8.0):
+        self.name = name
+        self.limiter = TokenBucket(rate_per_sec, burst)
+        self.breaker = CircuitBreaker(name, breaker_failures, breaker_reset)
+        self.attempt_timeout = attempt_timeout
+        self.deadline = deadline
+        self.max_attempts = max(max_attempts, 1)
+        self.hedge = hedge
+        self.base_backoff = base_backoff
+        self.max_backoff = max_backoff
+        self._latencies = deque(maxlen=LATENCY_WINDOW)
+        self._latency_lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls, name):
+        prefix = name.upper()
+        defaults = UPSTREAM_DEFAULTS.get(name, UPSTREAM_DEFAULTS["ailabtools"])
+
+        def setting(key, default, cast=float):
+            return cast(os.getenv(f"{prefix}_{key}", default))
+
+        return cls(
+            name,
+            rate_per_sec=setting("RATE_PER_SEC", defaults["rate_per_sec"]),
+            burst=setting("BURST", defaults["burst"], int),
+            attempt_timeout=setting("ATTEMPT_TIMEOUT", defaults["attempt_timeout"]),
+            deadline=setting("DEADLINE", defaults["deadline"]),
+            max_attempts=setting("MAX_ATTEMPTS", defaults["max_attempts"], int),
+            breaker_failures=setting("BREAKER_FAILURES", 5, int),
+            breaker_reset=setting("BREAKER_RESET", 30.0),
+            hedge=os.getenv(f"{prefix}_HEDGE", "0") == "1",
+        )
+
+    def hedge_delay(self):
+        """
+        p95 latency of recent successful attempts, or None when not hedging
+        """
+        if not self.hedge:
+            return None
+        with self._latency_lock:
+            if len(self._latencies) < MIN_HEDGE_SAMPLES:
+                return None
+            ordered = sorted(self._latencies)
+        return ordered[int(0.95 * (len(ordered) - 1))]
+
+    def _timed(self, fn, timeout):
+        started = time.perf_counter()
+        result = fn(timeout)
+        with self._latency_lock:
+            self._latencies.append(time.perf_counter() - started)
+        return result
+
+    def _attempt(self, fn, timeout):
+        hedge_after = self.hedge_delay()
+        if hedge_after is None or hedge_after >= timeout:
+            return self._timed(fn, timeout)
+
+        # Attempts run in their own threads (with the caller's context, so
+        # dependency timings still land on the request) and report back here
+        results = queue.Queue()
+        started = time.monotonic()
+
+        def launch(label):
+            context = contextvars.copy_context()
+
+            def target():
+                try:
+                    results.put((label, True, context.run(self._timed, fn, timeout)))
+                except Exception as e:
+                    results.put((label, False, e))
+
+            threading.Thread(target=target, name=f"{self.name}-{label}", daemon=True).start()
+
+        launch("primary")
+        launched, finished, error = 1, 0, None
+        while finished < launched:
+            if launched == 1:
+                wait = hedge_after - (time.monotonic() - started)
+            else:
+                wait = timeout - (time.monotonic() - started)
+            try:
+                label, ok, value = results.get(timeout=max(wait, 0))
+            except queue.Empty:
+                if launched == 1:
+                    # Only hedge while healthy and within quota
+                    if self.breaker.state == CLOSED and self.limiter.reserve(max_wait=0) == 0:
+                        launch("hedge")
+                        launched = 2
+                    else:
+                        hedge_after = timeout
+                    continue
+                raise TimeoutError(f"{self.name} attempt timed out after {timeout:.0f}s")
+            finished += 1
+            if ok:
+                if launched == 2:
+                    UPSTREAM_HEDGES_TOTAL.inc(dependency=self.name, winner=label)
+                return value
+            error = value
+        raise error
+
+    def call(self, fn, on_retry=None):
+        """
+        Return fn(timeout) under this policy. fn makes one upstream attempt
+        within timeout seconds and raises on failure; it may be retried and,
+        when hedging, run twice concurrently. on_retry(attempt, reason) is
+        called before each retry.
+        """
+        deadline = time.monotonic() + self.deadline
+        attempt = 0
+        while True:
+            attempt += 1
+            if not self.breaker.allow():
+                UPSTREAM_REJECTED_TOTAL.inc(dependency=self.name, reason=CircuitOpen.reason)
+                raise CircuitOpen(self.name, self.breaker.retry_after())
+
+            wait = self.limiter.reserve(max_wait=deadline - time.monotonic() - MIN_ATTEMPT_SECONDS)
+            if wait is None:
+                self.breaker.release()
+                UPSTREAM_REJECTED_TOTAL.inc(dependency=self.name, reason=RateLimited.reason)
+                raise RateLimited(self.name)
+            UPSTREAM_RATE_LIMIT_WAIT.observe(wait, dependency=self.name)
+            if wait:
+                time.sleep(wait)
+
+            timeout = min(self.attempt_timeout, deadline - time.monotonic())
+            try:
+                result = self._attempt(fn, timeout)
+            except Exception as e:
+                if not is_transient(e):
+                    # The upstream answered; the request itself was rejected
+                    self.breaker.record_success()
+                    raise
+                self.breaker.record_failure()
+                backoff = random.uniform(0, min(self.max_backoff, self.base_backoff * 2 ** (attempt - 1)))
+                if (attempt >= self.max_attempts
+                        or time.monotonic() + backoff > deadline - MIN_ATTEMPT_SECONDS):
+                    raise
+                reason = retry_reason(e)
+                UPSTREAM_RETRIES_TOTAL.inc(dependency=self.name, reason=reason)
+                logger.warning("%s attempt %d failed (%s), retrying in %.1fs", self.name, attempt, reason, backoff)
+                if on_retry:
+                    on_retry(attempt, reason)
+                time.sleep(backoff)
+                continue
+            self.breaker.record_success()
+            return result
+
+
+_policies = {}
+_policies_lock = threading.Lock()
+
+
+def get_upstream_policy(name):
+    """
+    The shared policy for an upstream, configured from the environment on first use
+    """
+    with _policies_lock:
+        if name not in _policies:
+            _policies[name] = UpstreamPolicy.from_env(name)
+        return _policies[name]
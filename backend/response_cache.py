@@ -0,0 +1,142 @@
+"""
+Per-user response cache for the analytics endpoints.
+
+Cached results are keyed by endpoint, query params and a per-user version
+counter. Every write that can change a user's analytics (entry create /
+update / delete, image upload, AI analysis) bumps that counter, so results
+computed before the write can never be served after it.
+
+The counters are rows in analytics_versions, bumped inside the write's own
+transaction and read through the request's session. Every worker process
+therefore sees a write's new version as soon as the write itself is visible,
+even though each worker caches results in its own memory.
+"""
+import os
+import threading
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from datetime import date
+
+from sqlalchemy import text
+
+from metrics import Counter
+
+CACHE_REQUESTS = Counter(
+    "analytics_cache_requests_total",
+    "Analytics response cache lookups by endpoint and result",
+    ["endpoint", "result"],
+)
+
+
+GET_VERSION_SQL = "SELECT version FROM analytics_versions WHERE user_id = :user_id"
+
+BUMP_VERSION_SQL = """
+INSERT INTO analytics_versions (user_id, version) VALUES (:user_id, 1)
+ON CONFLICT (user_id) DO UPDATE SET version = analytics_versions.version + 1
+"""
+
+
+class CacheBackend(ABC):
+    """
+    Storage interface for cached responses
+    """
+
+    @abstractmethod
+    def get(self, key):
+        ...
+
+    @abstractmethod
+    def set(self, key, value):
+        ...
+
+    @abstractmethod
+    def clear(self):
+        ...
+
+
+class LRUCacheBackend(CacheBackend):
+    """
+    In-process LRU backend, bounded by number of cached responses
+    """
+
+    def __init__(self, max_entries=1024):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            if key not in self._entries:
+                return None
+            self._entries.move_to_end(key)
+            return self._entries[key]
+
+    def set(self, key, value):
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+class ResponseCache:
+    def __init__(self, backend):
+        self.backend = backend
+        self._stats = {}
+        self._stats_lock = threading.Lock()
+
+    def _record(self, endpoint, result):
+        CACHE_REQUESTS.inc(endpoint=endpoint, result=result)
+        with self._stats_lock:
+            stats = self._stats.setdefault(endpoint, {"hit": 0, "miss": 0})
+            stats[result] += 1
+
+    def get_version(self, db, user_id):
+        return db.execute(text(GET_VERSION_SQL), {"user_id": user_id}).scalar() or 0
+
+    def get_or_compute(self, db, user_id, endpoint, params, compute):
+        """
+        Return the cached result for (user, endpoint, params), computing and
+        storing it on a miss. The version is read before computing, so a write
+        that lands mid-computation bumps past the key we store under.
+        """
+        version = self.get_version(db, user_id)
+        # Include today's date since the endpoints' date windows end today
+        key = (endpoint, user_id, version, date.today().isoformat(), tuple(sorted(params.items())))
+
+        cached = self.backend.get(key)
+        if cached is not None:
+            self._record(endpoint, "hit")
+            return cached
+
+        self._record(endpoint, "miss")
+        result = compute()
+        self.backend.set(key, result)
+        return result
+
+    def invalidate_user(self, db, user_id):
+        """
+        Invalidate every cached result for a user, in every worker. Call inside
+        the write's transaction, before it commits; the caller commits.
+        """
+        db.execute(text(BUMP_VERSION_SQL), {"user_id": user_id})
+
+    def stats(self):
+        with self._stats_lock:
+            counts = {endpoint: dict(c) for endpoint, c in self._stats.items()}
+        stats = {}
+        for endpoint, c in counts.items():
+            total = c["hit"] + c["miss"]
+            stats[endpoint] = {
+                "hits": c["hit"],
+                "misses": c["miss"],
+                "hit_ratio": round(c["hit"] / total, 4) if total else 0.0,
+            }
+        return stats
+
+
+analytics_cache = ResponseCache(LRUCacheBackend(int(os.getenv("ANALYTICS_CACHE_SIZE", "1024"))))
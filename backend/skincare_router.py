@@ -1,13 +1,18 @@
-from fastapi import APIRouter, Depends, HTTPException, UploadFile, File, Form
-from fastapi.responses import FileResponse
-from sqlalchemy.orm import Session
-from db_conn import SessionLocal
-from models import SkinCareEntry, ProductUsage, User
+from fastapi import APIRouter, Depends, HTTPException, UploadFile, File, Form, Header, Response
+from fastapi.responses import ORJSONResponse
+from sqlalchemy import delete, func
+from sqlalchemy.orm import Session, selectinload
+from db_conn import SessionLocal, primary_pins, read_session
+from models import SkinCareEntry, ProductUsage, User, EntryTombstone
+from response_cache import analytics_cache
+from starlette.concurrency import run_in_threadpool
+from image_storage import add_image_reference, release_image_reference, serve_image
+from product_usage_counters import apply_product_usage
 from pydantic import BaseModel
 from typing import List, Optional, Dict
-from datetime import date, datetime
+from datetime import date, datetime, timedelta, timezone
+import hashlib
 import os
-import shutil
 
 router = APIRouter(prefix="/skincare", tags=["skincare"])
 
@@ -47,6 +52,37 @@ class CalendarEntryResponse(BaseModel):
     skin_condition: Optional[str]
     has_image: bool
 
+class SyncedEntry(BaseModel):
+    id: int
+    date: date
+    skin_condition: Optional[str]
+    notes: Optional[str]
+    image_path: Optional[str]
+    analysis_result: Optional[str]
+    products: List[ProductCreate]
+    updated_at: datetime
+
+class DeletedEntry(BaseModel):
+    id: int
+    date: date
+    deleted_at: datetime
+
+class SyncResponse(BaseModel):
+    cursor: Optional[str]
+    full: bool  # True when entries is a full snapshot and local data should be replaced
+    entries: List[SyncedEntry]
+    deleted: List[DeletedEntry]
+
+# Tombstones older than this are pruned; a cursor older than that gets a full snapshot
+TOMBSTONE_RETENTION_DAYS = int(os.getenv("TOMBSTONE_RETENTION_DAYS", "90"))
+
+# Each sync re-sends changes this far behind the cursor. updated_at is stamped
+# by whichever app server handled the write, before its transaction commits, so
+# a change can become visible after a later-stamped one has already been synced;
+# the overlap covers slow transactions and clock skew between servers.
+# Clients apply entries and deletions by id, so repeats are harmless.
+SYNC_OVERLAP_SECONDS = int(os.getenv("SYNC_OVERLAP_SECONDS", "120"))
+
 # Dependency
 def get_db():
     db = SessionLocal()
@@ -59,15 +95,48 @@ def get_db():
 def get_current_user_id():
     return 1
 
+# Read-only endpoints use the replica unless the user has just written
+def get_read_db():
+    db = read_session(get_current_user_id())
+    try:
+        yield db
+    finally:
+        db.close()
+
+def calendar_etag(db: Session, user_id: int):
+    """
+    Weak ETag for a user's calendar from aggregates only (entry count, last
+    update, last delete), so unchanged calendars are answered without loading rows
+    """
+    count, last_update = db.query(
+        func.count(SkinCareEntry.id), func.max(SkinCareEntry.updated_at)
+    ).filter(SkinCareEntry.user_id == user_id).one()
+    last_delete = db.query(func.max(EntryTombstone.deleted_at)).filter(
+        EntryTombstone.user_id == user_id
+    ).scalar()
+    digest = hashlib.sha1(f"{user_id}:{count}:{last_update}:{last_delete}".encode()).hexdigest()
+    return f'W/"{digest[:20]}"'
+
 # Get all calendar entries for a user
-@router.get("/calendar/entries")
-async def get_calendar_entries(db: Session = Depends(get_db)):
+# The payload grows with every day logged, so it is encoded with orjson and
+# returned directly; response_model only documents the shape and is not re-validated
+@router.get("/calendar/entries", response_model=Dict[str, CalendarEntryResponse])
+async def get_calendar_entries(
+    if_none_match: Optional[str] = Header(None),
+    db: Session = Depends(get_read_db)
+):
     """
     Returns all entries for the calendar view
     Format: {date: {id, skin_condition, has_image}}
+    Supports If-None-Match: an unchanged calendar returns 304 with no body.
     """
     user_id = get_current_user_id()
     
+    etag = calendar_etag(db, user_id)
+    headers = {"ETag": etag, "Cache-Control": "private, no-cache"}
+    if if_none_match and etag in [tag.strip() for tag in if_none_match.split(",")]:
+        return Response(status_code=304, headers=headers)
+    
     entries = db.query(SkinCareEntry).filter(
         SkinCareEntry.user_id == user_id
     ).all()
@@ -80,7 +149,84 @@ async def get_calendar_entries(db: Session = Depends(get_db)):
             "has_image": entry.image_path is not None
         }
     
-    return calendar_data
+    return ORJSONResponse(calendar_data, headers=headers)
+
+def parse_sync_cursor(cursor: str):
+    """
+    Cursor as a naive UTC datetime (timestamps are stored naive in UTC);
+    offset-aware cursors are converted
+    """
+    try:
+        since_time = datetime.fromisoformat(cursor)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid sync cursor")
+    if since_time.tzinfo is not None:
+        since_time = since_time.astimezone(timezone.utc).replace(tzinfo=None)
+    return since_time
+
+# Delta sync for the calendar and entries
+@router.get("/sync", response_model=SyncResponse)
+async def sync_entries(since: Optional[str] = None, db: Session = Depends(get_db)):
+    """
+    Returns entries created or updated, and ids of entries deleted, since the
+    cursor from the previous sync. Without a cursor (or with one older than the
+    tombstone retention window) returns every entry with full=true.
+    Pass the returned cursor as ?since= on the next call. Changes from the last
+    SYNC_OVERLAP_SECONDS before the cursor are sent again.
+    """
+    user_id = get_current_user_id()
+    
+    since_time = parse_sync_cursor(since) if since else None
+    if since_time and since_time < datetime.utcnow() - timedelta(days=TOMBSTONE_RETENTION_DAYS):
+        since_time = None
+    
+    entries_query = db.query(SkinCareEntry).options(
+        selectinload(SkinCareEntry.products)
+    ).filter(SkinCareEntry.user_id == user_id)
+    deleted = []
+    if since_time:
+        changed_after = since_time - timedelta(seconds=SYNC_OVERLAP_SECONDS)
+        entries_query = entries_query.filter(SkinCareEntry.updated_at >= changed_after)
+        deleted = db.query(EntryTombstone).filter(
+            EntryTombstone.user_id == user_id,
+            EntryTombstone.deleted_at >= changed_after
+        ).order_by(EntryTombstone.deleted_at, EntryTombstone.id).all()
+    entries = entries_query.order_by(SkinCareEntry.updated_at, SkinCareEntry.id).all()
+    
+    # The next cursor is the latest change returned, never moving backwards
+    changed_at = [entry.updated_at for entry in entries if entry.updated_at] + [t.deleted_at for t in deleted]
+    if since_time:
+        changed_at.append(since_time)
+    cursor = max(changed_at).isoformat() if changed_at else None
+    
+    return ORJSONResponse({
+        "cursor": cursor,
+        "full": since_time is None,
+        "entries": [
+            {
+                "id": entry.id,
+                "date": str(entry.date),
+                "skin_condition": entry.skin_condition,
+                "notes": entry.notes,
+                "image_path": entry.image_path,
+                "analysis_result": entry.analysis_result,
+                "products": [
+                    {
+                        "product_name": p.product_name,
+                        "product_type": p.product_type,
+                        "time_of_day": p.time_of_day
+                    }
+                    for p in entry.products
+                ],
+                "updated_at": entry.updated_at.isoformat() if entry.updated_at else None
+            }
+            for entry in entries
+        ],
+        "deleted": [
+            {"id": t.entry_id, "date": str(t.date), "deleted_at": t.deleted_at.isoformat()}
+            for t in deleted
+        ]
+    })
 
 # Get entry by date
 @router.get("/entries/{date_str}")
@@ -157,10 +303,9 @@ async def create_entry(entry_data: EntryCreate, db: Session = Depends(get_db)):
         analysis_result=entry_data.analysis_result  # ← ADDED
     )
     db.add(new_entry)
-    db.commit()
-    db.refresh(new_entry)
+    db.flush()
     
-    # Add products
+    # Add products in the same transaction, so the entry's updated_at covers them
     if entry_data.products:
         print(f"DEBUG: Creating {len(entry_data.products)} products for entry {new_entry.id}")
         for product in entry_data.products:
@@ -172,10 +317,14 @@ async def create_entry(entry_data: EntryCreate, db: Session = Depends(get_db)):
                 time_of_day=product.time_of_day
             )
             db.add(product_usage)
-        db.commit()
-        print(f"DEBUG: Products committed to database")
+        apply_product_usage(db, user_id, new_entry.date, added=[p.product_name for p in entry_data.products])
     else:
         print(f"DEBUG: No products in entry_data. entry_data.products={entry_data.products}")
+    analytics_cache.invalidate_user(db, user_id)
+    db.commit()
+    db.refresh(new_entry)
+    
+    primary_pins.pin(user_id)
     
     return {
         "id": new_entry.id,
@@ -198,10 +347,11 @@ async def update_entry(
     """
     user_id = get_current_user_id()
     
+    # Locked so concurrent updates of one entry replace its products one after another
     entry = db.query(SkinCareEntry).filter(
         SkinCareEntry.id == entry_id,
         SkinCareEntry.user_id == user_id
-    ).first()
+    ).with_for_update().first()
     
     if not entry:
         raise HTTPException(status_code=404, detail="Entry not found")
@@ -213,16 +363,19 @@ async def update_entry(
         entry.notes = entry_data.notes
     if entry_data.analysis_result is not None:  # ← ADDED
         entry.analysis_result = entry_data.analysis_result
+    analytics_cache.invalidate_user(db, user_id)
     
     # Update products
     if entry_data.products is not None:
+        # Product rows live in another table, so mark the entry changed for delta sync
+        entry.updated_at = datetime.utcnow()
         print(f"DEBUG: Updating products for entry {entry_id}")
         print(f"DEBUG: entry_data.products={entry_data.products}")
-        # Delete existing products
-        deleted_count = db.query(ProductUsage).filter(
-            ProductUsage.entry_id == entry_id
-        ).delete()
-        print(f"DEBUG: Deleted {deleted_count} existing products")
+        # Delete existing products; the counters give back exactly the rows deleted
+        previous_products = db.execute(
+            delete(ProductUsage).where(ProductUsage.entry_id == entry_id).returning(ProductUsage.product_name)
+        ).scalars().all()
+        print(f"DEBUG: Deleted {len(previous_products)} existing products")
         
         # Add new products
         print(f"DEBUG: Adding {len(entry_data.products)} new products")
@@ -235,11 +388,17 @@ async def update_entry(
                 time_of_day=product.time_of_day
             )
             db.add(product_usage)
+        apply_product_usage(
+            db, user_id, entry.date,
+            added=[p.product_name for p in entry_data.products],
+            removed=previous_products,
+        )
         db.commit()
         print(f"DEBUG: Products committed to database")
     
     db.commit()
     db.refresh(entry)
+    primary_pins.pin(user_id)
     
     print(f"DEBUG: Updated entry analysis_result = {entry.analysis_result}")  # ← ADDED DEBUG
     
@@ -262,27 +421,33 @@ async def delete_entry(
     entry = db.query(SkinCareEntry).filter(
         SkinCareEntry.id == entry_id,
         SkinCareEntry.user_id == user_id
-    ).first()
+    ).with_for_update().first()
     
     if not entry:
         raise HTTPException(status_code=404, detail="Entry not found")
     
     # Delete associated products (cascade should handle this, but explicit is better)
-    db.query(ProductUsage).filter(
-        ProductUsage.entry_id == entry_id
+    removed_products = db.execute(
+        delete(ProductUsage).where(ProductUsage.entry_id == entry_id).returning(ProductUsage.product_name)
+    ).scalars().all()
+    apply_product_usage(db, user_id, entry.date, removed=removed_products)
+    
+    # Drop this entry's reference to its image; the blob goes with the last one
+    if entry.image_path:
+        release_image_reference(db, entry.image_path)
+    
+    # Leave a tombstone for delta sync, and prune ones past the retention window
+    db.add(EntryTombstone(entry_id=entry.id, user_id=user_id, date=entry.date))
+    db.query(EntryTombstone).filter(
+        EntryTombstone.user_id == user_id,
+        EntryTombstone.deleted_at < datetime.utcnow() - timedelta(days=TOMBSTONE_RETENTION_DAYS)
     ).delete()
     
-    # Delete the image file if it exists
-    if entry.image_path and os.path.exists(entry.image_path):
-        try:
-            os.remove(entry.image_path)
-            print(f"Deleted image file: {entry.image_path}")
-        except Exception as e:
-            print(f"Warning: Could not delete image file: {e}")
-    
-    # Delete the entry
+    # Delete the entry; committing removes a released image blob, so it runs in the threadpool
     db.delete(entry)
-    db.commit()
+    analytics_cache.invalidate_user(db, user_id)
+    await run_in_threadpool(db.commit)
+    primary_pins.pin(user_id)
     
     return {
         "message": "Entry deleted successfully",
@@ -309,21 +474,16 @@ async def upload_image(
     if not entry:
         raise HTTPException(status_code=404, detail="Entry not found")
     
-    # Create uploads directory if it doesn't exist
-    upload_dir = "uploads"
-    os.makedirs(upload_dir, exist_ok=True)
-    
-    # Save file
-    file_extension = file.filename.split(".")[-1]
-    filename = f"entry_{entry_id}_{datetime.now().timestamp()}.{file_extension}"
-    file_path = os.path.join(upload_dir, filename)
-    
-    with open(file_path, "wb") as buffer:
-        shutil.copyfileobj(file.file, buffer)
-    
-    # Update entry with relative path for frontend
-    entry.image_path = f"/uploads/{filename}"
-    db.commit()
+    # Images are stored once per content; identical photos share one blob.
+    # Storing and committing do blob store I/O, so they run in the threadpool
+    data = await file.read()
+    previous_image = entry.image_path
+    entry.image_path = await run_in_threadpool(add_image_reference, db, data, file.filename)
+    if previous_image:
+        release_image_reference(db, previous_image)
+    analytics_cache.invalidate_user(db, user_id)
+    await run_in_threadpool(db.commit)
+    primary_pins.pin(user_id)
     
     return {
         "message": "Image uploaded successfully",
@@ -332,13 +492,13 @@ async def upload_image(
 
 # Serve uploaded images
 @router.get("/uploads/{filename}")
-async def get_image(filename: str):
+async def get_image(filename: str, db: Session = Depends(get_db)):
     """
     Serve uploaded images
     """
-    file_path = os.path.join("uploads", filename)
+    response = serve_image(db, filename)
     
-    if not os.path.exists(file_path):
+    if response is None:
         raise HTTPException(status_code=404, detail="Image not found")
     
-    return FileResponse(file_path)
\ No newline at end of file
+    return response
@@ -0,0 +1,190 @@
+"""
+Local stand-ins for the AILabTools and Gemini APIs, for benchmarking the
+analysis and ingredient pipelines offline without spending API quota.
+
+One server answers both:
+    POST /api/portrait/analysis/skin-analysis          AILabTools skin analysis
+    POST /v1beta/models/{model}:generateContent        Gemini generate_content
+
+AILabTools results carry every field analysis_format reads, derived from a hash
+of the uploaded image so the same image always gets the same analysis. Gemini
+answers with a comma-separated ingredient list drawn from the lexicon.
+
+Latency is log-normal: --*-latency-ms is the median and --*-latency-sigma its
+spread (0.5 puts p99 near 3.2x the median). A fraction of requests (--*-error-rate)
+fail with --*-error-status, and --*-hang-rate of them stall for --hang-seconds
+to exercise client timeouts.
+
+Usage (from backend/):
+    python stub_upstreams.py [--port 8100] [--ailabtools-latency-ms 1500] [--gemini-error-rate 0.02]
+
+and point the app at it:
+    AILABTOOLS_API_URL=http://127.0.0.1:8100/api/portrait/analysis/skin-analysis
+    AILABTOOLS_API_KEY=stub
+    GEMINI_BASE_URL=http://127.0.0.1:8100
+    GEMINI_API_KEY=stub
+"""
+import argparse
+import asyncio
+import hashlib
+import math
+import random
+from dataclasses import dataclass
+
+from fastapi import FastAPI, File, UploadFile
+from fastapi.responses import ORJSONResponse
+
+from analysis_format import ANALYSIS_SPEC, SKIN_TYPES
+from ingredient_lexicon import LEXICON_FILES, load_lexicon
+
+# Gemini error bodies carry the gRPC-style status name alongside the code
+GEMINI_STATUS_NAMES = {
+    400: "INVALID_ARGUMENT",
+    429: "RESOURCE_EXHAUSTED",
+    500: "INTERNAL",
+    503: "UNAVAILABLE",
+    504: "DEADLINE_EXCEEDED",
+}
+
+
+@dataclass
+class StubProfile:
+    latency_ms: float = 1000.0
+    latency_sigma: float = 0.5
+    error_rate: float = 0.0
+    error_status: int = 503
+    hang_rate: float = 0.0
+
+    def sample_latency(self, rng):
+        if self.latency_ms <= 0:
+            return 0.0
+        return self.latency_ms / 1000 * math.exp(rng.gauss(0, self.latency_sigma))
+
+
+def skin_analysis_result(image_bytes):
+    """
+    An AILabTools-shaped response, deterministic per image
+    """
+    rng = random.Random(hashlib.sha256(image_bytes).digest())
+    result = {
+        "skin_type": {
+            "skin_type": rng.randrange(len(SKIN_TYPES)),
+            "details": [{"value": rng.randint(0, 1), "confidence": round(rng.random(), 3)} for _ in SKIN_TYPES],
+        },
+    }
+    for field, _, _ in ANALYSIS_SPEC:
+        result[field] = {"value": int(rng.random() < 0.3), "confidence": round(rng.uniform(0.5, 1), 3)}
+    return {
+        "request_id": f"stub-{rng.getrandbits(64):016x}",
+        "log_id": f"{rng.getrandbits(64):016x}",
+        "error_code": 0,
+        "error_code_str": "",
+        "error_msg": "",
+        "result": result,
+    }
+
+
+def gemini_response(model, text):
+    return {
+        "candidates": [{
+            "content": {"parts": [{"text": text}], "role": "model"},
+            "finishReason": "STOP",
+            "index": 0,
+        }],
+        "usageMetadata": {
+            "promptTokenCount": 280,
+            "candidatesTokenCount": len(text) // 4,
+            "totalTokenCount": 280 + len(text) // 4,
+        },
+        "modelVersion": model,
+    }
+
+
+def create_app(ailabtools, gemini, hang_seconds=120.0, seed=None):
+    app = FastAPI(title="Upstream stubs")
+    rng = random.Random(seed)
+    ingredients = sorted(load_lexicon(LEXICON_FILES["dictionary"]).values())
+    app.state.requests = {"ailabtools": 0, "gemini": 0}
+
+    async def behave(name, profile):
+        """
+        Wait out the sampled latency; returns an error status to answer with, or None
+        """
+        app.state.requests[name] += 1
+        if rng.random() < profile.hang_rate:
+            await asyncio.sleep(hang_seconds)
+        await asyncio.sleep(profile.sample_latency(rng))
+        if rng.random() < profile.error_rate:
+            return profile.error_status
+        return None
+
+    @app.post("/api/portrait/analysis/skin-analysis")
+    async def skin_analysis(image: UploadFile = File(...)):
+        image_bytes = await image.read()
+        status = await behave("ailabtools", ailabtools)
+        if status:
+            return ORJSONResponse(
+                {"error_code": status, "error_code_str": "STUB_ERROR", "error_msg": "Injected stub failure"},
+                status_code=status,
+            )
+        return ORJSONResponse(skin_analysis_result(image_bytes))
+
+    @app.post("/{version}/models/{model}:generateContent")
+    async def generate_content(version: str, model: str):
+        status = await behave("gemini", gemini)
+        if status:
+            return ORJSONResponse(
+                {"error": {
+                    "code": status,
+                    "message": "Injected stub failure",
+                    "status": GEMINI_STATUS_NAMES.get(status, "UNKNOWN"),
+                }},
+                status_code=status,
+            )
+        text = ", ".join(name.lower() for name in rng.sample(ingredients, min(rng.randint(12, 30), len(ingredients))))
+        return ORJSONResponse(gemini_response(model, text))
+
+    @app.get("/stub/stats")
+    async def stats():
+        return app.state.requests
+
+    return app
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8100)
+    parser.add_argument("--seed", type=int, default=None, help="seed latency and error sampling")
+    parser.add_argument("--hang-seconds", type=float, default=120.0)
+    for name, latency_ms in (("ailabtools", 1500.0), ("gemini", 2500.0)):
+        parser.add_argument(f"--{name}-latency-ms", type=float, default=latency_ms, help="median latency")
+        parser.add_argument(f"--{name}-latency-sigma", type=float, default=0.5)
+        parser.add_argument(f"--{name}-error-rate", type=float, default=0.0)
+        parser.add_argument(f"--{name}-error-status", type=int, default=503)
+        parser.add_argument(f"--{name}-hang-rate", type=float, default=0.0)
+    args = parser.parse_args()
+
+    profiles = {
+        name: StubProfile(
+            latency_ms=getattr(args, f"{name}_latency_ms"),
+            latency_sigma=getattr(args, f"{name}_latency_sigma"),
+            error_rate=getattr(args, f"{name}_error_rate"),
+            error_status=getattr(args, f"{name}_error_status"),
+            hang_rate=getattr(args, f"{name}_hang_rate"),
+        )
+        for name in ("ailabtools", "gemini")
+    }
+
+    import uvicorn
+
+    uvicorn.run(
+        create_app(profiles["ailabtools"], profiles["gemini"], args.hang_seconds, args.seed),
+        host=args.host,
+        port=args.port,
+        log_level="warning",
+    )
+
+
+if __name__ == "__main__":
+    main()
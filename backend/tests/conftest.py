@@ -0,0 +1,9 @@
+import os
+import sys
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# The backend's modules import each other flatly and read their data files
+# (ingredients/, uploads/) relative to backend/, as when the app runs from there
+sys.path.insert(0, BACKEND_DIR)
+os.chdir(BACKEND_DIR)
@@ -0,0 +1,120 @@
+import random
+
+import pytest
+
+from analysis_format import ANALYSIS_SPEC, format_analysis_result, is_generated_summary
+from backfill_analysis import classify
+
+
+def legacy_format_analysis_result(api_response):
+    # face_scan's formatter before the spec table, kept as the reference output
+    try:
+        if isinstance(api_response, dict) and 'result' in api_response:
+            data = api_response['result']
+            summary_parts = []
+            if 'skin_type' in data:
+                skin_types = ['Oily', 'Dry', 'Normal', 'Combination']
+                skin_type_value = data['skin_type'].get('skin_type', 2)
+                if 0 <= skin_type_value < len(skin_types):
+                    summary_parts.append(f"Skin Type: {skin_types[skin_type_value]}")
+            concerns = []
+            for field, label in (
+                ('acne', 'Acne'), ('eye_pouch', 'Eye Pouches'), ('dark_circle', 'Dark Circles'),
+                ('skin_spot', 'Skin Spots'), ('mole', 'Moles'), ('blackhead', 'Blackheads'),
+                ('forehead_wrinkle', 'Forehead Wrinkles'), ('crows_feet', "Crow's Feet"),
+                ('nasolabial_fold', 'Nasolabial Folds'),
+            ):
+                if data.get(field, {}).get('value') == 1:
+                    concerns.append(label)
+            if concerns:
+                summary_parts.append(f"Detected: {', '.join(concerns)}")
+            else:
+                summary_parts.append("No major concerns detected")
+            pore_areas = []
+            for field, label in (
+                ('pores_forehead', 'forehead'), ('pores_left_cheek', 'left cheek'),
+                ('pores_right_cheek', 'right cheek'), ('pores_jaw', 'jaw'),
+            ):
+                if data.get(field, {}).get('value') == 1:
+                    pore_areas.append(label)
+            if pore_areas:
+                summary_parts.append(f"Visible pores on: {', '.join(pore_areas)}")
+            if summary_parts:
+                return " | ".join(summary_parts)
+        return "Analysis completed successfully"
+    except Exception:
+        return "Analysis completed - see raw data for details"
+
+
+def random_payload(rng):
+    if rng.random() < 0.05:
+        return rng.choice([None, [], "text", {"error": "bad image"}])
+    data = {}
+    if rng.random() < 0.8:
+        data['skin_type'] = rng.choice([{"skin_type": rng.randint(-1, 5)}, {}, {"skin_type": "1"}, 3])
+    for field, _, _ in ANALYSIS_SPEC:
+        if rng.random() < 0.7:
+            data[field] = rng.choice([{"value": 1}, {"value": 0}, {"value": "1"}, {}, 1, None])
+    return {"result": data}
+
+
+def test_matches_legacy_formatter():
+    rng = random.Random(41)
+    for _ in range(20000):
+        payload = random_payload(rng)
+        assert format_analysis_result(payload) == legacy_format_analysis_result(payload), payload
+
+
+def test_summary_line():
+    payload = {"result": {
+        "skin_type": {"skin_type": 0},
+        "acne": {"value": 1},
+        "mole": {"value": 1},
+        "blackhead": {"value": 0},
+        "pores_jaw": {"value": 1},
+    }}
+    assert format_analysis_result(payload) == "Skin Type: Oily | Detected: Acne, Moles | Visible pores on: jaw"
+    assert format_analysis_result({"result": {}}) == "No major concerns detected"
+    assert format_analysis_result({}) == "Analysis completed successfully"
+
+
+def test_generated_summaries_are_recognised():
+    rng = random.Random(410)
+    for _ in range(2000):
+        assert is_generated_summary(format_analysis_result(random_payload(rng)))
+
+
+@pytest.mark.parametrize("text", [
+    "Skin Type: Dry | No major concerns detected",
+    "Detected: Crow's Feet, Nasolabial Folds | Visible pores on: forehead, left cheek",
+    '{"result": {"acne": {"value": 1}}}',
+    "Analysis completed successfully",
+])
+def test_generated_text(text):
+    assert is_generated_summary(text)
+
+
+@pytest.mark.parametrize("text", [
+    "Broke out after trying the new serum",
+    "Detected: Acne. Dermatologist says it's hormonal",
+    "Skin Type: Oily | Detected: Acne | felt tight today",
+    "Skin Type: Greasy | No major concerns detected",
+    "",
+])
+def test_user_text(text):
+    assert not is_generated_summary(text)
+
+
+def test_classify():
+    summary = "Skin Type: Oily | Detected: Acne"
+    assert classify(summary, summary) == "unchanged"
+    assert classify(None, summary) == "update"
+    assert classify("No major concerns detected", summary) == "update"
+    assert classify("my own notes", summary) == "conflict"
+    assert classify("my own notes", summary, overwrite=True) == "update"
+
+
+def test_malformed_result_is_logged(caplog):
+    assert format_analysis_result({"result": {"acne": 1}}) == "Analysis completed - see raw data for details"
+    assert caplog.records[-1].name == "analysis_format"
+    assert caplog.records[-1].exc_info is not None
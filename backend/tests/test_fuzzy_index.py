@@ -0,0 +1,104 @@
+import random
+import string
+
+from fuzzy_index import (
+    IngredientCorrector, SymmetricDeleteIndex, allowed_distance, edit_distance, generate_deletes,
+)
+
+LEXICONS = {
+    "dictionary": {
+        "glycerin": "Glycerin",
+        "niacinamide": "Niacinamide",
+        "sodium lauryl sulfate": "Sodium Lauryl Sulfate",
+        "sodium laureth sulfate": "Sodium Laureth Sulfate",
+        "aloe vera": "Aloe Vera",
+    },
+    "pore_clogging": {
+        "isopropyl myristate": "Isopropyl Myristate",
+        "coconut oil": "Coconut Oil",
+    },
+}
+
+
+def test_generate_deletes():
+    assert generate_deletes("abc", 1) == {"abc", "bc", "ac", "ab"}
+    assert "a" in generate_deletes("abc", 2)
+    # Single characters are never deleted down to the empty string
+    assert "" not in generate_deletes("ab", 2)
+
+
+def test_edit_distance_counts_transpositions_once():
+    assert edit_distance("glycerin", "glycerin", 2) == 0
+    assert edit_distance("glycerin", "glycrein", 2) == 1
+    assert edit_distance("glycerin", "glycerln", 2) == 1
+    assert edit_distance("glycerin", "gycerinn", 2) == 2
+    # Capped at max_distance + 1 once it is known to be further away
+    assert edit_distance("glycerin", "niacinamide", 2) == 3
+
+
+def brute_force_lookup(terms, text, max_distance):
+    candidates = [
+        (edit_distance(text, term, max_distance), -frequency, term)
+        for term, frequency in terms.items()
+    ]
+    candidates = [c for c in candidates if c[0] <= max_distance]
+    if not candidates:
+        return None
+    distance, _, term = min(candidates)
+    return term, distance
+
+
+def test_lookup_matches_brute_force():
+    rng = random.Random(32)
+    terms = {"".join(rng.choices("abcdef", k=rng.randint(3, 8))): rng.randint(1, 5) for _ in range(300)}
+    index = SymmetricDeleteIndex(terms, max_distance=2)
+    for _ in range(2000):
+        text = "".join(rng.choices("abcdefg", k=rng.randint(2, 9)))
+        assert index.lookup(text) == brute_force_lookup(terms, text, 2), text
+
+
+def test_lookup_prefers_frequent_terms_on_ties():
+    index = SymmetricDeleteIndex({"cat": 1, "car": 5}, max_distance=1)
+    assert index.lookup("caq") == ("car", 1)
+
+
+def test_lookup_respects_smaller_max_distance():
+    index = SymmetricDeleteIndex({"glycerin": 1}, max_distance=2)
+    assert index.lookup("glycerln", max_distance=0) is None
+    assert index.lookup("glycerln", max_distance=1) == ("glycerin", 1)
+    assert index.lookup("gycerinn", max_distance=1) is None
+
+
+def test_allowed_distance_scales_with_length():
+    assert allowed_distance("abc") == 0
+    assert allowed_distance("abcde") == 1
+    assert allowed_distance("abcdef") == 2
+
+
+def test_corrector_fixes_words_and_phrases_keeping_punctuation():
+    corrector = IngredientCorrector(LEXICONS)
+    tokens = "Aqua, Glycerln, Sodlum Laury1 Sulfate, Niacinamlde.".split()
+    assert corrector.correct_tokens(tokens) == ["Aqua,", "glycerin,", "sodium lauryl sulfate,", "niacinamide."]
+
+
+def test_corrector_phrases_do_not_span_a_comma():
+    corrector = IngredientCorrector(LEXICONS)
+    # Each word is still corrected on its own
+    assert corrector.correct_tokens(["Aloe,", "Vera"]) == ["aloe,", "vera"]
+    assert corrector.correct_tokens(["Aloe", "Vera,"]) == ["aloe vera,"]
+
+
+def test_corrector_passes_unknown_and_short_tokens_through():
+    corrector = IngredientCorrector(LEXICONS)
+    assert corrector.correct_tokens(["Xanthan", "oil"]) == ["Xanthan", "oil"]
+    assert corrector.correct_word("zzzzzzzz") is None
+
+
+def test_corrector_on_random_noise_never_invents_text():
+    corrector = IngredientCorrector(LEXICONS)
+    rng = random.Random(7)
+    vocabulary = {word for entries in LEXICONS.values() for name in entries for word in name.split()}
+    for _ in range(300):
+        tokens = ["".join(rng.choices(string.ascii_letters, k=rng.randint(1, 10))) for _ in range(4)]
+        for token, corrected in zip(tokens, corrector.correct_tokens(tokens)):
+            assert corrected == token or all(word in vocabulary for word in corrected.split())
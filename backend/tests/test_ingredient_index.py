@@ -0,0 +1,105 @@
+import random
+import string
+
+import pytest
+
+import ingredient_index
+from fuzzy_index import IngredientCorrector
+from ingredient_index import IngredientIndex, build_index, load_ingredient_index
+from ingredient_lexicon import lexicon_version, load_lexicons
+from ingredient_matcher import IngredientMatcher
+from product_compatibility import CompatibilityIndex
+
+
+@pytest.fixture(scope="module")
+def lexicons():
+    return load_lexicons()
+
+
+@pytest.fixture(scope="module")
+def index(lexicons, tmp_path_factory):
+    path = tmp_path_factory.mktemp("index") / "ingredient_index.bin"
+    build_index(str(path), lexicons, "test-version")
+    return IngredientIndex(str(path))
+
+
+def garble(rng, name):
+    # OCR-style noise: dropped, doubled, swapped and misread characters
+    chars = list(name)
+    for _ in range(rng.randint(0, 3)):
+        if not chars:
+            break
+        i = rng.randrange(len(chars))
+        edit = rng.random()
+        if edit < 0.25:
+            del chars[i]
+        elif edit < 0.5:
+            chars.insert(i, chars[i])
+        elif edit < 0.75 and i + 1 < len(chars):
+            chars[i], chars[i + 1] = chars[i + 1], chars[i]
+        else:
+            chars[i] = rng.choice(string.ascii_lowercase + "1l0-")
+    return "".join(chars)
+
+
+def garbled_texts(lexicons, count, seed):
+    rng = random.Random(seed)
+    names = sorted({display for entries in lexicons.values() for display in entries.values()})
+    texts = []
+    for _ in range(count):
+        parts = [garble(rng, rng.choice(names)) for _ in range(rng.randint(1, 8))]
+        if rng.random() < 0.3:
+            parts.append("".join(rng.choices(string.ascii_letters, k=rng.randint(1, 12))))
+        texts.append(rng.choice([", ", ",", " ", " / ", "\n"]).join(parts))
+    return texts
+
+
+def test_index_carries_the_lexicons(lexicons, index):
+    assert index.lexicons == lexicons
+    assert index.lexicon_version == "test-version"
+    assert index.max_distance == 2
+
+
+def test_mapped_indexes_match_in_process_ones(lexicons, index):
+    corrector, mapped_corrector = IngredientCorrector(lexicons), IngredientCorrector.from_index(index)
+    matcher, mapped_matcher = IngredientMatcher(lexicons), IngredientMatcher.from_index(index)
+    for text in garbled_texts(lexicons, 3000, seed=48):
+        tokens = text.split()
+        corrected = corrector.correct_tokens(tokens)
+        assert mapped_corrector.correct_tokens(tokens) == corrected, text
+        assert mapped_matcher.find(" ".join(corrected)) == matcher.find(" ".join(corrected)), text
+        assert mapped_matcher.find(text) == matcher.find(text), text
+
+
+def test_compatibility_scores_match(lexicons, index):
+    products = [text.split(", ") for text in garbled_texts(lexicons, 500, seed=480)]
+    assert CompatibilityIndex(index.lexicons).score_products(products) == CompatibilityIndex(lexicons).score_products(products)
+
+
+def test_rebuild_replaces_the_file_atomically(lexicons, tmp_path):
+    path = str(tmp_path / "ingredient_index.bin")
+    build_index(path, lexicons, "old")
+    old = IngredientIndex(path)
+    build_index(path, {"dictionary": {"glycerin": "Glycerin"}}, "new")
+    # A reader holding the old mapping keeps a consistent view
+    assert old.lexicons == lexicons
+    assert IngredientIndex(path).lexicons == {"dictionary": {"glycerin": "Glycerin"}}
+    assert old.identity != IngredientIndex(path).identity
+    assert [p.name for p in tmp_path.iterdir()] == ["ingredient_index.bin"]
+
+
+def test_load_ignores_stale_and_missing_indexes(lexicons, tmp_path, monkeypatch):
+    monkeypatch.setattr(ingredient_index, "_loaded", None)
+    path = str(tmp_path / "ingredient_index.bin")
+    assert load_ingredient_index(path) is None
+    build_index(path, lexicons, "stale")
+    assert load_ingredient_index(path) is None
+    build_index(path, lexicons, lexicon_version())
+    assert load_ingredient_index(path).lexicon_version == lexicon_version()
+
+
+def test_load_rejects_other_files(tmp_path, monkeypatch):
+    monkeypatch.setattr(ingredient_index, "_loaded", None)
+    path = tmp_path / "ingredient_index.bin"
+    path.write_bytes(b"not an index at all")
+    assert load_ingredient_index(str(path)) is None
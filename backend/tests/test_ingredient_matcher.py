@@ -0,0 +1,49 @@
+from ingredient_matcher import IngredientMatcher
+
+LEXICONS = {
+    "dictionary": {
+        "sodium": "Sodium",
+        "sodium lauryl sulfate": "Sodium Lauryl Sulfate",
+        "laureth 4": "Laureth-4",
+        "glycerin": "Glycerin",
+    },
+    "drying_skin": {"sodium lauryl sulfate": "Sodium Lauryl Sulfate"},
+}
+
+
+def names(matches):
+    return [match["ingredient"] for match in matches]
+
+
+def test_longest_name_wins():
+    matcher = IngredientMatcher(LEXICONS)
+    text = "Aqua, Sodium Lauryl Sulfate, Sodium Chloride"
+    matches = matcher.find(text)
+    assert names(matches) == ["sodium lauryl sulfate", "sodium"]
+    assert text[matches[0]["start"]:matches[0]["end"]] == "Sodium Lauryl Sulfate"
+    assert matches[0]["display_name"] == "Sodium Lauryl Sulfate"
+    assert matches[0]["lexicons"] == ["dictionary", "drying_skin"]
+
+
+def test_falls_back_to_a_shorter_name():
+    matcher = IngredientMatcher(LEXICONS)
+    assert names(matcher.find("Sodium Lauryl Glucoside")) == ["sodium"]
+
+
+def test_matches_do_not_span_separators():
+    matcher = IngredientMatcher(LEXICONS)
+    for text in ("Sodium, Lauryl Sulfate", "Sodium (Lauryl) Sulfate", "Sodium / Lauryl Sulfate", "Sodium\nLauryl Sulfate"):
+        assert names(matcher.find(text)) == ["sodium"], text
+
+
+def test_hyphens_and_case_do_not_break_a_match():
+    matcher = IngredientMatcher(LEXICONS)
+    text = "GLYCERIN, Laureth-4, sodium  lauryl   SULFATE"
+    matches = matcher.find(text)
+    assert names(matches) == ["glycerin", "laureth 4", "sodium lauryl sulfate"]
+    assert [text[m["start"]:m["end"]] for m in matches] == ["GLYCERIN", "Laureth-4", "sodium  lauryl   SULFATE"]
+
+
+def test_words_inside_longer_tokens_do_not_match():
+    matcher = IngredientMatcher(LEXICONS)
+    assert matcher.find("Polyglycerin-3, Sodiumhydroxide") == []
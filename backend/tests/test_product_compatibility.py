@@ -0,0 +1,93 @@
+import json
+import random
+
+from ingredient_lexicon import FLAG_LEXICONS, ingredient_tokens
+from product_compatibility import CompatibilityIndex
+
+LEXICONS = {
+    "dictionary": {"glycerin": "Glycerin", "aqua": "Aqua"},
+    "drying_skin": {"alcohol denat": "Alcohol Denat", "sodium lauryl sulfate": "Sodium Lauryl Sulfate"},
+    "pore_clogging": {"coconut oil": "Coconut Oil", "isopropyl myristate": "Isopropyl Myristate"},
+}
+
+
+def naive_matches(lexicons, ingredient):
+    # Word-boundary containment, checked pattern by pattern
+    tokens = " " + " ".join(ingredient_tokens(ingredient)) + " "
+    return {
+        (" ".join(ingredient_tokens(name)), lexicon)
+        for lexicon in FLAG_LEXICONS
+        for name in lexicons[lexicon]
+        if " " + " ".join(ingredient_tokens(name)) + " " in tokens
+    }
+
+
+def test_scores_a_product():
+    index = CompatibilityIndex(LEXICONS)
+    [result] = index.score_products([["Aqua", "Glycerin", "Cocos Nucifera Oil", "Coconut Oil", "Alcohol Denat."]])
+    assert result["score"] == 60.0
+    assert result["total_ingredients"] == 5
+    assert result["flagged_count"] == 2
+    assert result["flag_counts"] == {"drying_skin": 1, "pore_clogging": 1}
+    assert [o["ingredient"] for o in result["offending_ingredients"]] == ["Coconut Oil", "Alcohol Denat."]
+    assert result["offending_ingredients"][0]["matches"] == [{"pattern": "coconut oil", "lexicon": "pore_clogging"}]
+
+
+def test_patterns_match_on_word_boundaries_only():
+    index = CompatibilityIndex(LEXICONS)
+    assert index.decode(index.encode("Sodium Lauryl Sulfate")) == (("sodium lauryl sulfate", "drying_skin"),)
+    assert index.decode(index.encode("Sodium Laureth Sulfate")) == ()
+    assert index.decode(index.encode("Coconut Oils")) == ()
+
+
+def test_empty_product_scores_100():
+    index = CompatibilityIndex(LEXICONS)
+    [result] = index.score_products([[]])
+    assert result["score"] == 100.0
+    assert result["flagged_count"] == 0
+    assert result["offending_ingredients"] == []
+
+
+def test_results_are_plain_python_values():
+    index = CompatibilityIndex(LEXICONS)
+    results = index.score_products([["Coconut Oil"], [], ["Aqua"]])
+    assert all(type(result["score"]) is float for result in results)
+    assert all(type(result["flagged_count"]) is int for result in results)
+    json.dumps(results)
+
+
+def test_batch_matches_naive_scoring():
+    rng = random.Random(33)
+    vocabulary = ["alcohol", "denat", "coconut", "oil", "sodium", "lauryl", "sulfate", "aqua", "extract", "myristate"]
+    # Enough patterns to span several 64-bit words
+    lexicons = {
+        "dictionary": {},
+        "drying_skin": {f"drying {i} {rng.choice(vocabulary)}": "" for i in range(80)},
+        "pore_clogging": {f"{rng.choice(vocabulary)} clog {i}": "" for i in range(80)},
+    }
+    names = [name for lexicon in FLAG_LEXICONS for name in lexicons[lexicon]]
+    index = CompatibilityIndex(lexicons)
+    assert index.n_words > 1
+
+    products = []
+    for _ in range(200):
+        product = []
+        for _ in range(rng.randint(0, 12)):
+            words = rng.choices(vocabulary, k=rng.randint(1, 3))
+            if rng.random() < 0.3:
+                words.insert(rng.randint(0, len(words)), rng.choice(names))
+            product.append(" ".join(words).title())
+        products.append(product)
+
+    for product, result in zip(products, index.score_products(products)):
+        flagged = [ingredient for ingredient in product if naive_matches(lexicons, ingredient)]
+        assert result["flagged_count"] == len(flagged)
+        assert result["score"] == (100.0 if not product else 100 * (1 - len(flagged) / len(product)))
+        for lexicon in FLAG_LEXICONS:
+            assert result["flag_counts"][lexicon] == sum(
+                any(name == lexicon for _, name in naive_matches(lexicons, ingredient)) for ingredient in product
+            )
+        for offending in result["offending_ingredients"]:
+            assert {(m["pattern"], m["lexicon"]) for m in offending["matches"]} == naive_matches(
+                lexicons, offending["ingredient"]
+            )
@@ -0,0 +1,159 @@
+import os
+import random
+from datetime import date, timedelta
+
+import pytest
+from sqlalchemy import create_engine, text
+
+from product_usage_counters import (
+    APPLY_DELTAS_SQL, DELETE_EMPTY_SQL, apply_product_usage, count_products, rebuild_product_usage_counters,
+    top_products,
+)
+
+
+class RecordingSession:
+    """
+    Records the statements apply_product_usage runs instead of executing them
+    """
+
+    def __init__(self):
+        self.statements = []
+
+    def execute(self, statement, params=None):
+        self.statements.append((statement.text, params))
+
+
+def deltas(session):
+    sql, params = session.statements[0]
+    assert sql == APPLY_DELTAS_SQL
+    return {name: (delta, display) for name, display, delta in zip(params["names"], params["display_names"], params["deltas"])}
+
+
+def test_count_products_normalizes_names():
+    assert count_products(["CeraVe Cleanser", " cerave  cleanser ", "SPF 50", "", "   "]) == {
+        "cerave cleanser": (2, " cerave  cleanser "),
+        "spf 50": (1, "SPF 50"),
+    }
+
+
+def test_new_entry_adds_uses():
+    session = RecordingSession()
+    apply_product_usage(session, 1, date(2024, 5, 1), added=["Toner", "toner", "Retinol"])
+    assert deltas(session) == {"retinol": (1, "Retinol"), "toner": (2, "toner")}
+    assert len(session.statements) == 1
+    assert session.statements[0][1]["names"] == ["retinol", "toner"]
+
+
+def test_update_applies_only_the_difference():
+    session = RecordingSession()
+    apply_product_usage(session, 1, date(2024, 5, 1), added=["Toner", "SPF 50"], removed=["toner", "Retinol", "Retinol"])
+    # The unchanged product keeps its counter (and display name) untouched
+    assert deltas(session) == {"retinol": (-2, "Retinol"), "spf 50": (1, "SPF 50")}
+    sql, params = session.statements[1]
+    assert sql == DELETE_EMPTY_SQL
+    assert params == {"user_id": 1, "day": date(2024, 5, 1), "names": ["retinol", "spf 50"]}
+
+
+def test_no_change_runs_nothing():
+    session = RecordingSession()
+    apply_product_usage(session, 1, date(2024, 5, 1), added=["Toner"], removed=["TONER"])
+    apply_product_usage(session, 1, date(2024, 5, 1))
+    assert session.statements == []
+
+
+def test_random_deltas_add_up():
+    rng = random.Random(50)
+    names = ["CeraVe Cleanser", "cerave cleanser", "Retinol", "SPF 50", "spf  50", "Toner", ""]
+    for _ in range(500):
+        before = [rng.choice(names) for _ in range(rng.randint(0, 5))]
+        after = [rng.choice(names) for _ in range(rng.randint(0, 5))]
+        counters = {name: uses for name, (uses, _) in count_products(before).items()}
+        session = RecordingSession()
+        apply_product_usage(session, 1, date(2024, 5, 1), added=after, removed=before)
+        if session.statements:
+            for name, (delta, _) in deltas(session).items():
+                assert delta != 0
+                counters[name] = counters.get(name, 0) + delta
+        expected = {name: uses for name, (uses, _) in count_products(after).items()}
+        assert {name: uses for name, uses in counters.items() if uses} == expected
+
+
+# The workload below runs the entry endpoints against a real database; point
+# TEST_DATABASE_URL at a disposable one, its tables are created and emptied
+TEST_DATABASE_URL = os.getenv("TEST_DATABASE_URL")
+
+
+@pytest.fixture
+def database(monkeypatch):
+    if not TEST_DATABASE_URL:
+        pytest.skip("TEST_DATABASE_URL is not set")
+    import db_conn
+    import models
+
+    engine = create_engine(TEST_DATABASE_URL)
+    models.Base.metadata.create_all(engine)
+    with engine.begin() as conn:
+        conn.execute(text(
+            "TRUNCATE users, skincare_entries, product_usage, product_usage_daily, entry_tombstones "
+            "RESTART IDENTITY CASCADE"
+        ))
+        conn.execute(text(
+            "INSERT INTO users (id, username, email, hashed_password, created_at, is_verified) "
+            "VALUES (1, 'test', 'test@example.com', 'x', now(), true)"
+        ))
+    binds = db_conn.SessionLocal.kw["bind"], db_conn.ReadSessionLocal.kw["bind"]
+    monkeypatch.setattr(db_conn, "engine", engine)
+    monkeypatch.setattr(db_conn, "read_engine", engine)
+    db_conn.SessionLocal.configure(bind=engine)
+    db_conn.ReadSessionLocal.configure(bind=engine)
+    yield engine
+    db_conn.SessionLocal.configure(bind=binds[0])
+    db_conn.ReadSessionLocal.configure(bind=binds[1])
+    engine.dispose()
+
+
+def test_counters_match_a_rebuild_after_random_edits(database):
+    from fastapi.testclient import TestClient
+
+    import main
+
+    client = TestClient(main.app)
+    rng = random.Random(500)
+    today = date.today()
+    names = ["CeraVe Cleanser", "cerave cleanser", "Retinol", "SPF 50", "spf  50", "Toner", "Vitamin C", "Niacinamide"]
+    entry_ids = {}
+
+    def products():
+        return [{"product_name": rng.choice(names)} for _ in range(rng.randint(0, 5))]
+
+    for _ in range(200):
+        day = today - timedelta(days=rng.randrange(60))
+        if day not in entry_ids:
+            response = client.post("/skincare/entries", json={"date": str(day), "products": products()})
+            assert response.status_code == 200, response.text
+            entry_ids[day] = response.json()["id"]
+        elif rng.random() < 0.3:
+            assert client.delete(f"/skincare/entries/{entry_ids.pop(day)}").status_code == 200
+        else:
+            response = client.put(f"/skincare/entries/{entry_ids[day]}", json={"products": products()})
+            assert response.status_code == 200, response.text
+
+    def counters():
+        with database.connect() as conn:
+            return sorted(map(tuple, conn.execute(text(
+                "SELECT user_id, date, product_name, uses FROM product_usage_daily"
+            ))))
+
+    live = counters()
+    rebuild_product_usage_counters(database)
+    assert counters() == live
+
+    start = today - timedelta(days=29)
+    with database.connect() as conn:
+        grouped = conn.execute(text(
+            "SELECT lower(btrim(regexp_replace(p.product_name, '\\s+', ' ', 'g'))) AS name, count(*) AS uses "
+            "FROM product_usage p JOIN skincare_entries e ON e.id = p.entry_id "
+            "WHERE e.user_id = 1 AND e.date >= :start GROUP BY 1 ORDER BY 2 DESC, 1"
+        ), {"start": start}).all()
+        top = top_products(conn, 1, start, today, limit=len(names))
+    assert [uses for _, uses in top] == [row.uses for row in grouped]
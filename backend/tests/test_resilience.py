@@ -0,0 +1,157 @@
+import pytest
+
+import resilience
+from resilience import (
+    CLOSED, HALF_OPEN, OPEN, CircuitBreaker, CircuitOpen, RateLimited, TokenBucket, UpstreamHTTPError,
+    UpstreamPolicy,
+)
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(resilience.time, "monotonic", clock.monotonic)
+    monkeypatch.setattr(resilience.time, "sleep", clock.sleep)
+    return clock
+
+
+def test_token_bucket_serves_a_burst_then_queues(clock):
+    bucket = TokenBucket(rate=2.0, burst=3)
+    assert [bucket.reserve(max_wait=10) for _ in range(3)] == [0.0, 0.0, 0.0]
+    # Reservations are made ahead, so waiting callers queue up in order
+    assert bucket.reserve(max_wait=10) == pytest.approx(0.5)
+    assert bucket.reserve(max_wait=10) == pytest.approx(1.0)
+
+
+def test_token_bucket_refuses_waits_past_max_wait_without_taking_a_token(clock):
+    bucket = TokenBucket(rate=1.0, burst=1)
+    assert bucket.reserve(max_wait=0) == 0.0
+    assert bucket.reserve(max_wait=0.5) is None
+    assert bucket.reserve(max_wait=1.0) == pytest.approx(1.0)
+
+
+def test_token_bucket_refills_up_to_burst(clock):
+    bucket = TokenBucket(rate=1.0, burst=2)
+    bucket.reserve(max_wait=0)
+    bucket.reserve(max_wait=0)
+    clock.now += 60
+    assert [bucket.reserve(max_wait=0) for _ in range(3)] == [0.0, 0.0, None]
+
+
+def test_token_bucket_without_a_rate_never_waits(clock):
+    bucket = TokenBucket(rate=0, burst=1)
+    assert all(bucket.reserve(max_wait=0) == 0.0 for _ in range(100))
+
+
+def test_breaker_opens_after_consecutive_failures(clock):
+    breaker = CircuitBreaker("test", failure_threshold=3, reset_timeout=30)
+    breaker.record_failure()
+    breaker.record_failure()
+    breaker.record_success()
+    breaker.record_failure()
+    breaker.record_failure()
+    assert breaker.state == CLOSED and breaker.allow()
+    breaker.record_failure()
+    assert breaker.state == OPEN
+    assert not breaker.allow()
+    assert breaker.retry_after() == pytest.approx(30)
+
+
+def test_breaker_half_open_lets_one_trial_through(clock):
+    breaker = CircuitBreaker("test", failure_threshold=1, reset_timeout=30)
+    breaker.record_failure()
+    clock.now += 30
+    assert breaker.allow()
+    assert breaker.state == HALF_OPEN
+    assert not breaker.allow()
+    breaker.record_success()
+    assert breaker.state == CLOSED
+    assert breaker.allow() and breaker.allow()
+
+
+def test_breaker_failed_trial_reopens(clock):
+    breaker = CircuitBreaker("test", failure_threshold=1, reset_timeout=30)
+    breaker.record_failure()
+    clock.now += 30
+    assert breaker.allow()
+    breaker.record_failure()
+    assert breaker.state == OPEN
+    assert breaker.retry_after() == pytest.approx(30)
+
+
+def test_breaker_release_frees_the_trial(clock):
+    breaker = CircuitBreaker("test", failure_threshold=1, reset_timeout=30)
+    breaker.record_failure()
+    clock.now += 30
+    assert breaker.allow()
+    breaker.release()
+    assert breaker.state == HALF_OPEN and breaker.allow()
+
+
+def policy(**overrides):
+    settings = dict(rate_per_sec=0, burst=1, attempt_timeout=5, deadline=30, max_attempts=3,
+                    breaker_failures=2, breaker_reset=60)
+    settings.update(overrides)
+    return UpstreamPolicy("test", **settings)
+
+
+def test_call_retries_transient_failures(clock):
+    outcomes = [TimeoutError("slow"), UpstreamHTTPError("busy", 503), "ok"]
+    retries = []
+
+    def attempt(timeout):
+        outcome = outcomes.pop(0)
+        if isinstance(outcome, Exception):
+            raise outcome
+        return outcome
+
+    assert policy(breaker_failures=5).call(attempt, on_retry=lambda n, reason: retries.append(reason)) == "ok"
+    assert retries == ["TimeoutError", "503"]
+
+
+def test_call_does_not_retry_rejected_requests(clock):
+    calls = []
+
+    def attempt(timeout):
+        calls.append(timeout)
+        raise UpstreamHTTPError("bad request", 400)
+
+    upstream = policy()
+    with pytest.raises(UpstreamHTTPError):
+        upstream.call(attempt)
+    assert len(calls) == 1
+    assert upstream.breaker.state == CLOSED
+
+
+def test_call_fails_fast_while_the_breaker_is_open(clock):
+    upstream = policy(max_attempts=1)
+
+    def attempt(timeout):
+        raise ConnectionError("down")
+
+    for _ in range(2):
+        with pytest.raises(ConnectionError):
+            upstream.call(attempt)
+    with pytest.raises(CircuitOpen) as error:
+        upstream.call(attempt)
+    assert error.value.retry_after == pytest.approx(60)
+
+
+def test_call_rejects_when_the_rate_limit_outlasts_the_deadline(clock):
+    upstream = policy(rate_per_sec=0.01, burst=1, deadline=10)
+    assert upstream.call(lambda timeout: "ok") == "ok"
+    with pytest.raises(RateLimited):
+        upstream.call(lambda timeout: "ok")
+    # The rejected call gave back nothing it had taken
+    assert upstream.breaker.state == CLOSED and not upstream.breaker.trial_in_flight
@@ -0,0 +1,130 @@
+import pytest
+from sqlalchemy import create_engine, text
+from sqlalchemy.orm import Session
+
+from response_cache import CacheBackend, LRUCacheBackend, ResponseCache
+
+
+@pytest.fixture
+def engine(tmp_path):
+    # SQLite runs the same version upsert as Postgres
+    engine = create_engine(f"sqlite:///{tmp_path / 'cache.db'}")
+    with engine.begin() as conn:
+        conn.execute(text("CREATE TABLE analytics_versions (user_id INTEGER PRIMARY KEY, version INTEGER NOT NULL)"))
+    yield engine
+    engine.dispose()
+
+
+@pytest.fixture
+def db(engine):
+    with Session(engine) as session:
+        yield session
+
+
+def make_cache(max_entries=16):
+    return ResponseCache(LRUCacheBackend(max_entries))
+
+
+def write(engine, cache, user_id):
+    with Session(engine) as session:
+        cache.invalidate_user(session, user_id)
+        session.commit()
+
+
+def counting(value):
+    calls = []
+
+    def compute():
+        calls.append(value)
+        return value
+
+    return compute, calls
+
+
+def test_hit_after_miss(db):
+    cache = make_cache()
+    compute, calls = counting({"total": 1})
+    assert cache.get_or_compute(db, 1, "overview", {"days": 30}, compute) == {"total": 1}
+    assert cache.get_or_compute(db, 1, "overview", {"days": 30}, compute) == {"total": 1}
+    assert len(calls) == 1
+    assert cache.stats()["overview"] == {"hits": 1, "misses": 1, "hit_ratio": 0.5}
+
+
+def test_params_are_part_of_the_key_regardless_of_order(db):
+    cache = make_cache()
+    compute, calls = counting("x")
+    cache.get_or_compute(db, 1, "overview", {"days": 30, "granularity": "week"}, compute)
+    cache.get_or_compute(db, 1, "overview", {"granularity": "week", "days": 30}, compute)
+    cache.get_or_compute(db, 1, "overview", {"days": 7, "granularity": "week"}, compute)
+    assert len(calls) == 2
+
+
+def test_invalidate_user_only_affects_that_user(engine, db):
+    cache = make_cache()
+    compute, calls = counting("x")
+    cache.get_or_compute(db, 1, "overview", {}, compute)
+    cache.get_or_compute(db, 2, "overview", {}, compute)
+    write(engine, cache, 1)
+    cache.get_or_compute(db, 1, "overview", {}, compute)
+    cache.get_or_compute(db, 2, "overview", {}, compute)
+    assert len(calls) == 3
+
+
+def test_write_in_another_worker_invalidates(engine, db):
+    # Two workers: separate in-process caches sharing the database
+    worker_a, worker_b = make_cache(), make_cache()
+    compute, calls = counting("x")
+    worker_a.get_or_compute(db, 1, "overview", {}, compute)
+    write(engine, worker_b, 1)
+    worker_a.get_or_compute(db, 1, "overview", {}, compute)
+    assert len(calls) == 2
+
+
+def test_rolled_back_write_keeps_the_version(engine, db):
+    cache = make_cache()
+    with Session(engine) as session:
+        cache.invalidate_user(session, 1)
+        session.rollback()
+    assert cache.get_version(db, 1) == 0
+
+
+def test_write_during_compute_is_not_served_afterwards(engine, db):
+    cache = make_cache()
+
+    def compute_racing_a_write():
+        # The version was read before computing; a write lands mid-computation
+        write(engine, cache, 1)
+        return "stale"
+
+    assert cache.get_or_compute(db, 1, "overview", {}, compute_racing_a_write) == "stale"
+    db.rollback()
+    compute, calls = counting("fresh")
+    assert cache.get_or_compute(db, 1, "overview", {}, compute) == "fresh"
+    assert calls == ["fresh"]
+
+
+def test_lru_evicts_least_recently_used():
+    backend = LRUCacheBackend(max_entries=2)
+    backend.set("a", 1)
+    backend.set("b", 2)
+    assert backend.get("a") == 1
+    backend.set("c", 3)
+    assert backend.get("b") is None
+    assert backend.get("a") == 1
+    assert backend.get("c") == 3
+
+
+def test_clear_drops_entries():
+    backend = LRUCacheBackend()
+    backend.set("a", 1)
+    backend.clear()
+    assert backend.get("a") is None
+
+
+def test_incomplete_backend_cannot_be_constructed():
+    class GetOnly(CacheBackend):
+        def get(self, key):
+            return None
+
+    with pytest.raises(TypeError):
+        GetOnly()
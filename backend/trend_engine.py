@@ -0,0 +1,113 @@
+"""
+Skin concern trends computed in Postgres with window functions.
+
+For every day with an AI analysis, each concern is flagged from keywords in the
+analysis text. Rolling concern rates over a short and a long window (7 and 30
+days by default) come from RANGE window frames, and the trend of each concern
+is the least-squares slope (regr_slope) of its daily flag over the period.
+"""
+from datetime import timedelta
+
+from sqlalchemy import text
+
+# Keywords (matched case-insensitively as substrings) that mark each concern
+CONCERN_KEYWORDS = {
+    'acne': ['acne', 'breakout', 'pimple', 'blemish'],
+    'dark_circles': ['dark circle', 'under eye'],
+    'wrinkles': ['wrinkle', 'fine line', 'crow'],
+    'spots': ['spot', 'pigment', 'hyperpigment'],
+    'pores': ['pore', 'enlarged pore']
+}
+
+DEFAULT_SHORT_WINDOW = 7
+DEFAULT_LONG_WINDOW = 30
+
+# A fitted change in score smaller than this over the period counts as stable
+STABLE_CHANGE_POINTS = 5
+
+
+def _trend_sql(concerns):
+    flags = ",\n        ".join(
+        f"max((lower(analysis_result) LIKE ANY(:kw_{c}))::int) AS {c}" for c in concerns
+    )
+    rolling = ",\n        ".join(
+        f"avg({c}) OVER short_window AS {c}_short, avg({c}) OVER long_window AS {c}_long" for c in concerns
+    )
+    series = ",\n    ".join(
+        f"{c}_short, {c}_long, regr_slope({c}, day) OVER () AS {c}_slope" for c in concerns
+    )
+    # Rows from before start_date only warm up the rolling windows; the final
+    # WHERE runs before the OVER () slopes, so those cover the period alone
+    return f"""
+WITH daily AS (
+    SELECT date,
+        {flags}
+    FROM skincare_entries
+    WHERE user_id = :user_id
+      AND analysis_result IS NOT NULL
+      AND date BETWEEN :warmup_date AND :end_date
+    GROUP BY date
+),
+rolling AS (
+    SELECT date, date - :start_date AS day, {", ".join(concerns)},
+        {rolling}
+    FROM daily
+    WINDOW short_window AS (ORDER BY date RANGE BETWEEN make_interval(days => :short_window - 1) PRECEDING AND CURRENT ROW),
+           long_window AS (ORDER BY date RANGE BETWEEN make_interval(days => :long_window - 1) PRECEDING AND CURRENT ROW)
+)
+SELECT date,
+    {series}
+FROM rolling
+WHERE date >= :start_date
+ORDER BY date
+"""
+
+
+def compute_concern_trends(db, user_id, start_date, end_date,
+                           short_window=DEFAULT_SHORT_WINDOW, long_window=DEFAULT_LONG_WINDOW):
+    """
+    Returns (series, metrics): the rolling rates per analysed day, and per
+    concern the latest rates, fitted slope and trend. Both are empty when
+    there are no analyses in the period.
+    """
+    concerns = list(CONCERN_KEYWORDS)
+    params = {
+        "user_id": user_id,
+        "start_date": start_date,
+        "end_date": end_date,
+        "warmup_date": start_date - timedelta(days=long_window - 1),
+        "short_window": short_window,
+        "long_window": long_window,
+        **{f"kw_{c}": [f"%{keyword}%" for keyword in CONCERN_KEYWORDS[c]] for c in concerns}
+    }
+    rows = db.execute(text(_trend_sql(concerns)), params).mappings().all()
+    if not rows:
+        return [], {}
+
+    series = [
+        {
+            "date": str(row["date"]),
+            "rates": {
+                c: {"short": round(float(row[f"{c}_short"]), 3), "long": round(float(row[f"{c}_long"]), 3)}
+                for c in concerns
+            }
+        }
+        for row in rows
+    ]
+
+    period_days = (end_date - start_date).days
+    latest = rows[-1]
+    metrics = {}
+    for c in concerns:
+        slope = latest[f"{c}_slope"] or 0.0  # NULL with fewer than two analysed days
+        # Concerns are bad, so a falling rate is a rising score
+        change = -slope * period_days * 100
+        metrics[c] = {
+            "current": round(max(0, 100 - float(latest[f"{c}_short"]) * 100)),
+            "change": round(change),
+            "trend": "stable" if abs(change) < STABLE_CHANGE_POINTS else "improving" if change > 0 else "worsening",
+            "short_rate": round(float(latest[f"{c}_short"]), 3),
+            "long_rate": round(float(latest[f"{c}_long"]), 3),
+            "slope_per_week": round(slope * 7, 4)
+        }
+    return series, metrics